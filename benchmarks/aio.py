@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""Latency of the asyncio API under concurrent load.
+
+Converts every document of tests/ttml-documents (or the given ones)
+-n times over, all at once, while a heartbeat task measures how late the
+event loop wakes it up. Run once per mode:
+
+    inline      Ttml2Srt() called straight from the coroutines, as a
+                service not using ttml2srt_aio would
+    threads     AsyncConverter on a thread pool
+    processes   AsyncConverter on a process pool
+
+Prints conversion latency and event loop lag percentiles for each mode.
+
+    python benchmarks/aio.py [-n copies] [-j workers]
+        [--max-concurrency N] [--modes inline,threads]
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import os
+import sys
+import time
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(
+    os.path.realpath(__file__)), '..'))
+sys.path.insert(0, ROOT)
+
+from ttml2srt import Ttml2Srt
+from ttml2srt_aio import AsyncConverter
+
+SAMPLE_DIR = os.path.join(ROOT, 'tests', 'ttml-documents')
+
+MODES = ('inline', 'threads', 'processes')
+
+# Heartbeat period (s)
+TICK = 0.005
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+async def heartbeat(lags, done):
+    clock = time.perf_counter
+    while not done.is_set():
+        started = clock()
+        await asyncio.sleep(TICK)
+        lags.append(clock() - started - TICK)
+
+
+async def convert_inline(path):
+    return Ttml2Srt(path).paragraphs()
+
+
+async def run_mode(mode, paths, workers, max_concurrency):
+    if mode == 'inline':
+        convert = convert_inline
+        executor = None
+    else:
+        executor = (concurrent.futures.ThreadPoolExecutor if mode == 'threads'
+            else concurrent.futures.ProcessPoolExecutor)(workers)
+        convert = AsyncConverter(executor, max_concurrency).convert
+
+    clock = time.perf_counter
+    latencies = []
+
+    async def timed(path):
+        started = clock()
+        await convert(path)
+        latencies.append(clock() - started)
+
+    lags = []
+    done = asyncio.Event()
+    beat = asyncio.ensure_future(heartbeat(lags, done))
+    # Let the heartbeat start before the load arrives
+    await asyncio.sleep(TICK)
+
+    started = clock()
+    await asyncio.gather(*[timed(path) for path in paths])
+    elapsed = clock() - started
+
+    done.set()
+    await beat
+    if executor is not None:
+        executor.shutdown()
+
+    return elapsed, latencies, lags
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description='Latency of the asyncio API under concurrent load.')
+    argparser.add_argument('-n', '--copies', type=int, default=3,
+        help='conversions per document (default: %(default)s)')
+    argparser.add_argument('-j', '--workers', type=int,
+        default=os.cpu_count() or 1,
+        help='executor workers (default: CPU count)')
+    argparser.add_argument('--max-concurrency', type=int, default=None,
+        help='AsyncConverter max_concurrency (default: unlimited)')
+    argparser.add_argument('--modes', default=','.join(MODES),
+        help='comma separated modes to run (default: %(default)s)')
+    argparser.add_argument('paths', metavar='ttml-file', nargs='*',
+        help='documents to convert (default: the whole corpus)')
+    args = argparser.parse_args()
+
+    paths = args.paths or sorted(
+        os.path.join(SAMPLE_DIR, f) for f in os.listdir(SAMPLE_DIR))
+    paths = paths * args.copies
+
+    print('{} conversions, {} workers, max concurrency {}'.format(
+        len(paths), args.workers, args.max_concurrency or '-'))
+    print('{:<10} {:>8} | {:>8} {:>8} {:>8} | {:>8} {:>8} {:>8}'.format(
+        'mode', 'total s', 'lat p50', 'lat p95', 'lat max',
+        'lag p50', 'lag p99', 'lag max'))
+
+    for mode in args.modes.split(','):
+        elapsed, latencies, lags = asyncio.run(run_mode(
+            mode, paths, args.workers, args.max_concurrency))
+        lags = lags or [0.0]
+        print('{:<10} {:>8.2f} | {:>8.1f} {:>8.1f} {:>8.1f} | '
+            '{:>8.1f} {:>8.1f} {:>8.1f}'.format(
+            mode, elapsed,
+            percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000,
+            max(latencies) * 1000,
+            percentile(lags, 50) * 1000, percentile(lags, 99) * 1000,
+            max(lags) * 1000))
+    print('latency and lag in ms')
+
+
+if __name__ == '__main__':
+    main()
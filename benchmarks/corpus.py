@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""Benchmark every conversion stage over the bundled TTML corpus.
+
+Stages, timed separately for each document in tests/ttml-documents:
+
+    parse       minidom.parse() of the document
+    styles      get_tt_style_attrs() for each <style> of the parsed document
+    load        Ttml2Srt() construction (parse, TT params, styles, <p>s)
+    extract     parag_to_ms() (and extract_dialogue()) for each <p>,
+                into a CueStore
+    sort        sorting the CueStore by begin time
+    sequalize   merging overlapping paragraphs (iter_merged())
+    format      SubRip timestamps and paragraphs out of the merged ones
+    write2file  end-to-end conversion written to an in-memory file
+
+Prints per-file and aggregate wall time, cues/s and bytes/s, plus peak
+traced memory, the process' peak RSS and how many time expressions and
+SubRip timestamps were found in the memos (TimeMemo) of the documents. --json writes the same figures
+for comparing builds; --compare reads such a file and exits with status 1
+when the end-to-end time regressed by more than --threshold percent.
+
+    python benchmarks/corpus.py [-r rounds] [--json out.json]
+        [--compare baseline.json [--threshold 10]] [--parser iterparse]
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from xml.dom import minidom
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(
+    os.path.realpath(__file__)), '..'))
+sys.path.insert(0, ROOT)
+
+from ttml2srt import Ttml2Srt, CueStore, ConversionStats
+
+SAMPLE_DIR = os.path.join(ROOT, 'tests', 'ttml-documents')
+
+STAGES = (
+    'parse', 'styles', 'load', 'extract', 'sort', 'sequalize', 'format',
+    'write2file')
+
+
+def peak_rss_kb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def time_cue_stages(ttml, timings):
+    """Run the extract, sort and sequalize stages of `ttml` once, adding
+    their durations to `timings`. Returns the CueStore and merged cues.
+    """
+
+    clock = time.perf_counter
+
+    t = clock()
+    cues = CueStore(ttml.parag_to_ms(p) for p in ttml.lines)
+    timings['extract'] = clock() - t
+
+    t = clock()
+    cues.sort()
+    timings['sort'] = clock() - t
+
+    t = clock()
+    merged = list(ttml.iter_merged(cues))
+    timings['sequalize'] = clock() - t
+
+    return cues, merged
+
+
+def time_stages(path, parser):
+    """Run each stage once and return {stage: seconds} and the cue count
+    """
+
+    timings = {}
+    clock = time.perf_counter
+
+    t = clock()
+    dom = minidom.parse(path)
+    timings['parse'] = clock() - t
+
+    t = clock()
+    ttml = Ttml2Srt(path, parser=parser)
+    timings['load'] = clock() - t
+
+    t = clock()
+    for styling in dom.getElementsByTagName('styling'):
+        for style in styling.getElementsByTagName('style'):
+            ttml.get_tt_style_attrs(style, True)
+    timings['styles'] = clock() - t
+
+    cues, merged = time_cue_stages(ttml, timings)
+
+    t = clock()
+    ''.join([chunk for _count, chunk in ttml.srt_chunks(
+        ttml.with_subrip_times(merged))])
+    timings['format'] = clock() - t
+
+    t = clock()
+    Ttml2Srt(path, parser=parser).write2file(io.StringIO())
+    timings['write2file'] = clock() - t
+
+    return timings, len(cues)
+
+
+def traced_peak(path, parser):
+    tracemalloc.start()
+    try:
+        Ttml2Srt(path, parser=parser).write2file(io.StringIO())
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def memo_hits(path, parser):
+    """Return {'exprs', 'expr_hits', 'timecodes', 'srt_hits'}: time
+    expressions converted and SubRip timestamps formatted by a
+    conversion, and those found in the memos
+    """
+
+    stats = ConversionStats()
+    Ttml2Srt(path, parser=parser, stats=stats).write2file(io.StringIO())
+    counters = stats.counters
+    return {
+        'exprs': 2 * counters['cues'],
+        'expr_hits': counters.get('expr_hits', 0),
+        'timecodes': 2 * counters['paragraphs'],
+        'srt_hits': counters.get('srt_hits', 0),
+    }
+
+
+def run(paths, rounds, parser, memory):
+    files = []
+    for path in paths:
+        best = None
+        for _ in range(rounds):
+            timings, cues = time_stages(path, parser)
+            best = timings if best is None else dict(
+                (k, min(v, best[k])) for k, v in timings.items())
+        size = os.path.getsize(path)
+        total = best['write2file']
+        files.append({
+            'file': os.path.basename(path),
+            'bytes': size,
+            'cues': cues,
+            'seconds': best,
+            'cues_per_sec': cues / total,
+            'bytes_per_sec': size / total,
+            'traced_peak_bytes': traced_peak(path, parser) if memory else None,
+            'memo': memo_hits(path, parser),
+        })
+
+    total = sum(f['seconds']['write2file'] for f in files)
+    cues = sum(f['cues'] for f in files)
+    size = sum(f['bytes'] for f in files)
+    return {
+        'python': platform.python_version(),
+        'parser': parser,
+        'rounds': rounds,
+        'files': files,
+        'aggregate': {
+            'files': len(files),
+            'bytes': size,
+            'cues': cues,
+            'seconds': dict(
+                (s, sum(f['seconds'][s] for f in files)) for s in STAGES),
+            'cues_per_sec': cues / total,
+            'bytes_per_sec': size / total,
+            'traced_peak_bytes': max(
+                f['traced_peak_bytes'] for f in files) if memory else None,
+            'peak_rss_kb': peak_rss_kb(),
+            'memo': dict((k, sum(f['memo'][k] for f in files)) \
+                for k in files[0]['memo']),
+        },
+    }
+
+
+def print_report(report, verbose):
+    header = '{:<56} {:>6}'.format('file', 'cues') + ''.join(
+        ' {:>10}'.format(s) for s in STAGES) + ' {:>9} {:>8}'.format(
+        'cues/s', 'MB/s')
+    row = '{:<56} {:>6}' + ' {:>10.2f}' * len(STAGES) + ' {:>9.0f} {:>8.2f}'
+
+    def line(name, entry):
+        return row.format(
+            name[:56], entry['cues'],
+            *[entry['seconds'][s] * 1000 for s in STAGES] + [
+                entry['cues_per_sec'], entry['bytes_per_sec'] / 1e6])
+
+    print(header + '   (stage times in ms)')
+    if verbose:
+        for f in report['files']:
+            print(line(f['file'], f))
+    agg = report['aggregate']
+    print(line('all {} files'.format(agg['files']), agg))
+
+    if agg['traced_peak_bytes'] is not None:
+        print('peak traced memory (largest file): {:.1f} MB'.format(
+            agg['traced_peak_bytes'] / 1e6))
+    if agg['peak_rss_kb'] is not None:
+        print('peak RSS: {:.1f} MB'.format(agg['peak_rss_kb'] / 1024.0))
+    memo = agg['memo']
+    print('memo hits: {} of {} time expressions ({:.1f}%), {} of {} SubRip '
+        'timestamps ({:.1f}%)'.format(
+            memo['expr_hits'], memo['exprs'],
+            memo['expr_hits'] * 100.0 / max(memo['exprs'], 1),
+            memo['srt_hits'], memo['timecodes'],
+            memo['srt_hits'] * 100.0 / max(memo['timecodes'], 1)))
+
+
+def compare(report, baseline, threshold):
+    """Print stage changes against a baseline report over the files both
+    reports have. Returns False if the end-to-end time regressed by more
+    than threshold percent.
+    """
+
+    before_files = dict((f['file'], f) for f in baseline['files'])
+    common = [f for f in report['files'] if f['file'] in before_files]
+    print('comparing {} files'.format(len(common)))
+
+    ok = True
+    for stage in STAGES:
+        before = sum(before_files[f['file']]['seconds'][stage] for f in common)
+        after = sum(f['seconds'][stage] for f in common)
+        change = (after - before) / before * 100 if before else 0
+        flag = ''
+        if stage == 'write2file' and change > threshold:
+            flag = '  REGRESSION'
+            ok = False
+        print('{:<12} {:>10.2f} -> {:>10.2f} ms {:>+7.1f}%{}'.format(
+            stage, before * 1000, after * 1000, change, flag))
+    return ok
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    argparser.add_argument('paths', nargs='*', metavar='ttml-file',
+        help='documents to benchmark (default: the whole corpus)')
+    argparser.add_argument('-r', '--rounds', type=int, default=3,
+        help='runs per document, the fastest one counts (default: 3)')
+    argparser.add_argument('--parser', choices=Ttml2Srt.PARSERS,
+        default='minidom')
+    argparser.add_argument('--no-memory', dest='memory',
+        action='store_false', help='skip tracemalloc runs')
+    argparser.add_argument('-v', '--verbose', action='store_true',
+        help='print per-file figures')
+    argparser.add_argument('--json', metavar='file',
+        help='write the report as JSON')
+    argparser.add_argument('--compare', metavar='file',
+        help='JSON report of a previous run to compare against')
+    argparser.add_argument('--threshold', type=float, default=10,
+        help='end-to-end slowdown (%%) treated as a regression (default: 10)')
+    args = argparser.parse_args()
+
+    paths = args.paths or [
+        os.path.join(SAMPLE_DIR, f) for f in sorted(os.listdir(SAMPLE_DIR))]
+
+    report = run(paths, args.rounds, args.parser, args.memory)
+    print_report(report, args.verbose)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
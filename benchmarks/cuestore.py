@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""Memory held per cue while paragraphs are sorted.
+
+Documents whose paragraphs aren't in begin-time order have all their cues
+held before merging. Builds -n cues out of the paragraphs of a corpus
+document and measures (tracemalloc) the memory used by
+
+    tuples      a list of process_parag() 5-tuples: begin and end in ms
+                and as SubRip strings, and the dialogue (the layout used
+                before CueStore)
+    cuestore    a CueStore: begin and end in arrays of doubles, dialogue
+                in a list
+
+Dialogue strings are shared between cues, as their size is the same
+either way. Also reports the peak of a whole conversion of an unordered
+document with -n paragraphs.
+
+    python benchmarks/cuestore.py [-n cues] [ttml-file]
+"""
+
+import argparse
+import io
+import os
+import random
+import sys
+import tracemalloc
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(
+    os.path.realpath(__file__)), '..'))
+sys.path.insert(0, ROOT)
+
+from ttml2srt import Ttml2Srt, CueStore
+
+SAMPLE = os.path.join(ROOT, 'tests', 'ttml-documents', 'netflix-001.xml')
+
+
+def traced(build):
+    """Return (object built, bytes allocated by build() still held)
+    """
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        built = build()
+        return built, tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+
+def unordered_document(count):
+    """TTML document of `count` one-second paragraphs in shuffled order
+    """
+
+    begins = list(range(count))
+    random.Random(count).shuffle(begins)
+    out = io.BytesIO()
+    out.write(b'<?xml version="1.0" encoding="utf-8"?>\n'
+        b'<tt xmlns="http://www.w3.org/ns/ttml" '
+        b'xmlns:ttp="http://www.w3.org/ns/ttml#parameter" '
+        b'ttp:tickRate="10000000"><body><div>\n')
+    for begin in begins:
+        out.write('<p begin="{}t" end="{}t">Line {}</p>\n'.format(
+            begin * 10000000, begin * 10000000 + 9000000, begin).encode('ascii'))
+    out.write(b'</div></body></tt>\n')
+    return out.getvalue()
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description='Memory held per cue while paragraphs are sorted.')
+    argparser.add_argument('-n', '--cues', type=int, default=100000,
+        help='number of cues (default: %(default)s)')
+    argparser.add_argument('path', metavar='ttml-file', nargs='?',
+        default=SAMPLE, help='document to take paragraphs from '
+            '(default: netflix-001)')
+    args = argparser.parse_args()
+
+    ttml = Ttml2Srt(args.path)
+    cues = [ttml.parag_to_ms(p) for p in ttml.lines]
+    # Spread copies of the document's cues over a long timeline
+    offset = max(end for _begin, end, _text in cues) + 1000
+    source = [(begin + offset * (i // len(cues)), end + offset * (i // len(cues)),
+        text) for i, (begin, end, text) in (
+            (i, cues[i % len(cues)]) for i in range(args.cues))]
+
+    def tuples():
+        return [(begin, end, ttml.ms_to_subrip(begin), ttml.ms_to_subrip(end),
+            text) for begin, end, text in source]
+
+    def store():
+        return CueStore(source)
+
+    per_100k = 100000.0 / args.cues
+    sizes = {}
+    for name, build in (('tuples', tuples), ('cuestore', store)):
+        _built, sizes[name] = traced(build)
+        print('{:<10} {:>8.2f} MB per 100k cues {:>6.0f} bytes per cue'.format(
+            name, sizes[name] * per_100k / 1e6, sizes[name] / float(args.cues)))
+    print('cuestore saves {:.2f} MB per 100k cues ({:.0f}%)'.format(
+        (sizes['tuples'] - sizes['cuestore']) * per_100k / 1e6,
+        (1 - sizes['cuestore'] / float(sizes['tuples'])) * 100))
+
+    data = unordered_document(args.cues)
+    tracemalloc.start()
+    Ttml2Srt(io.BytesIO(data), parser='iterparse').write2file(io.BytesIO())
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print('unordered {}-paragraph document, iterparse: peak {:.2f} MB'.format(
+        args.cues, peak / 1e6))
+
+
+if __name__ == '__main__':
+    main()
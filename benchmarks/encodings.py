@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""Conversion of documents that aren't UTF-8 encoded.
+
+Writes a document of -n paragraphs in each of UTF-16, Windows-1252 and
+Shift_JIS and converts it
+
+    transcoded  the way it had to be done before ttml2srt took other
+                encodings: decoded, re-encoded as UTF-8 with the
+                declaration changed, written to a temporary file and
+                converted from there
+    path        straight from its path
+    bytes       from its contents in memory
+    mmap        from a memory-mapped file
+
+reporting time and peak memory (tracemalloc, which doesn't see mapped
+pages) of each. The UTF-8 document converted from its path is the
+baseline.
+
+    python benchmarks/encodings.py [-n paragraphs] [-r rounds]
+        [--parser minidom|iterparse]
+"""
+
+import argparse
+import io
+import mmap
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(
+    os.path.realpath(__file__)), '..'))
+sys.path.insert(0, ROOT)
+
+from ttml2srt import Ttml2Srt
+
+# Dialogue by encoding, as each encoding can represent it
+DIALOGUE = {
+    'utf-8': u'Caf\xe9 ’{}’ 字幕',
+    'utf-16': u'Caf\xe9 ’{}’ 字幕',
+    'windows-1252': u'Caf\xe9 ’{}’',
+    'shift_jis': u'字幕 ’{}’',
+}
+
+
+def document(count, encoding):
+    lines = [u'<?xml version="1.0" encoding="{}"?>\n'
+        u'<tt xmlns="http://www.w3.org/ns/ttml"><body><div>\n'.format(encoding)]
+    for i in range(count):
+        lines.append(u'<p begin="{}ms" end="{}ms">{}</p>\n'.format(
+            i * 1000, i * 1000 + 900, DIALOGUE[encoding].format(i)))
+    lines.append(u'</div></body></tt>\n')
+    return u''.join(lines).encode(encoding)
+
+
+def transcoded(path, encoding, parser):
+    """Convert `path` the way callers did before other encodings worked
+    """
+
+    with io.open(path, encoding=encoding) as f:
+        text = f.read()
+    text = re.sub(r'encoding="[^"]+"', 'encoding="utf-8"', text, 1)
+    handle, tmp_path = tempfile.mkstemp()
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            f.write(text.encode('utf-8'))
+        del text
+        return Ttml2Srt(tmp_path, parser=parser).paragraphs()
+    finally:
+        os.remove(tmp_path)
+
+
+def from_bytes(path, parser):
+    with open(path, 'rb') as f:
+        data = f.read()
+    return Ttml2Srt(data, parser=parser).paragraphs()
+
+
+def from_mmap(path, parser):
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return Ttml2Srt(mapped, parser=parser).paragraphs()
+        finally:
+            mapped.close()
+
+
+def measure(rounds, fn):
+    """Return (best time s, peak bytes, result) of fn() over `rounds` runs
+    """
+
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, result
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description='Conversion of documents that aren\'t UTF-8 encoded.')
+    argparser.add_argument('-n', '--paragraphs', type=int, default=50000,
+        help='paragraphs per document (default: %(default)s)')
+    argparser.add_argument('-r', '--rounds', type=int, default=3,
+        help='runs of each, the best counts (default: %(default)s)')
+    argparser.add_argument('--parser', choices=Ttml2Srt.PARSERS,
+        default='minidom', help='XML parser (default: %(default)s)')
+    args = argparser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        print('{} paragraphs, {}'.format(args.paragraphs, args.parser))
+        print('{:<14} {:<11} {:>8} {:>8} {:>9}'.format(
+            'encoding', 'input', 'MB', 'best s', 'peak MB'))
+
+        for encoding in sorted(DIALOGUE):
+            path = os.path.join(tmpdir, encoding + '.xml')
+            with open(path, 'wb') as f:
+                f.write(document(args.paragraphs, encoding))
+            size = os.path.getsize(path)
+
+            runs = [('path', lambda: Ttml2Srt(
+                path, parser=args.parser).paragraphs())]
+            if encoding != 'utf-8':
+                runs.insert(0, ('transcoded',
+                    lambda: transcoded(path, encoding, args.parser)))
+                runs.append(('bytes', lambda: from_bytes(path, args.parser)))
+                runs.append(('mmap', lambda: from_mmap(path, args.parser)))
+
+            results = set()
+            for label, fn in runs:
+                elapsed, peak, srt = measure(args.rounds, fn)
+                results.add(srt)
+                print('{:<14} {:<11} {:>8.2f} {:>8.3f} {:>9.2f}'.format(
+                    encoding, label, size / 1e6, elapsed, peak / 1e6))
+            if len(results) != 1:
+                print('{}: outputs differ'.format(encoding))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""Combining densely overlapping cues.
+
+Generates -n cues in clusters of -k simultaneous speakers: cues of a
+cluster begin 100 ms apart and last two to three seconds, so each one
+overlaps many of the others, not just the one before it. Then combines
+them with
+
+    pairwise    the merging done before overlap clusters: each cue is
+                compared with the previous one only and appended to the
+                growing dialogue by string concatenation
+    merge       Ttml2Srt.iter_merged(), each cluster becoming one cue
+    split       the same, cutting clusters into time slices
+    keep        the same, cues left overlapping
+
+from a list and from a CueStore, reporting the best time of -r runs and
+the number of cues out of each. Also converts a document of the same
+cues with each policy.
+
+    python benchmarks/overlap.py [-n cues] [-k cues per cluster]
+        [-r rounds]
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(
+    os.path.realpath(__file__)), '..'))
+sys.path.insert(0, ROOT)
+
+from ttml2srt import Ttml2Srt, CueStore
+
+
+def dense_cues(count, per_cluster):
+    # Clusters a few seconds apart
+    cluster_every = per_cluster * 100 + 5000
+    cues = []
+    for i in range(count):
+        cluster, j = divmod(i, per_cluster)
+        begin = cluster * cluster_every + j * 100
+        cues.append((begin, begin + 2000 + (j % 3) * 500,
+            'Speaker {} line {}'.format(j, i)))
+    return cues
+
+
+def document(cues):
+    out = io.BytesIO()
+    out.write(b'<?xml version="1.0" encoding="utf-8"?>\n'
+        b'<tt xmlns="http://www.w3.org/ns/ttml"><body><div>\n')
+    for begin, end, text in cues:
+        out.write('<p begin="{}ms" end="{}ms">{}</p>\n'.format(
+            begin, end, text).encode('ascii'))
+    out.write(b'</div></body></tt>\n')
+    return out.getvalue()
+
+
+def pairwise(cues):
+    """Merge the way it was done before overlap clusters
+    """
+
+    merged = []
+    prev_begin = prev_end = None
+    for begin, end, text in cues:
+        if prev_end is None or begin >= prev_end:
+            merged.append((begin, end, text))
+        else:
+            last = merged.pop()
+            merged.append((prev_begin, max(end, prev_end),
+                last[-1] + '\n' + text))
+        prev_begin, prev_end = begin, end
+    return merged
+
+
+def best_of(rounds, fn):
+    times = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - started)
+    return min(times), result
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description='Combining densely overlapping cues.')
+    argparser.add_argument('-n', '--cues', type=int, default=100000,
+        help='number of cues (default: %(default)s)')
+    argparser.add_argument('-k', '--cluster', type=int, default=50,
+        help='cues per cluster (default: %(default)s)')
+    argparser.add_argument('-r', '--rounds', type=int, default=3,
+        help='runs of each, the best counts (default: %(default)s)')
+    args = argparser.parse_args()
+
+    cues = dense_cues(args.cues, args.cluster)
+    store = CueStore(cues)
+    converters = dict((overlap, Ttml2Srt(io.BytesIO(document(cues[:1])),
+        overlap=overlap)) for overlap in Ttml2Srt.OVERLAP_POLICIES)
+
+    print('{} cues in clusters of {}'.format(args.cues, args.cluster))
+    print('{:<10} {:>10} {:>10} {:>9}'.format(
+        '', 'list ms', 'store ms', 'cues out'))
+    elapsed, merged = best_of(args.rounds, lambda: pairwise(cues))
+    print('{:<10} {:>10.2f} {:>10} {:>9}'.format(
+        'pairwise', elapsed * 1000, '', len(merged)))
+    for overlap in Ttml2Srt.OVERLAP_POLICIES:
+        iter_merged = converters[overlap].iter_merged
+        elapsed, merged = best_of(args.rounds,
+            lambda: list(iter_merged(cues)))
+        from_store, _merged = best_of(args.rounds,
+            lambda: list(iter_merged(store)))
+        print('{:<10} {:>10.2f} {:>10.2f} {:>9}'.format(
+            overlap, elapsed * 1000, from_store * 1000, len(merged)))
+
+    data = document(cues)
+    for overlap in Ttml2Srt.OVERLAP_POLICIES:
+        elapsed, _srt = best_of(1, lambda: Ttml2Srt(
+            io.BytesIO(data), overlap=overlap).paragraphs())
+        print('conversion, {:<6} {:>8.2f} s'.format(overlap, elapsed))
+
+
+if __name__ == '__main__':
+    main()
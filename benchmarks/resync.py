@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""Cost of resyncing cue times through a piecewise-linear TimeMap.
+
+Maps -n cue times through -a anchors (a drifting timeline) with
+
+    numpy       TimeMap.map_array() using numpy.interp
+    python      TimeMap.map_array() with numpy hidden, the bisect fallback
+    per-call    TimeMap() called once per value
+
+and checks all three agree. Then converts an unordered document of -n
+paragraphs with and without anchors, reporting the overhead of the
+resync on a whole conversion.
+
+    python benchmarks/resync.py [-n cues] [-a anchors] [-r rounds]
+"""
+
+import argparse
+import io
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(
+    os.path.realpath(__file__)), '..'))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import ttml2srt
+from ttml2srt import Ttml2Srt, TimeMap
+from cuestore import unordered_document
+
+
+def best_of(rounds, fn):
+    times = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - started)
+    return min(times), result
+
+
+def drifting_anchors(count, duration):
+    """`count` anchors over `duration` ms, each adding up to 500 ms of drift
+    """
+
+    rand = random.Random(count)
+    anchors = []
+    offset = 0
+    for i in range(count):
+        offset += rand.randint(0, 500)
+        source = duration * i // max(count - 1, 1)
+        anchors.append((source, source + offset))
+    return anchors
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description='Cost of resyncing cue times through a TimeMap.')
+    argparser.add_argument('-n', '--cues', type=int, default=200000,
+        help='number of cue times (default: %(default)s)')
+    argparser.add_argument('-a', '--anchors', type=int, default=50,
+        help='number of anchors (default: %(default)s)')
+    argparser.add_argument('-r', '--rounds', type=int, default=5,
+        help='runs of each, the best counts (default: %(default)s)')
+    args = argparser.parse_args()
+
+    # One second cues, as in the unordered document below
+    duration = args.cues * 1000
+    anchors = drifting_anchors(args.anchors, duration)
+    time_map = TimeMap(anchors)
+    times = [float(i * 1000) for i in range(args.cues)]
+    numpy = ttml2srt._numpy()
+
+    results = {}
+    timings = []
+    if numpy is not None:
+        timings.append(('numpy', lambda: time_map.map_array(times)))
+
+    def python():
+        ttml2srt._numpy_module[:] = [None]
+        try:
+            return time_map.map_array(times)
+        finally:
+            ttml2srt._numpy_module[:] = [numpy]
+    timings.append(('python', python))
+    timings.append(('per-call', lambda: [time_map(t) for t in times]))
+
+    print('{} cue times, {} anchors{}'.format(args.cues, args.anchors,
+        '' if numpy is not None else ' (numpy not installed)'))
+    for name, fn in timings:
+        elapsed, results[name] = best_of(args.rounds, fn)
+        print('{:<10} {:>9.2f} ms {:>7.1f} ns per value'.format(
+            name, elapsed * 1000, elapsed * 1e9 / args.cues))
+    reference = list(results['per-call'])
+    for name, mapped in results.items():
+        if list(mapped) != reference:
+            print('{} differs from per-call'.format(name))
+
+    data = unordered_document(args.cues)
+    for label, kwargs in (('no anchors', {}),
+            ('anchors', dict(anchors=anchors))):
+        elapsed, _srt = best_of(1, lambda: Ttml2Srt(
+            io.BytesIO(data), parser='iterparse', **kwargs).paragraphs())
+        print('conversion, {:<10} {:>8.2f} s'.format(label, elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""How conversion time and memory grow with document size.
+
+Generates documents of 1k to 1M paragraphs with ttmlgen.py (every time
+expression form, nested italic spans, <br/>, style references, --overlap
+of paragraphs overlapping, --div-size paragraphs per <div>; 1 gives as
+many <div>s as paragraphs) and converts each in a fresh process, twice:
+
+    stages      one stage after another, as benchmarks/corpus.py does:
+                  parse      Ttml2Srt() construction (with iterparse only
+                             the document head; <p>s are parsed while
+                             they're read)
+                  dialogue   read_parag() of each <p>: extract_dialogue()
+                             and the time attributes
+                  extract    parag_to_ms() of each <p> into a CueStore
+                  sort       sorting it, when it isn't already
+                  sequalize  merging overlapping cues (iter_merged())
+                  output     formatting SubRip paragraphs
+    convert     write2file() end to end, to /dev/null
+
+reporting time per 1000 cues and the growth of the process' peak RSS
+over its size after importing ttml2srt. Then checks that growth is
+near-linear: time per cue of every stage (taking over --min-ms at the
+reference size) and of the end-to-end conversion, and peak RSS growth
+per cue, must not exceed --tolerance times their value at the reference
+size (the first size of at least 10000 paragraphs). Exits with status 1
+when they do.
+
+    python benchmarks/scaling.py [--sizes 1000,10000,100000,1000000]
+        [--parser iterparse|minidom] [--overlap 0.1] [--div-size 0]
+        [--tolerance 1.5] [--json out.json]
+
+minidom holds the whole document tree, around 4 GB at 1M paragraphs;
+iterparse (the default here) doesn't.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(
+    os.path.realpath(__file__)), '..'))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from ttml2srt import Ttml2Srt
+import ttmlgen
+from corpus import peak_rss_kb, time_cue_stages
+
+STAGES = ('parse', 'dialogue', 'extract', 'sort', 'sequalize', 'output')
+
+
+def time_stages(path, parser):
+    """Run each stage once and return {stage: seconds} and the cue count
+    """
+
+    timings = {}
+    clock = time.perf_counter
+
+    t = clock()
+    ttml = Ttml2Srt(path, parser=parser)
+    timings['parse'] = clock() - t
+
+    t = clock()
+    for p in ttml.lines:
+        ttml.read_parag(p)
+    timings['dialogue'] = clock() - t
+
+    cues, merged = time_cue_stages(ttml, timings)
+
+    t = clock()
+    with io.open(os.devnull, 'w', encoding='utf-8') as out:
+        for _count, chunk in ttml.srt_chunks(ttml.with_subrip_times(merged)):
+            out.write(chunk)
+    timings['output'] = clock() - t
+
+    return timings, len(cues)
+
+
+def child(mode, path, parser):
+    """Measure one conversion in this process, print the figures as JSON
+    """
+
+    base_kb = peak_rss_kb()
+    if mode == 'stages':
+        timings, cues = time_stages(path, parser)
+        result = {'seconds': timings, 'cues': cues}
+    else:
+        started = time.perf_counter()
+        Ttml2Srt(path, parser=parser).write2file(os.devnull)
+        result = {'seconds': time.perf_counter() - started}
+    result['rss_growth_kb'] = peak_rss_kb() - base_kb
+    print(json.dumps(result))
+
+
+def measure(mode, path, parser):
+    output = subprocess.check_output([sys.executable,
+        os.path.realpath(__file__), '--child', mode, path,
+        '--parser', parser])
+    return json.loads(output.decode('utf-8'))
+
+
+def run(sizes, parser, overlap, div_size=0):
+    tmpdir = tempfile.mkdtemp()
+    results = []
+    try:
+        for size in sizes:
+            path = os.path.join(tmpdir, '{}.xml'.format(size))
+            with io.open(path, 'w', encoding='utf-8') as out:
+                ttmlgen.write_document(out, size, overlap,
+                    div_size=div_size)
+            stages = measure('stages', path, parser)
+            convert = measure('convert', path, parser)
+            results.append({
+                'paragraphs': size,
+                'bytes': os.path.getsize(path),
+                'cues': stages['cues'],
+                'seconds': dict(stages['seconds'], convert=convert['seconds']),
+                'rss_growth_kb': convert['rss_growth_kb'],
+                'stages_rss_growth_kb': stages['rss_growth_kb'],
+            })
+            os.remove(path)
+    finally:
+        shutil.rmtree(tmpdir)
+    return {
+        'python': platform.python_version(),
+        'parser': parser,
+        'overlap': overlap,
+        'div_size': div_size,
+        'sizes': results,
+    }
+
+
+def print_report(report):
+    columns = STAGES + ('convert',)
+    print('{}, overlap {}, div size {}   (ms per 1000 paragraphs)'.format(
+        report['parser'], report['overlap'], report['div_size']))
+    print('{:>9} {:>9}'.format('paras', 'MB') + ''.join(
+        ' {:>9}'.format(c) for c in columns) + ' {:>10} {:>10}'.format(
+        'RSS MB', 'stages MB'))
+    for entry in report['sizes']:
+        per_k = 1e6 / entry['paragraphs']
+        print('{:>9} {:>9.1f}'.format(entry['paragraphs'],
+            entry['bytes'] / 1e6) + ''.join(' {:>9.2f}'.format(
+                entry['seconds'][c] * per_k) for c in columns) +
+            ' {:>10.1f} {:>10.1f}'.format(entry['rss_growth_kb'] / 1024.0,
+                entry['stages_rss_growth_kb'] / 1024.0))
+
+
+def check(report, tolerance, min_ms):
+    """Print the checks of near-linear growth against the reference size.
+    Returns False if any failed.
+    """
+
+    sizes = report['sizes']
+    reference = next((e for e in sizes if e['paragraphs'] >= 10000),
+        sizes[0])
+    largest = sizes[-1]
+    if largest is reference:
+        print('one size of 10000 paragraphs or more, nothing to compare')
+        return True
+
+    def per_cue(entry, name):
+        if name == 'rss':
+            return entry['rss_growth_kb'] / float(entry['paragraphs'])
+        return entry['seconds'][name] / entry['paragraphs']
+
+    names = ['convert', 'rss'] + [stage for stage in STAGES \
+        if reference['seconds'][stage] * 1000 >= min_ms]
+    ok = True
+    for name in names:
+        before = per_cue(reference, name)
+        after = per_cue(largest, name)
+        ratio = after / before if before > 0 else 0
+        # Memory may not grow at all (iterparse)
+        failed = ratio > tolerance and (name != 'rss' or
+            largest['rss_growth_kb'] > 64 * 1024)
+        ok = ok and not failed
+        print('{:<10} {:>8} -> {:>8} paragraphs: x{:.2f} per paragraph{}'
+            .format(name, reference['paragraphs'], largest['paragraphs'],
+                ratio, '  NOT LINEAR' if failed else ''))
+    return ok
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    argparser.add_argument('--sizes', default='1000,10000,100000,1000000',
+        help='document sizes in paragraphs (default: %(default)s)')
+    argparser.add_argument('--parser', default='iterparse',
+        choices=('minidom', 'iterparse'))
+    argparser.add_argument('--overlap', type=float, default=0.1,
+        help='share of paragraphs overlapping the previous one '
+            '(default: %(default)s)')
+    argparser.add_argument('--div-size', type=int, default=0,
+        help='paragraphs per <div>; 0 puts them all in one '
+            '(default: %(default)s)')
+    argparser.add_argument('--tolerance', type=float, default=1.5,
+        help='largest growth of per-paragraph time and memory allowed '
+            '(default: %(default)s)')
+    argparser.add_argument('--min-ms', type=float, default=20,
+        help='stages faster than this at the reference size are not '
+            'checked (default: %(default)s)')
+    argparser.add_argument('--json', metavar='file',
+        help='write the report as JSON')
+    argparser.add_argument('--child', nargs=2, metavar=('mode', 'path'),
+        help=argparse.SUPPRESS)
+    args = argparser.parse_args()
+
+    if args.child:
+        child(args.child[0], args.child[1], args.parser)
+        return 0
+
+    sizes = sorted(int(size) for size in args.sizes.split(','))
+    report = run(sizes, args.parser, args.overlap, args.div_size)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    return 0 if check(report, args.tolerance, args.min_ms) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
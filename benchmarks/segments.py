@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""Conversion of a title split into TTML segment documents.
+
+Generates a title of -n segments of -d seconds each in a temporary
+directory, with a 1.2 second cue every 1.7 seconds. Cues crossing a segment
+boundary are carried by every segment they overlap, either repeated
+whole or clipped to the segment (alternately), the way packagers
+do. Then converts it with SegmentedTtml2Srt and reports
+
+    total       time to convert all segments to SRT
+    first       time until the first chunk of output was written
+    peak        peak memory (tracemalloc) during the conversion
+
+next to the same for a single document holding all the cues. Also checks
+that both produce the same SRT.
+
+    python benchmarks/segments.py [-n segments] [-d seconds]
+        [--parser minidom|iterparse]
+"""
+
+import argparse
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(
+    os.path.realpath(__file__)), '..'))
+sys.path.insert(0, ROOT)
+
+from ttml2srt import Ttml2Srt, SegmentedTtml2Srt, ConversionStats
+
+HEAD = ('<?xml version="1.0" encoding="utf-8"?>\n'
+    '<tt xmlns="http://www.w3.org/ns/ttml" xml:lang="en"><body><div>\n')
+TAIL = '</div></body></tt>\n'
+
+# Cue spacing and length (ms)
+CUE_EVERY = 1700
+CUE_LENGTH = 1200
+
+
+def paragraph(begin, end, text):
+    return '<p begin="{}ms" end="{}ms">{}</p>\n'.format(begin, end, text)
+
+
+def title_cues(segments, duration):
+    return [(begin, begin + CUE_LENGTH, 'Line {}'.format(i)) for i, begin \
+        in enumerate(range(0, segments * duration - CUE_LENGTH, CUE_EVERY))]
+
+
+def write_segments(directory, segments, duration):
+    """Write the segments of the title, return their paths
+    """
+
+    cues = title_cues(segments, duration)
+    paths = []
+    for n in range(segments):
+        start, stop = n * duration, (n + 1) * duration
+        with io.open(os.path.join(directory, 'seg-{}.ttml'.format(n)), 'w',
+                encoding='utf-8') as f:
+            f.write(HEAD)
+            for i, (begin, end, text) in enumerate(cues):
+                if end <= start or begin >= stop:
+                    continue
+                if i % 2:
+                    begin, end = max(begin, start), min(end, stop)
+                f.write(paragraph(begin, end, text))
+            f.write(TAIL)
+        paths.append(f.name)
+    return paths
+
+
+def measure(convert):
+    """Return (SRT, total s, s to first output, peak bytes) of convert(out)
+    """
+
+    class Output(io.StringIO):
+        first = None
+
+        def write(self, text):
+            if self.first is None:
+                self.first = time.perf_counter()
+            return io.StringIO.write(self, text)
+
+    out = Output()
+    tracemalloc.start()
+    started = time.perf_counter()
+    convert(out)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return out.getvalue(), elapsed, out.first - started, peak
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description='Conversion of a title split into TTML segments.')
+    argparser.add_argument('-n', '--segments', type=int, default=1000,
+        help='number of segments (default: %(default)s)')
+    argparser.add_argument('-d', '--duration', type=float, default=6,
+        help='segment duration in seconds (default: %(default)s)')
+    argparser.add_argument('--parser', choices=Ttml2Srt.PARSERS,
+        default='minidom', help='XML parser (default: %(default)s)')
+    args = argparser.parse_args()
+
+    duration = int(args.duration * 1000)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        paths = write_segments(tmpdir, args.segments, duration)
+        size = sum(os.path.getsize(path) for path in paths)
+        single = os.path.join(tmpdir, 'title.ttml')
+        with io.open(single, 'w', encoding='utf-8') as f:
+            f.write(HEAD)
+            f.writelines(paragraph(*cue) for cue in title_cues(
+                args.segments, duration))
+            f.write(TAIL)
+
+        stats = ConversionStats()
+        segmented = measure(lambda out: SegmentedTtml2Srt(
+            paths, parser=args.parser, stats=stats).write2file(out))
+        whole = measure(lambda out: Ttml2Srt(
+            single, parser=args.parser).write2file(out))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    print('{} segments of {:g} s, {:.2f} MB, {} cues read, {} duplicates '
+        'dropped'.format(args.segments, args.duration, size / 1e6,
+            stats.counters['cues'], stats.counters['duplicates']))
+    print('{:<10} {:>9} {:>9} {:>9}'.format('', 'total s', 'first ms',
+        'peak MB'))
+    for label, (_srt, elapsed, first, peak) in (
+            ('segments', segmented), ('single', whole)):
+        print('{:<10} {:>9.2f} {:>9.1f} {:>9.2f}'.format(
+            label, elapsed, first * 1000, peak / 1e6))
+    if segmented[0] != whole[0]:
+        print('segmented SRT differs from the single document one')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""Request latency of `ttml2srt.py serve` against running the CLI per file.
+
+Starts the server in a subprocess on a Unix socket (or TCP with --tcp),
+POSTs every document of tests/ttml-documents (or the given ones) -n times
+from -c client threads, and prints latency percentiles, throughput and
+the server's own /stats. Then converts -k documents by starting
+`ttml2srt.py` once per file, the way a per-request workflow without the
+server does.
+
+    python benchmarks/server.py [-n copies] [-c clients] [-j workers]
+        [-k cli-runs] [--tcp]
+"""
+
+import argparse
+import http.client
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(
+    os.path.realpath(__file__)), '..'))
+SCRIPT = os.path.join(ROOT, 'ttml2srt.py')
+
+SAMPLE_DIR = os.path.join(ROOT, 'tests', 'ttml-documents')
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, path):
+        http.client.HTTPConnection.__init__(self, 'localhost')
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+def print_latencies(label, latencies, elapsed):
+    print('{:<8} {:>6} requests {:>8.1f}/s | p50 {:>7.2f}  p90 {:>7.2f}  '
+        'p99 {:>7.2f}  max {:>7.2f} ms'.format(
+            label, len(latencies), len(latencies) / elapsed,
+            percentile(latencies, 50) * 1000, percentile(latencies, 90) * 1000,
+            percentile(latencies, 99) * 1000, max(latencies) * 1000))
+
+
+def wait_for_server(connect, timeout=10):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            conn = connect()
+            conn.request('GET', '/stats')
+            conn.getresponse().read()
+            return conn
+        except (OSError, http.client.HTTPException):
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def run_clients(connect, bodies, clients):
+    clock = time.perf_counter
+    latencies = []
+    lock = threading.Lock()
+    queue = list(enumerate(bodies))
+
+    def client():
+        conn = connect()
+        while True:
+            with lock:
+                if not queue:
+                    break
+                _index, body = queue.pop()
+            started = clock()
+            conn.request('POST', '/', body)
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                raise RuntimeError('HTTP {}'.format(response.status))
+            with lock:
+                latencies.append(clock() - started)
+        conn.close()
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = clock()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, clock() - started
+
+
+def run_cli(paths):
+    clock = time.perf_counter
+    latencies = []
+    started = clock()
+    with open(os.devnull, 'wb') as devnull:
+        for path in paths:
+            t = clock()
+            subprocess.check_call([sys.executable, SCRIPT, path], stdout=devnull)
+            latencies.append(clock() - t)
+    return latencies, clock() - started
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description='Request latency of ttml2srt.py serve.')
+    argparser.add_argument('-n', '--copies', type=int, default=5,
+        help='requests per document (default: %(default)s)')
+    argparser.add_argument('-c', '--clients', type=int, default=4,
+        help='concurrent client connections (default: %(default)s)')
+    argparser.add_argument('-j', '--jobs', type=int, default=1,
+        help='server worker processes (default: %(default)s)')
+    argparser.add_argument('-k', '--cli-runs', type=int, default=20,
+        help='documents converted with one CLI process each '
+            '(default: %(default)s)')
+    argparser.add_argument('--tcp', action='store_true',
+        help='connect over TCP instead of a Unix socket')
+    argparser.add_argument('paths', metavar='ttml-file', nargs='*',
+        help='documents to convert (default: the whole corpus)')
+    args = argparser.parse_args()
+
+    paths = args.paths or sorted(
+        os.path.join(SAMPLE_DIR, f) for f in os.listdir(SAMPLE_DIR))
+    bodies = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            bodies.append(f.read())
+    bodies = bodies * args.copies
+
+    tmpdir = tempfile.mkdtemp()
+    if args.tcp:
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+        address = ['--port', str(port)]
+        connect = lambda: http.client.HTTPConnection('127.0.0.1', port)
+    else:
+        socket_path = os.path.join(tmpdir, 'ttml2srt.sock')
+        address = ['--socket', socket_path]
+        connect = lambda: UnixHTTPConnection(socket_path)
+
+    server = subprocess.Popen(
+        [sys.executable, SCRIPT, 'serve', '-j', str(args.jobs)] + address,
+        stderr=subprocess.DEVNULL)
+    try:
+        conn = wait_for_server(connect)
+        latencies, elapsed = run_clients(connect, bodies, args.clients)
+        conn.request('GET', '/stats')
+        server_stats = json.loads(conn.getresponse().read().decode('utf-8'))
+        conn.close()
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    print('{} clients, {} server jobs, {}'.format(
+        args.clients, args.jobs, 'TCP' if args.tcp else 'Unix socket'))
+    print_latencies('serve', latencies, elapsed)
+    print('server-side /stats: {}'.format(json.dumps(server_stats)))
+
+    if args.cli_runs:
+        print_latencies('cli', *run_cli(paths[:args.cli_runs]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""Cold-start cost of ttml2srt.
+
+Runs, each -r times in a fresh interpreter, and reports the median:
+
+    import      `python -X importtime -c "import ttml2srt"`: cumulative
+                import time of ttml2srt (and everything it imports), as
+                reported by the interpreter
+    python      `python -c pass`, the interpreter's own startup
+    script      `python ttml2srt.py doc.xml`, a plain command line
+    module      `python -m ttml2srt doc.xml`, the same using cached
+                bytecode (scripts are compiled on every run)
+
+Also lists the modules imported by a plain conversion. --json writes the
+figures for tracking; --compare reads such a file and exits with status 1
+when the script run got slower by more than --threshold percent.
+
+    python benchmarks/startup.py [-r rounds] [--json out.json]
+        [--compare baseline.json [--threshold 10]] [ttml-file]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(
+    os.path.realpath(__file__)), '..'))
+SCRIPT = os.path.join(ROOT, 'ttml2srt.py')
+
+SAMPLE = os.path.join(ROOT, 'tests', 'ttml-documents', 'netflix-001.xml')
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def import_times(argv):
+    """Run argv with -X importtime, return {module: cumulative us}
+    """
+
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime'] + argv, cwd=ROOT,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _self, cumulative, name = line[len('import time:'):].split('|')
+        # Nested imports are indented
+        if not name.startswith('  '):
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def wall_time(argv):
+    started = time.perf_counter()
+    subprocess.run([sys.executable] + argv, cwd=ROOT,
+        stdout=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - started
+
+
+def run(rounds, path):
+    commands = {
+        'python': ['-c', 'pass'],
+        'script': [SCRIPT, path],
+        'module': ['-m', 'ttml2srt', path],
+    }
+    # Let -m write its bytecode cache (where allowed) before timing
+    wall_time(commands['module'])
+
+    samples = dict((name, []) for name in ['import'] + list(commands))
+    for _ in range(rounds):
+        samples['import'].append(
+            import_times(['-c', 'import ttml2srt'])['ttml2srt'] / 1e6)
+        for name, argv in commands.items():
+            samples[name].append(wall_time(argv))
+
+    report = dict(
+        (name, median(values) * 1000) for name, values in samples.items())
+    report['modules'] = sorted(import_times([SCRIPT, path]))
+    return report
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description='Cold-start cost of ttml2srt.')
+    argparser.add_argument('-r', '--rounds', type=int, default=15,
+        help='runs of each command, the median counts (default: %(default)s)')
+    argparser.add_argument('--json', metavar='file',
+        help='write the report as JSON')
+    argparser.add_argument('--compare', metavar='file',
+        help='JSON report of a previous run to compare against')
+    argparser.add_argument('--threshold', type=float, default=10,
+        help='script run slowdown (%%) treated as a regression '
+            '(default: %(default)s)')
+    argparser.add_argument('path', metavar='ttml-file', nargs='?',
+        default=SAMPLE, help='document to convert (default: netflix-001)')
+    args = argparser.parse_args()
+
+    report = run(args.rounds, args.path)
+
+    for name in ('import', 'python', 'script', 'module'):
+        print('{:<8} {:>8.2f} ms'.format(name, report[name]))
+    print('modules imported by a plain conversion: {}'.format(
+        ' '.join(report['modules'])))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        status = 0
+        for name in ('import', 'script', 'module'):
+            change = (report[name] / baseline[name] - 1) * 100
+            print('{:<8} {:>8.2f} -> {:>8.2f} ms {:>+7.1f}%'.format(
+                name, baseline[name], report[name], change))
+            if name == 'script' and change > args.threshold:
+                status = 1
+        sys.exit(status)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""Memory and time of text normalization per text node.
+
+Extracts the dialogue of each <p> of a generated document of -n
+paragraphs (benchmarks/ttmlgen.py: nested styled spans, <br/>, plain
+and italic text) with
+
+    legacy      extract_dialogue() as it was before the normalization
+                stage: recursion, re.sub() of the pattern string and
+                newline replace() per text node, style tags nested by
+                format() calls and text formatted into them in a try
+                block (minidom only)
+    default     Ttml2Srt.extract_dialogue() under each whitespace policy
+    collapse    (see Ttml2Srt.WHITESPACE_POLICIES)
+    strip
+    keep
+
+reporting the best time of -r runs and, with tracemalloc, the peak of
+memory allocated while extracting each <p> over what was allocated
+before, averaged per text node (transient strings and lists, the
+dialogue returned included).
+
+    python benchmarks/textnorm.py [-n paragraphs] [-r rounds]
+        [--parser minidom|iterparse]
+"""
+
+import argparse
+import io
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(
+    os.path.realpath(__file__)), '..'))
+sys.path.insert(0, ROOT)
+
+from ttml2srt import Ttml2Srt
+import ttmlgen
+
+
+def legacy_extract(ttml, nodes, styles=()):
+    """Extract dialogue the way it was done before the normalization stage
+    """
+
+    dialogue = []
+
+    for node in nodes:
+
+        _styles = []
+
+        if node.nodeType == node.TEXT_NODE:
+
+            format_str = '{}'
+
+            text = re.sub(r'^\s{4,}', '', node.nodeValue.replace('\n', ''))
+
+            for style in styles:
+                format_str = '{ot}{f}{et}'.format(
+                    et='</{}>'.format(style),
+                    ot='<{}>'.format(style),
+                    f=format_str)
+
+            try:
+                dialogue.append(format_str.format(text))
+            except UnicodeEncodeError:
+                dialogue.append(format_str.format(text.encode('utf8')))
+
+        elif node.localName == 'br':
+            dialogue.append('\n')
+
+        elif node.localName == 'span':
+            style_attrs = ttml.get_tt_style_attrs(node)
+            if style_attrs['font_style'] == 'italic' or \
+                    style_attrs['style_id'] in ttml.italic_style_ids:
+                _styles.append('i')
+
+        if node.hasChildNodes():
+            dialogue += legacy_extract(ttml, node.childNodes, _styles)
+
+    return ''.join(dialogue)
+
+
+def count_text_nodes(paragraph):
+    if hasattr(paragraph, 'attrib'):
+        return sum(bool(e.text) + bool(e.tail and e is not paragraph) \
+            for e in paragraph.iter())
+    stack, count = [paragraph], 0
+    while stack:
+        node = stack.pop()
+        count += node.nodeType == node.TEXT_NODE
+        stack.extend(node.childNodes)
+    return count
+
+
+def extractor(ttml):
+    if ttml.parser == 'iterparse':
+        return ttml.extract_element_dialogue
+    return lambda p: ttml.extract_dialogue(p.childNodes)
+
+
+def best_of(rounds, fn, paragraphs):
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for p in paragraphs:
+            fn(p)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def transient_bytes(fn, paragraphs):
+    """Return the sum over `paragraphs` of the memory peak of fn(p)
+    """
+
+    total = 0
+    tracemalloc.start()
+    try:
+        for p in paragraphs:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            fn(p)
+            total += tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+    return total
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description='Memory and time of text normalization per text node.')
+    argparser.add_argument('-n', '--paragraphs', type=int, default=20000,
+        help='paragraphs of the document (default: %(default)s)')
+    argparser.add_argument('-r', '--rounds', type=int, default=5,
+        help='runs of each, the best counts (default: %(default)s)')
+    argparser.add_argument('--parser', choices=Ttml2Srt.PARSERS,
+        default='minidom', help='XML parser (default: %(default)s)')
+    args = argparser.parse_args()
+
+    data = ttmlgen.document(args.paragraphs)
+    runs = []
+    for whitespace in Ttml2Srt.WHITESPACE_POLICIES:
+        ttml = Ttml2Srt(io.BytesIO(data), parser=args.parser,
+            whitespace=whitespace)
+        runs.append((whitespace, extractor(ttml), list(ttml.lines)))
+    if args.parser == 'minidom':
+        ttml = Ttml2Srt(io.BytesIO(data))
+        runs.insert(0, ('legacy',
+            lambda p: legacy_extract(ttml, p.childNodes), list(ttml.lines)))
+
+    text_nodes = sum(count_text_nodes(p) for p in runs[0][2])
+    print('{} paragraphs, {} text nodes, {}'.format(
+        args.paragraphs, text_nodes, args.parser))
+    print('{:<10} {:>10} {:>12} {:>14}'.format(
+        '', 'best ms', 'ns per node', 'bytes per node'))
+    for label, fn, paragraphs in runs:
+        elapsed = best_of(args.rounds, fn, paragraphs)
+        peak = transient_bytes(fn, paragraphs)
+        print('{:<10} {:>10.2f} {:>12.0f} {:>14.1f}'.format(label,
+            elapsed * 1000, elapsed * 1e9 / text_nodes,
+            peak / float(text_nodes)))
+
+
+if __name__ == '__main__':
+    main()
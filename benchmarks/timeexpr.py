@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""Micro-benchmark of time expression conversion.
+
+Compares :meth:`Ttml2Srt.timeexprs_to_ms` (and the single expression
+:meth:`Ttml2Srt.timeexpr_to_ms`) with the conversion scheme it replaced:
+stripping digits off each expression to look up a per-form method which
+then re.split()s the expression and hops through a few helper methods.
+The old scheme is reproduced in :class:`LegacyConverter`.
+
+Expressions are the begin/end attributes found in tests/ttml-documents.
+
+    python benchmarks/timeexpr.py [-r rounds]
+"""
+
+import argparse
+import os
+import re
+import sys
+import timeit
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(
+    os.path.realpath(__file__)), '..'))
+sys.path.insert(0, ROOT)
+
+from ttml2srt import Ttml2Srt
+
+SAMPLE_DIR = os.path.join(ROOT, 'tests', 'ttml-documents')
+
+
+class LegacyConverter(object):
+
+    def __init__(self, frame_rate, tick_rate, time_multiplier=1):
+        self.frame_rate = frame_rate
+        self.tick_rate = tick_rate
+        self.time_multiplier = time_multiplier
+
+    def _scaler(self, ms):
+        return ms * self.time_multiplier
+
+    def _hhmmss_to_ms(self, hh, mm, ss):
+        return hh * 3600 * 1000 + mm * 60 * 1000 + ss * 1000
+
+    def frames_to_ms(self, frames):
+        return int(int(frames) * (1000 / self.frame_rate))
+
+    def offset_ticks_to_ms(self, time):
+        ticks = int(time[:-1])
+        seconds = 1.0 / self.tick_rate
+        return self._scaler((seconds * ticks) * 1000)
+
+    def offset_seconds_to_ms(self, time):
+        return self._scaler(int(1000 * float(time[:-1])))
+
+    def fraction_timestamp_to_ms(self, timestamp):
+        hh, mm, ss, fraction = re.split(r'[:.]', timestamp)
+        hh, mm, ss = [int(i) for i in (hh, mm, ss)]
+        return self._scaler(self._hhmmss_to_ms(hh, mm, ss) + int(fraction[:3]))
+
+    def frame_timestamp_to_ms(self, timestamp):
+        hh, mm, ss, frames = [int(i) for i in timestamp.split('.')[0].split(':')]
+        return self._scaler(
+            self._hhmmss_to_ms(hh, mm, ss) + self.frames_to_ms(frames))
+
+    def determine_ms_convfn(self, time_expr):
+        time_expr_fns = {
+            ':::': self.frame_timestamp_to_ms,
+            ':::.': self.frame_timestamp_to_ms,
+            '::.': self.fraction_timestamp_to_ms,
+            's': self.offset_seconds_to_ms,
+            '.s': self.offset_seconds_to_ms,
+            't': self.offset_ticks_to_ms,
+        }
+        return time_expr_fns[''.join([i for i in time_expr if not i.isdigit()])]
+
+    def timeexpr_to_ms(self, time_expr):
+        # The first expression decided the method for the whole document
+        self.timeexpr_to_ms = self.determine_ms_convfn(time_expr)
+        return self.timeexpr_to_ms(time_expr)
+
+
+def corpus_expressions():
+    """Return corpus time expressions grouped by form
+    """
+
+    forms = {}
+    for name in sorted(os.listdir(SAMPLE_DIR)):
+        with open(os.path.join(SAMPLE_DIR, name), 'rb') as f:
+            data = f.read().decode('utf-8')
+        for expr in re.findall(r'\b(?:begin|end)="([^"]+)"', data):
+            if re.match(r'\d+:\d+:\d+$', expr):
+                # Not handled by the legacy scheme
+                continue
+            form = re.sub(r'\d+', '9', expr)
+            forms.setdefault(form, []).append(expr)
+    return forms
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    argparser.add_argument('-r', '--rounds', type=int, default=5)
+    args = argparser.parse_args()
+
+    ttml = Ttml2Srt(os.path.join(SAMPLE_DIR, 'netflix-077.xml'))
+    ttml.frame_rate = 25
+    ttml.tick_rate = 10000000
+
+    print('{:<16} {:>7} {:>12} {:>12} {:>12} {:>8}'.format(
+        'form', 'exprs', 'legacy ns', 'single ns', 'batch ns', 'speedup'))
+
+    totals = [0, 0, 0]
+    count = 0
+    for form, exprs in sorted(corpus_expressions().items()):
+
+        def legacy():
+            conv = LegacyConverter(25, 10000000)
+            for expr in exprs:
+                conv.timeexpr_to_ms(expr)
+
+        def single():
+            for expr in exprs:
+                ttml.timeexpr_to_ms(expr)
+
+        def batch():
+            ttml.timeexprs_to_ms(exprs)
+
+        results = [
+            min(timeit.repeat(fn, number=1, repeat=args.rounds)) \
+                * 1e9 / len(exprs)
+            for fn in (legacy, single, batch)]
+        print('{:<16} {:>7} {:>12.0f} {:>12.0f} {:>12.0f} {:>7.2f}x'.format(
+            form, len(exprs), results[0], results[1], results[2],
+            results[0] / results[2]))
+
+        count += len(exprs)
+        for i, result in enumerate(results):
+            totals[i] += result * len(exprs)
+
+    totals = [t / count for t in totals]
+    print('{:<16} {:>7} {:>12.0f} {:>12.0f} {:>12.0f} {:>7.2f}x'.format(
+        'all', count, totals[0], totals[1], totals[2], totals[0] / totals[2]))
+
+    # A document mixing forms, which the legacy scheme gets wrong
+    mixed = ['00:00:05', '00:00:07.240', '00:01:02:12', '12.5s', '20000000t']
+    print('mixed forms: {}'.format(ttml.timeexprs_to_ms(mixed)))
+
+
+if __name__ == '__main__':
+    main()
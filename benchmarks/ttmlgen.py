@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""Deterministic generator of large TTML documents.
+
+Writes a document of -n paragraphs that exercises what Ttml2Srt reads:
+times in each form told apart by determine_ms_convfn() (TIME_FORMS,
+cycled through paragraph by paragraph), italic spans nested in plain
+and styled spans, <br/> line breaks, style references on <p> and <span>
+and, with probability --overlap, paragraphs beginning before the
+previous one ends (simultaneous speakers). Paragraphs are all in one
+<div>, or --div-size of them in each of many. The same arguments always
+give the same bytes.
+
+    python benchmarks/ttmlgen.py [-n paragraphs] [--overlap 0.1]
+        [--div-size 0] [--seed 0] [-o out.xml]
+"""
+
+import argparse
+import io
+import random
+import sys
+
+# Frame rate and tick rate of generated documents. Times are multiples
+# of a frame (40 ms) and begins at least a frame apart, so paragraphs stay
+# in order though some forms convert to a ms less.
+FPS = 25
+FRAME_MS = 1000 // FPS
+TICK_RATE = 10000000
+
+# Time expression forms: each form determine_ms_convfn() tells apart, and
+# clock times with frames and sub-frames
+TIME_FORMS = (
+    'clock',            # 00:02:23
+    'clock_fraction',   # 00:02:23.280
+    'clock_frames',     # 00:02:23:07
+    'clock_subframes',  # 00:02:23:07.1
+    'hours',            # 0.039800000h
+    'minutes',          # 2.3880000m
+    'seconds',          # 143.28s
+    'ms',               # 143280ms
+    'frames',           # 3582f
+    'ticks',            # 1432800000t
+)
+
+HEAD = (u'<?xml version="1.0" encoding="utf-8"?>\n'
+    u'<tt xmlns="http://www.w3.org/ns/ttml" '
+    u'xmlns:tts="http://www.w3.org/ns/ttml#styling" '
+    u'xmlns:ttp="http://www.w3.org/ns/ttml#parameter" '
+    u'ttp:frameRate="{fps}" ttp:tickRate="{tick_rate}" xml:lang="en">\n'
+    u'<head><styling>\n'
+    u'<style xml:id="s0" tts:fontFamily="proportionalSansSerif"/>\n'
+    u'<style xml:id="italic" tts:fontStyle="italic"/>\n'
+    u'</styling></head>\n'
+    u'<body><div>\n').format(fps=FPS, tick_rate=TICK_RATE)
+TAIL = u'</div></body></tt>\n'
+
+WORDS = (u'we', u'should', u'go', u'now', u'before', u'the', u'tide', u'turns',
+    u'I', u'never', u'said', u'that', u'where', u'is', u'everyone', u'listen',
+    u'café', u'déjà', u'vu', u'naïve')
+
+
+def time_expr(ms, form):
+    """Return `ms` (a multiple of FRAME_MS, and of 1000 for 'clock') as a
+    time expression of `form`
+    """
+
+    if form == 'hours':
+        return u'{:.9f}h'.format(ms / 3600000.0)
+    if form == 'minutes':
+        return u'{:.7f}m'.format(ms / 60000.0)
+    if form == 'seconds':
+        return u'{}.{:03d}s'.format(*divmod(ms, 1000))
+    if form == 'ms':
+        return u'{}ms'.format(ms)
+    if form == 'frames':
+        return u'{}f'.format(ms // FRAME_MS)
+    if form == 'ticks':
+        return u'{}t'.format(ms * (TICK_RATE // 1000))
+
+    hh, rest = divmod(ms, 3600000)
+    mm, rest = divmod(rest, 60000)
+    ss, rest = divmod(rest, 1000)
+    clock = u'{:02d}:{:02d}:{:02d}'.format(hh, mm, ss)
+    if form == 'clock':
+        return clock
+    if form == 'clock_fraction':
+        return u'{}.{:03d}'.format(clock, rest)
+    if form == 'clock_frames':
+        return u'{}:{:02d}'.format(clock, rest // FRAME_MS)
+    return u'{}:{:02d}.1'.format(clock, rest // FRAME_MS)
+
+
+def dialogue(rand, index):
+    """Return the markup of a paragraph's content
+    """
+
+    def words(count):
+        return u' '.join(rand.choice(WORDS) for _ in range(count))
+
+    lines = [words(rand.randint(2, 6)) + u' {}'.format(index)]
+    kind = rand.randint(0, 5)
+    if kind == 1:
+        lines.append(u'<span tts:fontStyle="italic">{}</span>'.format(
+            words(3)))
+    elif kind == 2:
+        # Italic nested in a styled span, around another break
+        lines.append(u'<span style="s0">{} <span tts:fontStyle="italic">'
+            u'{}<br/>{}</span></span>'.format(words(2), words(2), words(2)))
+    elif kind == 3:
+        lines.append(u'<span style="italic">{}</span> {}'.format(
+            words(2), words(2)))
+    elif kind == 4:
+        lines.append(words(4))
+    return u'<br/>'.join(lines)
+
+
+def write_document(out, count, overlap=0.1, seed=0, div_size=0):
+    """Write a document of `count` paragraphs to text file `out`, in
+    <div>s of `div_size` paragraphs (all in one if 0)
+    """
+
+    rand = random.Random(seed)
+    out.write(HEAD)
+    begin = previous_end = 0
+    for i in range(count):
+        if i and rand.random() < overlap:
+            # Another speaker, beginning while the previous one shows
+            begin = max(previous_end - FRAME_MS * rand.randint(1, 25),
+                begin + FRAME_MS)
+        else:
+            begin = previous_end + FRAME_MS * rand.randint(0, 50)
+        end = begin + FRAME_MS * rand.randint(25, 100)
+        form = TIME_FORMS[i % len(TIME_FORMS)]
+        if form == 'clock':
+            # Whole seconds only
+            begin, end = -(-begin // 1000) * 1000, -(-end // 1000) * 1000
+        style = u' style="italic"' if rand.random() < 0.05 else u''
+        if i and div_size and not i % div_size:
+            out.write(u'</div><div>\n')
+        out.write(u'<p begin="{}" end="{}"{}>{}</p>\n'.format(
+            time_expr(begin, form), time_expr(end, form), style,
+            dialogue(rand, i)))
+        previous_end = max(previous_end, end)
+    out.write(TAIL)
+
+
+def document(count, overlap=0.1, seed=0, div_size=0):
+    """Return a document of `count` paragraphs as UTF-8 bytes
+    """
+
+    out = io.StringIO()
+    write_document(out, count, overlap, seed, div_size)
+    return out.getvalue().encode('utf-8')
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description='Deterministic generator of large TTML documents.')
+    argparser.add_argument('-n', '--paragraphs', type=int, default=1000,
+        help='number of paragraphs (default: %(default)s)')
+    argparser.add_argument('--overlap', type=float, default=0.1,
+        help='share of paragraphs overlapping the previous one '
+            '(default: %(default)s)')
+    argparser.add_argument('--div-size', type=int, default=0,
+        help='paragraphs per <div>; 0 puts them all in one '
+            '(default: %(default)s)')
+    argparser.add_argument('--seed', type=int, default=0,
+        help='random seed (default: %(default)s)')
+    argparser.add_argument('-o', '--output', metavar='file',
+        help='file to write to (default: stdout)')
+    args = argparser.parse_args()
+
+    if args.output:
+        with io.open(args.output, 'w', encoding='utf-8') as out:
+            write_document(out, args.paragraphs, args.overlap, args.seed,
+            args.div_size)
+    else:
+        out = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+        write_document(out, args.paragraphs, args.overlap, args.seed,
+            args.div_size)
+        out.flush()
+
+
+if __name__ == '__main__':
+    main()
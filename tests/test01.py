@@ -6,14 +6,39 @@ import sys
 import os
 import subprocess
 import re
+import shutil
+import tempfile
+import io
+import mmap
 
 sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(
     os.path.realpath(__file__)), '../')))
 
-from ttml2srt import Ttml2Srt
+import ttml2srt
+from ttml2srt import Ttml2Srt, CueCache, CueStore, ConversionStats, \
+    SegmentedTtml2Srt, TimeMap, VttWriter, convert_batch, convert_manifest, \
+    find_ttml_files, load_anchors, make_server
+
+try:
+    from http.client import HTTPConnection
+except ImportError:
+    from httplib import HTTPConnection
+import json
+import threading
+
+if sys.version_info >= (3, 7):
+    import asyncio
+    import concurrent.futures
+    import ttml2srt_aio
+else:
+    ttml2srt_aio = None
 
 SAMPLE_DIR = 'tests/ttml-documents'
 
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(
+    os.path.realpath(__file__)), '../benchmarks')))
+import ttmlgen
+
 def get_ttml(**kwargs):
     return Ttml2Srt(os.path.join(SAMPLE_DIR, 'netflix-077.xml'), **kwargs)
 
@@ -27,6 +52,231 @@ def set_attrs(ttml, fps=None, clock_mode=None, tick_rate=None, time_base = None)
     if time_base is not None:
         ttml.time_base = time_base
 
+STYLED_TTML = b'''<?xml version="1.0" encoding="utf-8"?>
+<tt xmlns="http://www.w3.org/ns/ttml" xmlns:tts="http://www.w3.org/ns/ttml#styling"
+    xmlns:ttp="http://www.w3.org/ns/ttml#parameter" ttp:tickRate="10" xml:lang="en">
+<head><styling>
+<style xml:id="italic" tts:fontStyle="italic"/>
+<style xml:id="derived" style="italic" tts:color="yellow"/>
+<style xml:id="plain" tts:color="white"/>
+</styling></head>
+<body><div>
+<p begin="10t" end="20t" style="derived">Whole <span style="plain">line</span></p>
+<p begin="30t" end="40t">a <span style="italic">b <span style="plain">c</span> d<br/>e</span> f</p>
+<p begin="50t" end="60t"><span tts:fontStyle="italic">g</span><br/>h</p>
+</div></body>
+</tt>
+'''
+
+STYLED_SRT = '''1
+00:00:01,000 --> 00:00:02,000
+<i><font color="yellow">Whole </font></i><i>line</i>
+
+2
+00:00:03,000 --> 00:00:04,000
+a <i>b </i><i>c</i><i> d</i>
+<i>e</i> f
+
+3
+00:00:05,000 --> 00:00:06,000
+<i>g</i>
+h
+
+'''
+
+# Styles of regions and time containers, referenced and inline styles
+# overriding them
+CASCADED_TTML = b'''<?xml version="1.0" encoding="utf-8"?>
+<tt xmlns="http://www.w3.org/ns/ttml" xmlns:tts="http://www.w3.org/ns/ttml#styling">
+<head>
+<styling>
+<style xml:id="base" tts:color="white" tts:fontWeight="bold"/>
+<style xml:id="speaker" style="base" tts:color="#00ff00ff"/>
+<style xml:id="upright" tts:fontStyle="normal" tts:fontWeight="normal"/>
+<style xml:id="loop1" style="loop2" tts:fontStyle="italic"/>
+<style xml:id="loop2" style="loop1"/>
+</styling>
+<layout>
+<region xml:id="top" tts:fontStyle="italic"/>
+<region xml:id="bottom" style="speaker"/>
+</layout>
+</head>
+<body region="bottom">
+<div style="base">
+<p begin="1s" end="2s">a <span tts:color="rgb(255,0,0)">b</span></p>
+<p begin="3s" end="4s" region="top" style="upright"><span style="loop1">c</span> d</p>
+</div>
+<div region="top">
+<p begin="5s" end="6s" tts:fontWeight="bold">e<span tts:fontStyle="normal">f</span></p>
+<p begin="7s" end="8s"><span tts:color="#00ff0000">g</span><span tts:color="bogus">h</span></p>
+</div>
+<div><p begin="9s" end="10s">i</p></div>
+<div tts:fontStyle="italic" style="upright">
+<div tts:color="yellow"><p begin="11s" end="12s">j <span tts:fontStyle="normal">k</span></p></div>
+</div>
+</body>
+</tt>
+'''
+
+CASCADED_SRT = '''1
+00:00:01,000 --> 00:00:02,000
+<b>a </b><font color="#ff0000"><b>b</b></font>
+
+2
+00:00:03,000 --> 00:00:04,000
+<i>c</i> d
+
+3
+00:00:05,000 --> 00:00:06,000
+<i><b>e</b></i><b>f</b>
+
+4
+00:00:07,000 --> 00:00:08,000
+<i>g</i><i>h</i>
+
+5
+00:00:09,000 --> 00:00:10,000
+<font color="#00ff00"><b>i</b></font>
+
+6
+00:00:11,000 --> 00:00:12,000
+<i><font color="yellow">j </font></i><font color="yellow">k</font>
+
+'''
+
+UNORDERED_TTML = b'''<?xml version="1.0" encoding="utf-8"?>
+<tt xmlns="http://www.w3.org/ns/ttml">
+<body><div>
+<p begin="00:00:03.000" end="00:00:04.000">c</p>
+<p begin="00:00:01.000" end="00:00:02.500">a</p>
+<p begin="00:00:02.000" end="00:00:02.200">b</p>
+<p begin="00:00:05.000" end="00:00:06.000">d</p>
+</div></body>
+</tt>
+'''
+
+UNORDERED_SRT = '''1
+00:00:01,000 --> 00:00:02,500
+a
+b
+
+2
+00:00:03,000 --> 00:00:04,000
+c
+
+3
+00:00:05,000 --> 00:00:06,000
+d
+
+'''
+
+# <p> times relative to their <body> and <div> time containers
+CONTAINED_TTML = b'''<?xml version="1.0" encoding="utf-8"?>
+<tt xmlns="http://www.w3.org/ns/ttml"
+    xmlns:ttp="http://www.w3.org/ns/ttml#parameter" ttp:frameRate="25">
+<body begin="10s">
+<div begin="00:00:01:00">
+<p begin="00:00:00.500" end="1s">a</p>
+<p begin="2s" end="75f">b</p>
+</div>
+<div><p begin="30s" end="31s">c</p></div>
+<div begin="1m"><p begin="0s" end="1500ms">d</p></div>
+</body>
+</tt>
+'''
+
+CONTAINED_SRT = '''1
+00:00:11,500 --> 00:00:12,000
+a
+
+2
+00:00:13,000 --> 00:00:14,000
+b
+
+3
+00:00:40,000 --> 00:00:41,000
+c
+
+4
+00:01:10,000 --> 00:01:11,500
+d
+
+'''
+
+SEGMENT_TTML = '''<?xml version="1.0" encoding="utf-8"?>
+<tt xmlns="http://www.w3.org/ns/ttml" xml:lang="en"><body><div>
+{}
+</div></body></tt>
+'''
+
+# Indented text, runs of spaces and spaces next to line breaks and tags
+WHITESPACE_TTML = b'''<?xml version="1.0" encoding="utf-8"?>
+<tt xmlns="http://www.w3.org/ns/ttml" xmlns:tts="http://www.w3.org/ns/ttml#styling">
+<body><div>
+<p begin="1s" end="2s">
+      Hello   there <span tts:fontStyle="italic"> big
+   world </span><br/>
+   <span tts:fontStyle="italic">  next</span>  line  </p>
+</div></body></tt>
+'''
+
+WHITESPACE_DIALOGUE = {
+    'default': 'Hello   there <i> big   world </i>\n   <i>  next</i>  line  ',
+    'collapse': ' Hello there <i> big world </i>\n <i> next</i> line ',
+    'strip': 'Hello there <i> big world</i>\n<i>next</i> line',
+    'keep': '\n      Hello   there <i> big\n   world </i>\n\n   '
+        '<i>  next</i>  line  ',
+}
+
+# Repeated cue (b), cue continued over two boundaries (long) and a gap
+SEGMENTS = [
+    [(0, 1, 'a'), (1.5, 2, 'b')],
+    [(1.5, 2, 'b'), (3, 4, 'c'), (5, 6, 'long')],
+    [(6, 8, 'long'), (8.5, 9, 'd')],
+    [(8, 10, 'long')],
+    [],
+    [(12, 13, 'e')],
+]
+
+SEGMENTS_SRT = '''1
+00:00:00,000 --> 00:00:01,000
+a
+
+2
+00:00:01,500 --> 00:00:02,000
+b
+
+3
+00:00:03,000 --> 00:00:04,000
+c
+
+4
+00:00:05,000 --> 00:00:10,000
+long
+d
+
+5
+00:00:12,000 --> 00:00:13,000
+e
+
+'''
+
+
+def segment_sources():
+    return [io.BytesIO(SEGMENT_TTML.format(''.join(
+        '<p begin="{}s" end="{}s">{}</p>'.format(*cue) for cue in cues)
+        ).encode('utf-8')) for cues in SEGMENTS]
+
+
+class ReadOnlyStream(object):
+
+    def __init__(self, data):
+        self._stream = io.BytesIO(data)
+
+    def read(self, size=-1):
+        return self._stream.read(size)
+
+
 class Tester(unittest.TestCase):
 
     def test_time_expr_type_detection(self):
@@ -113,6 +363,29 @@ class Tester(unittest.TestCase):
         for t in hours_to_ms_tests:
             self.assertEqual(ttml.offset_hours_to_ms(t[0]), t[1])
 
+    def test_mixed_time_expressions(self):
+
+        ttml = get_ttml()
+        set_attrs(ttml, fps=25, tick_rate=10000000)
+
+        self.assertEqual(
+            ttml.timeexprs_to_ms([
+                '00:00:05', '00:00:07.240', '00:00:07.5', '00:00:10:23',
+                '2.5s', '1.5m', '1h', '1500ms', '1500.7ms', '50f',
+                '20000000t',
+            ]),
+            [5000, 7240, 7500, 10920, 2500, 90000, 3.6e6, 1500, 1500, 2000,
+             2000])
+
+        for time_expr in ('4322323', '1:2', '00:00:05,000', '5x', 'ts'):
+            self.assertRaises(
+                NotImplementedError, ttml.timeexpr_to_ms, time_expr)
+
+        ttml = get_ttml(shift=100)
+        set_attrs(ttml, fps=25)
+        ttml.time_multiplier = 0.5
+        self.assertEqual(ttml.timeexprs_to_ms(['10s', '00:00:10:00']), [5000, 5000])
+
     def test_ms_to_subrip(self):
 
         ttml = get_ttml()
@@ -166,6 +439,53 @@ class Tester(unittest.TestCase):
                 ttml.timeexpr_to_subrip(time_expr)[1],
                 subrip)
 
+    def test_time_memo(self):
+        # Each paragraph begins where the previous one ends
+        chained = '<?xml version="1.0" encoding="utf-8"?>\n' \
+            '<tt xmlns="http://www.w3.org/ns/ttml"><body><div>\n' + ''.join(
+                '<p begin="00:00:{:02d}:00" end="00:00:{:02d}:00">Line {}</p>\n'.format(
+                    i, i + 1, i) for i in range(40)) + '</div></body></tt>\n'
+
+        stats = ConversionStats()
+        ttml = Ttml2Srt(io.BytesIO(chained.encode('utf-8')), stats=stats)
+        ttml.write2file(io.StringIO())
+        self.assertEqual(stats.counters['expr_lookups'], 80)
+        self.assertEqual(stats.counters['expr_hits'], 39)
+        self.assertEqual(stats.counters['srt_lookups'], 80)
+        self.assertEqual(stats.counters['srt_hits'], 39)
+
+        memoized = ttml.paragraphs()
+        ttml.expr_memo.active = ttml.subrip_memo.active = False
+        self.assertEqual(ttml.paragraphs(), memoized)
+
+        # Tick expressions skip the memo without turning it off
+        ticked = chained.replace(
+            '<div>\n', '<div>\n<p begin="0t" end="1t">Tick</p>\n', 1)
+        stats = ConversionStats()
+        ttml = Ttml2Srt(io.BytesIO(ticked.encode('utf-8')), stats=stats)
+        ttml.write2file(io.StringIO())
+        self.assertEqual(stats.counters['expr_lookups'], 80)
+        self.assertEqual(stats.counters['expr_hits'], 39)
+        self.assertTrue(ttml.expr_memo.active)
+
+        # Memoized values don't outlive the parameters they depend on
+        ttml = get_ttml()
+        set_attrs(ttml, fps=25)
+        self.assertEqual(ttml.timeexpr_to_ms('00:00:01:12'), 1480)
+        set_attrs(ttml, fps=50)
+        self.assertEqual(ttml.timeexpr_to_ms('00:00:01:12'), 1240)
+
+        # Documents with no repeated times turn the memos off
+        ttml = Ttml2Srt(os.path.join(SAMPLE_DIR, 'hbonordic-001.xml'))
+        ttml.paragraphs()
+        self.assertFalse(ttml.expr_memo.active or ttml.subrip_memo.active)
+
+        # Tick expressions alone never get to the memo
+        ttml = Ttml2Srt(os.path.join(SAMPLE_DIR, 'netflix-001.xml'))
+        ttml.paragraphs()
+        self.assertEqual(ttml.expr_memo.lookups, 0)
+        self.assertFalse(ttml.subrip_memo.active)
+
     def test_time_positions(self):
 
         positions = {
@@ -180,12 +500,12 @@ class Tester(unittest.TestCase):
             'rotten.netflix.en.xml': (
                 ('a food to be eaten every day.', 33.434 * 1000, 500),
                 ('At the bottom is the exit tube.', 2303.821 * 1000, 500),
-                ('but they guzzle a shringking water supply.', 3206.242 * 1000, 250),
+                ('but they guzzle a shrinking water supply.', 3205.869 * 1000, 250),
 
             ),
 
             'darkest.hour.netflix.en.xml': (
-                ('under the leadership of Mr. Chamberlain', 231.443 * 1000, 500),
+                ('under the leadership of Mr. Chamberlain,', 231.443 * 1000, 500),
                 ('Uh, Neville, would you...', 4009.489 * 1000, 500),
                 ('There shall be no negotiated peace.', 6705.056 * 1000, 500),
             ),
@@ -207,8 +527,11 @@ class Tester(unittest.TestCase):
                 [ttml.process_parag(p) for p in ttml.lines], key=lambda x: x[0])
             position_pairings = positions[ttml_file]
             for line_match, pos, margin in position_pairings:
+                matched = False
                 for bms, ems, _b, _e, line in subs:
-                    if line.strip() == line_match:
+                    # Lines may carry style tags (<i>, <font color=...>)
+                    if re.sub(r'<[^<>]*>', '', line).strip() == line_match:
+                        matched = True
                         try:
                             self.assertTrue(
                                 bms <= pos + margin and bms >= pos - margin)
@@ -216,13 +539,682 @@ class Tester(unittest.TestCase):
                             raise AssertionError(
                                 'calculated pos: {}, wanted: {}, margin: {}'.format(
                                     bms, pos, margin))
+                self.assertTrue(matched,
+                    '{}: no line "{}"'.format(ttml_file, line_match))
 
     def test_files(self):
-        with open(os.devnull, 'w') as f:
+        with io.open(os.devnull, 'w', encoding='utf-8') as f:
             for ttml_doc in os.listdir(SAMPLE_DIR):
                 ttml = Ttml2Srt(os.path.join(SAMPLE_DIR, ttml_doc))
                 for p in ttml.paragraphs(generator=True):
                     f.write(p)
 
+    def test_iterparse_matches_minidom(self):
+        for ttml_doc in os.listdir(SAMPLE_DIR):
+            path = os.path.join(SAMPLE_DIR, ttml_doc)
+            expected = Ttml2Srt(path).paragraphs()
+            ttml = Ttml2Srt(path, parser='iterparse')
+            self.assertEqual(ttml.paragraphs(), expected)
+            # Reading the source again should give the same result
+            self.assertEqual(ttml.paragraphs(), expected)
+
+    def test_paragraph_order(self):
+        for parser in Ttml2Srt.PARSERS:
+            for source in (io.BytesIO, ReadOnlyStream):
+                ttml = Ttml2Srt(source(UNORDERED_TTML), parser=parser)
+                self.assertEqual(ttml.paragraphs(), UNORDERED_SRT)
+
+        ttml = Ttml2Srt(os.path.join(SAMPLE_DIR, 'netflix-001.xml'),
+            parser='iterparse')
+        paragraphs = ttml.iter_paragraphs()
+        self.assertEqual(next(paragraphs), ttml.to_paragraphs()[0])
+
+    def test_time_containers(self):
+        for parser in Ttml2Srt.PARSERS:
+            ttml = Ttml2Srt(io.BytesIO(CONTAINED_TTML), parser=parser)
+            self.assertTrue(ttml._begins_monotonic())
+            self.assertEqual(ttml.paragraphs(), CONTAINED_SRT)
+
+    def test_encodings(self):
+        text = u'<?xml version="1.0" encoding="{}"?>\n' \
+            u'<tt xmlns="http://www.w3.org/ns/ttml"><body><div>\n' \
+            u'<p begin="1s" end="2s">{}</p>\n' \
+            u'</div></body></tt>\n'
+        srt = u'1\n00:00:01,000 --> 00:00:02,000\n{}\n\n'
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for encoding, dialogue in (
+                    ('utf-16', u'caf\xe9 \u5b57\u5e55'),
+                    ('windows-1252', u'caf\xe9 \u2019'),
+                    ('shift_jis', u'\u5b57\u5e55 \u2019')):
+                data = text.format(encoding, dialogue).encode(encoding)
+                path = os.path.join(tmpdir, encoding)
+                with open(path, 'wb') as f:
+                    f.write(data)
+                with open(path, 'rb') as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    for parser in Ttml2Srt.PARSERS:
+                        for source in (path, bytearray(data), memoryview(data),
+                                mapped):
+                            mapped.seek(0)
+                            ttml = Ttml2Srt(source, parser=parser)
+                            self.assertEqual(ttml.encoding, encoding)
+                            self.assertEqual(ttml.paragraphs(),
+                                srt.format(dialogue))
+                    mapped.close()
+                # Documents read as text keep their declaration
+                for parser in Ttml2Srt.PARSERS:
+                    for ttml in (
+                            Ttml2Srt.from_string(text.format(encoding, dialogue),
+                                parser=parser),
+                            Ttml2Srt(io.StringIO(text.format(encoding, dialogue)),
+                                parser=parser)):
+                        self.assertEqual(ttml.encoding, encoding)
+                        self.assertEqual(ttml.paragraphs(), srt.format(dialogue))
+        finally:
+            shutil.rmtree(tmpdir)
+
+        self.assertRaises(NotImplementedError, Ttml2Srt,
+            bytearray(text.format('x-unknown', u'').encode('utf-8')))
+
+    def test_structured_cues(self):
+        expected = [
+            (1000, 2000, [('Whole ', ('font color="yellow"', 'i')),
+                ('line', ('i',))]),
+            (3000, 4000, [('a ', ()), ('b c d', ('i',)), ('\n', ()),
+                ('e', ('i',)), (' f', ())]),
+            (5000, 6000, [('g', ('i',)), ('\nh', ())]),
+        ]
+        for parser in Ttml2Srt.PARSERS:
+            for document in (STYLED_TTML, STYLED_TTML.decode('utf-8')):
+                ttml = Ttml2Srt.from_string(document, parser=parser)
+                cues = list(ttml.iter_structured_cues())
+                self.assertEqual(cues, expected)
+                self.assertEqual(cues[0].runs[0].text, 'Whole ')
+                self.assertTrue(cues[0].runs[0].italic)
+                self.assertEqual(cues[0].runs[0].color, 'yellow')
+                self.assertEqual(cues[0].runs[1].color, None)
+                self.assertEqual(ttml.paragraphs(), STYLED_SRT)
+
+    def test_structured_escaped_text(self):
+        document = b'''<?xml version="1.0" encoding="utf-8"?>
+<tt xmlns="http://www.w3.org/ns/ttml" xmlns:tts="http://www.w3.org/ns/ttml#styling">
+<body><div>
+<p begin="1s" end="3s">x &lt;b&gt; y &lt;/b&gt; z</p>
+<p begin="2s" end="4s"><span tts:fontStyle="italic">&amp;lt;i&gt;</span></p>
+</div></body>
+</tt>
+'''
+        expected = [(1000, 4000, [('x <b> y </b> z\n', ()),
+            ('&lt;i>', ('i',))])]
+        cache_dir = tempfile.mkdtemp()
+        try:
+            for parser in Ttml2Srt.PARSERS:
+                # Read, then restored from the cache
+                for _ in range(2):
+                    ttml = Ttml2Srt.from_string(document, parser=parser,
+                        cache=CueCache(cache_dir))
+                    self.assertEqual(list(ttml.iter_structured_cues()),
+                        expected)
+                    self.assertEqual(ttml.to_paragraphs(), [(
+                        '00:00:01,000', '00:00:04,000',
+                        'x <b> y </b> z\n<i>&lt;i></i>')])
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_generated(self):
+        document = ttmlgen.document(2000, overlap=0.3)
+        self.assertEqual(document, ttmlgen.document(2000, overlap=0.3))
+        self.assertNotEqual(document, ttmlgen.document(2000, seed=1))
+
+        ttml = Ttml2Srt.from_string(document)
+        begins = re.findall(r'<p begin="([^"]+)"', document.decode('utf-8'))
+        self.assertEqual(len(begins), 2000)
+        # Every conversion, clock times with and without frames sharing one
+        self.assertEqual(len(set(ttml.determine_ms_convfn(b).__name__ \
+            for b in begins)), 8)
+        self.assertTrue(ttml._begins_monotonic())
+
+        srt = ttml.paragraphs()
+        self.assertEqual(Ttml2Srt.from_string(document,
+            parser='iterparse').paragraphs(), srt)
+        # Overlapping paragraphs merged, every line kept
+        self.assertTrue(srt.count(' --> ') < 1600)
+        self.assertEqual(sorted(int(n) for n in re.findall(
+            r'(?m) (\d+)(?:</i>)?$', srt)),
+            list(range(2000)))
+        self.assertTrue('<i>' in srt)
+        self.assertFalse('<br' in srt)
+
+        # A <div> per paragraph, iterparse dropping each as it ends
+        document = ttmlgen.document(500, div_size=1)
+        self.assertEqual(document.count(b'<div>'), 500)
+        self.assertEqual(Ttml2Srt.from_string(document,
+            parser='iterparse').paragraphs(),
+            Ttml2Srt.from_string(document).paragraphs())
+
+    def test_cue_store(self):
+        ttml = get_ttml()
+        cues = CueStore([(3000, 4000, 'c'), (1000, 2500, 'a'),
+            (2000, 2200, 'b'), (1000, 1500.5, 'a2')])
+        self.assertFalse(cues.is_sorted())
+        cues.sort()
+        self.assertTrue(cues.is_sorted())
+        self.assertEqual([text for _b, _e, text in cues], ['a', 'a2', 'b', 'c'])
+        self.assertEqual(
+            list(ttml.with_subrip_times(ttml.iter_merged(cues))),
+            ttml.sequalize([(b, e, ttml.ms_to_subrip(b), ttml.ms_to_subrip(e),
+                text) for b, e, text in cues]))
+        self.assertEqual(list(ttml.iter_merged(cues)), [
+            (1000, 2500, 'a\na2\nb'), (3000, 4000, 'c')])
+
+    def test_overlap(self):
+        # b overlaps a only, c overlaps a but not b, d touches c
+        cues = [(0, 10, 'a'), (2, 4, 'b'), (6, 12, 'c'), (12, 13, 'd')]
+        expected = {
+            'merge': [(0, 12, 'a\nb\nc'), (12, 13, 'd')],
+            'split': [(0, 2, 'a'), (2, 4, 'a\nb'), (4, 6, 'a'),
+                (6, 10, 'a\nc'), (10, 12, 'c'), (12, 13, 'd')],
+            'keep': cues,
+        }
+        for overlap in Ttml2Srt.OVERLAP_POLICIES:
+            ttml = get_ttml(overlap=overlap)
+            self.assertEqual(list(ttml.iter_merged(cues)), expected[overlap])
+            self.assertEqual(list(ttml.iter_merged(CueStore(cues))),
+                expected[overlap])
+
+        for parser in Ttml2Srt.PARSERS:
+            ttml = Ttml2Srt(io.BytesIO(UNORDERED_TTML), parser=parser,
+                overlap='split')
+            self.assertEqual(ttml.paragraphs().split('\n\n')[:4], [
+                '1\n00:00:01,000 --> 00:00:02,000\na',
+                '2\n00:00:02,000 --> 00:00:02,200\na\nb',
+                '3\n00:00:02,200 --> 00:00:02,500\na',
+                '4\n00:00:03,000 --> 00:00:04,000\nc'])
+
+        # Split slices are counted apart from merged cues
+        stats = ConversionStats()
+        ttml = Ttml2Srt(io.BytesIO(UNORDERED_TTML), stats=stats,
+            overlap='split')
+        self.assertEqual(len(ttml.to_paragraphs()), 5)
+        self.assertEqual(stats.counters['slices'], 5)
+        self.assertFalse('merged' in stats.counters)
+
+        # A cue ending before it begins never shows when split
+        self.assertEqual(
+            list(get_ttml(overlap='split').iter_merged(
+                [(0, 10, 'a'), (5, 3, 'b'), (6, 12, 'c')])),
+            [(0, 6, 'a'), (6, 10, 'a\nc'), (10, 12, 'c')])
+
+        self.assertRaises(ValueError, get_ttml, overlap='drop')
+
+    def test_whitespace(self):
+        for parser in Ttml2Srt.PARSERS:
+            for whitespace in Ttml2Srt.WHITESPACE_POLICIES:
+                ttml = Ttml2Srt(io.BytesIO(WHITESPACE_TTML), parser=parser,
+                    whitespace=whitespace)
+                self.assertEqual(list(ttml.iter_cues()),
+                    [(1000, 2000, WHITESPACE_DIALOGUE[whitespace])])
+
+        # Dialogue is cached per policy
+        cache_dir = tempfile.mkdtemp()
+        try:
+            cache = CueCache(cache_dir)
+            for whitespace in ('default', 'strip', 'default', 'strip'):
+                ttml = Ttml2Srt(io.BytesIO(WHITESPACE_TTML), cache=cache,
+                    whitespace=whitespace)
+                self.assertEqual(list(ttml.iter_cues())[0][2],
+                    WHITESPACE_DIALOGUE[whitespace])
+            self.assertEqual((cache.misses, cache.hits), (2, 2))
+        finally:
+            shutil.rmtree(cache_dir)
+
+        self.assertRaises(ValueError, get_ttml, whitespace='trim')
+
+    def test_resync(self):
+        time_map = TimeMap([(10000, 12000), (0, 1000), (20000, 20000)])
+        times = [-1000, 0, 5000, 10000, 15000, 20000, 30000]
+        expected = [0, 1000, 6500, 12000, 16000, 20000, 30000]
+
+        numpy = ttml2srt._numpy()
+        try:
+            for module in set([numpy, None]):
+                ttml2srt._numpy_module[:] = [module]
+                self.assertEqual(list(time_map.map_array(times)), expected)
+        finally:
+            ttml2srt._numpy_module[:] = [numpy]
+
+        self.assertRaises(ValueError, TimeMap, [(0, 1000), (10000, 500)])
+        self.assertRaises(ValueError, TimeMap, [(0, 1000), (0, 2000)])
+
+        # A single anchor is a shift, on both the streaming and sorting path
+        self.assertEqual(get_ttml(anchors=[(0, 1500)]).paragraphs(),
+            get_ttml(shift=1500).paragraphs())
+        self.assertEqual(
+            Ttml2Srt(io.BytesIO(UNORDERED_TTML), anchors=[(0, 1500)]).paragraphs(),
+            Ttml2Srt(io.BytesIO(UNORDERED_TTML), shift=1500).paragraphs())
+
+        anchors_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(anchors_dir, 'anchors.txt')
+            with open(path, 'w') as f:
+                f.write('# source target\n00:00:01,000 --> 00:00:02.500\n\n'
+                    '60000 61000\n')
+            self.assertEqual(load_anchors(path), [(1000, 2500), (60000, 61000)])
+        finally:
+            shutil.rmtree(anchors_dir)
+
+
+    @unittest.skipIf(ttml2srt._numpy() is None, 'needs numpy')
+    def test_resync_numpy(self):
+        time_map = TimeMap([(1000, 1333), (7001, 9002), (60000, 59999.5)])
+        # Fractional times around and between the anchors
+        times = [t / 7.0 for t in range(-7000, 490000, 3)] + [
+            1000.5, 7001, 60000, 60000.5, 3000.25]
+
+        numpy = ttml2srt._numpy()
+        try:
+            ttml2srt._numpy_module[:] = [None]
+            expected = list(time_map.map_array(times))
+        finally:
+            ttml2srt._numpy_module[:] = [numpy]
+        self.assertEqual(list(time_map.map_array(times)), expected)
+        self.assertEqual(expected[-1], 3889.227)
+    def test_segments(self):
+        for parser in Ttml2Srt.PARSERS:
+            stats = ConversionStats()
+            ttml = SegmentedTtml2Srt(segment_sources(), parser=parser,
+                stats=stats)
+            self.assertEqual(ttml.paragraphs(), SEGMENTS_SRT)
+            self.assertEqual(ttml.lang, 'en')
+            self.assertEqual(stats.counters['segments'], len(SEGMENTS))
+            self.assertEqual(stats.counters['duplicates'], 3)
+
+        # Cues held back are those still liable to be repeated
+        ttml = SegmentedTtml2Srt(None)
+        cues = ttml.iter_deduplicated(iter([
+            [(0, 1000, 'a'), (500, 4000, 'b')],
+            [(500, 4000, 'b'), (2000, 3000, 'c')],
+        ]))
+        self.assertEqual(next(cues), (0, 1000, 'a'))
+        self.assertEqual(list(cues), [(500, 4000, 'b'), (2000, 3000, 'c')])
+
+    def test_write_formats(self):
+        ttml = Ttml2Srt(io.BytesIO(STYLED_TTML))
+        outputs = [('srt', io.StringIO()), ('vtt', io.StringIO()),
+            ('ass', io.BytesIO())]
+        self.assertEqual(ttml.write_formats(outputs), 3)
+        srt, vtt, ass = [output.getvalue() for _name, output in outputs]
+
+        self.assertEqual(srt, STYLED_SRT)
+        self.assertEqual(vtt, 'WEBVTT\n\n' + re.sub(
+            r'(?m)^\d+\n', '', STYLED_SRT).replace(',', '.').replace(
+            '<font color="yellow">Whole </font>', '<c.yellow>Whole </c>'))
+        events = ass.decode('utf-8').split('[Events]\n')[1]
+        self.assertEqual(events.split('\n')[1:], [
+            'Dialogue: 0,0:00:01.00,0:00:02.00,Default,,0,0,0,,'
+                '{\\i1}{\\c&H00FFFF&}Whole {\\c}{\\i0}{\\i1}line{\\i0}',
+            'Dialogue: 0,0:00:03.00,0:00:04.00,Default,,0,0,0,,'
+                'a {\\i1}b {\\i0}{\\i1}c{\\i0}{\\i1} d{\\i0}\\N{\\i1}e{\\i0} f',
+            'Dialogue: 0,0:00:05.00,0:00:06.00,Default,,0,0,0,,'
+                '{\\i1}g{\\i0}\\Nh',
+            ''])
+        self.assertEqual(
+            VttWriter(ttml).escape('<i>a</i> -> b &amp; &lt;c>'),
+            '<i>a</i> -&gt; b &amp; &lt;c&gt;')
+
+        # Text reading as tags or ASS override blocks stays text
+        ttml = Ttml2Srt(io.BytesIO(STYLED_TTML.replace(
+            b'>h</p>', b'>&lt;i&gt;h&lt;/i&gt; &amp; {\\an8}</p>').replace(
+            b'Whole <span', b'&lt;font color="red"&gt;Whole <span')))
+        outputs = [('srt', io.StringIO()), ('vtt', io.StringIO()),
+            ('ass', io.StringIO())]
+        ttml.write_formats(outputs)
+        srt, vtt, ass = [output.getvalue() for _name, output in outputs]
+        self.assertEqual(srt, ttml.paragraphs())
+        self.assertIn('<i>g</i>\n<i>h</i> & {\\an8}\n', srt)
+        self.assertIn('<i>g</i>\n&lt;i&gt;h&lt;/i&gt; &amp; {\\an8}\n', vtt)
+        self.assertIn('<i><c.yellow>&lt;font color="red"&gt;Whole </c></i>',
+            vtt)
+        self.assertIn('{\\i1}g{\\i0}\\N<i>h</i> & \\{\\an8\\}\n', ass)
+        self.assertIn('{\\c&H00FFFF&}<font color="red">Whole {\\c}', ass)
+
+    def test_output_targets(self):
+        ttml = Ttml2Srt(os.path.join(SAMPLE_DIR, 'netflix-001.xml'))
+        expected = ttml.paragraphs()
+        count = expected.count(' --> ')
+
+        self.assertEqual(ttml.to_bytes(), expected.encode('utf-8'))
+
+        for handle, to_text in (
+                (io.StringIO(), lambda h: h.getvalue()),
+                (io.BytesIO(), lambda h: h.getvalue().decode('utf-8'))):
+            self.assertEqual(ttml.write2file(handle), count)
+            self.assertEqual(to_text(handle), expected)
+
+        output_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(output_dir, 'out.srt')
+            self.assertEqual(ttml.write2file(path), count)
+            with io.open(path, 'rb') as f:
+                self.assertEqual(f.read(), expected.encode('utf-8'))
+        finally:
+            shutil.rmtree(output_dir)
+
+    def test_stdout_output(self):
+        path = os.path.join(SAMPLE_DIR, 'tvp.pl.Ekspedycja-41100771.pl.xml')
+        output = subprocess.check_output([sys.executable, 'ttml2srt.py', path])
+        self.assertEqual(output, Ttml2Srt(path).to_bytes())
+
+        output_dir = tempfile.mkdtemp()
+        try:
+            srt_path = os.path.join(output_dir, 'out.srt')
+            if bytes is str:
+                # A text mode file of Python 2 takes byte strings
+                handle = open(srt_path, 'w')
+            else:
+                handle = io.open(srt_path, 'w', encoding='utf-8')
+            Ttml2Srt(path).write2file(handle, close_fd=True)
+            with io.open(srt_path, 'rb') as f:
+                self.assertEqual(f.read(), output)
+        finally:
+            shutil.rmtree(output_dir)
+
+    @unittest.skipIf(ttml2srt_aio is None, 'asyncio API needs Python 3.7+')
+    def test_async(self):
+        path = os.path.join(SAMPLE_DIR, 'netflix-001.xml')
+        with open(path, 'rb') as f:
+            data = f.read()
+        expected = Ttml2Srt(path)
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            stream = asyncio.StreamReader()
+            stream.feed_data(data)
+            stream.feed_eof()
+
+            converter = ttml2srt_aio.AsyncConverter(max_concurrency=2)
+            tasks = [loop.create_task(coro) for coro in (
+                ttml2srt_aio.convert_async(path),
+                converter.convert(data),
+                converter.convert(stream, parser='iterparse'),
+            )]
+            self.assertEqual(
+                [loop.run_until_complete(task) for task in tasks],
+                [expected.paragraphs()] * 3)
+
+            paragraphs = []
+            iterator = converter.iter_paragraphs(path, batch_size=10)
+            while True:
+                try:
+                    paragraphs.append(
+                        loop.run_until_complete(iterator.__anext__()))
+                except StopAsyncIteration:
+                    break
+            self.assertEqual(paragraphs, expected.to_paragraphs())
+
+            task = loop.create_task(converter.convert(path))
+            loop.call_soon(task.cancel)
+            self.assertRaises(
+                asyncio.CancelledError, loop.run_until_complete, task)
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+    @unittest.skipIf(ttml2srt_aio is None, 'asyncio API needs Python 3.7+')
+    def test_async_process_pool(self):
+        path = os.path.join(SAMPLE_DIR, 'netflix-001.xml')
+        with open(path, 'rb') as f:
+            data = f.read()
+        expected = Ttml2Srt(path)
+
+        loop = asyncio.new_event_loop()
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=2)
+        try:
+            converter = ttml2srt_aio.AsyncConverter(executor)
+            self.assertEqual(
+                loop.run_until_complete(converter.convert(data)),
+                expected.paragraphs())
+            self.assertEqual(
+                loop.run_until_complete(converter.load(path)).paragraphs(),
+                expected.paragraphs())
+
+            paragraphs = []
+            iterator = converter.iter_paragraphs(path, parser='iterparse')
+            while True:
+                try:
+                    paragraphs.append(
+                        loop.run_until_complete(iterator.__anext__()))
+                except StopAsyncIteration:
+                    break
+            self.assertEqual(paragraphs, expected.to_paragraphs())
+        finally:
+            executor.shutdown()
+            loop.close()
+
+    def test_server(self):
+        path = os.path.join(SAMPLE_DIR, 'netflix-001.xml')
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        for jobs in (1, 2):
+            server = make_server(('127.0.0.1', 0), jobs, shift=1000)
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+            try:
+                conn = HTTPConnection(*server.server_address[:2])
+
+                def request(method, url, body=None):
+                    conn.request(method, url, body)
+                    response = conn.getresponse()
+                    return response.status, response.read()
+
+                self.assertEqual(request('POST', '/', data), (
+                    200, Ttml2Srt(path, shift=1000).to_bytes()))
+                self.assertEqual(request('POST', '/?shift=0&fps=25', data), (
+                    200, Ttml2Srt(path, source_fps=25).to_bytes()))
+                self.assertEqual(request('POST', '/?shift=x', data)[0], 400)
+                self.assertEqual(request('POST', '/', b'<tt')[0], 422)
+
+                status, body = request('GET', '/stats')
+                stats = json.loads(body.decode('utf-8'))
+                self.assertEqual((stats['requests'], stats['errors']), (4, 2))
+                self.assertTrue(stats['latency_ms']['max'] > 0)
+                conn.close()
+            finally:
+                server.shutdown()
+                server.server_close()
+                thread.join()
+
+    def test_style_resolution(self):
+        for parser in Ttml2Srt.PARSERS:
+            ttml = Ttml2Srt(io.BytesIO(STYLED_TTML), parser=parser)
+            self.assertEqual(ttml.paragraphs(), STYLED_SRT)
+            self.assertEqual(sorted(ttml.italic_style_ids), ['derived', 'italic'])
+
+    def test_style_cascade(self):
+        for parser in Ttml2Srt.PARSERS:
+            ttml = Ttml2Srt(io.BytesIO(CASCADED_TTML), parser=parser)
+            self.assertEqual(ttml.paragraphs(), CASCADED_SRT)
+            self.assertEqual(sorted(ttml.italic_style_ids), ['loop1', 'loop2'])
+
+        ttml = Ttml2Srt(io.BytesIO(CASCADED_TTML))
+        outputs = [('vtt', io.StringIO()), ('ass', io.BytesIO())]
+        ttml.write_formats(outputs)
+        vtt = outputs[0][1].getvalue()
+        self.assertTrue('<b>a </b><c.red><b>b</b></c>' in vtt)
+        self.assertTrue('<c.lime><b>i</b></c>' in vtt)
+        self.assertTrue('{\\b1}a {\\b0}{\\c&H0000FF&}{\\b1}b{\\b0}{\\c}' in
+            outputs[1][1].getvalue().decode('utf-8'))
+
+        # One resolution per distinct combination of styles
+        ttml = Ttml2Srt.from_string(ttmlgen.document(500))
+        ttml.paragraphs()
+        self.assertTrue(len(ttml._element_tags) < 10)
+
+    def test_batch(self):
+        output_dir = tempfile.mkdtemp()
+        try:
+            paths = find_ttml_files([
+                os.path.join(SAMPLE_DIR, 'netflix-00[1-3].xml'),
+                os.path.join(SAMPLE_DIR, 'netflix-001.xml'),
+                os.path.join(SAMPLE_DIR, 'missing.xml'),
+            ])
+            self.assertEqual(len(paths), 4)
+            results = sorted(convert_batch(paths, output_dir, jobs=2))
+            errors = [r[-1] for r in results if r[-1]]
+            self.assertEqual(len(errors), 1)
+            self.assertEqual(
+                sorted(os.listdir(output_dir)),
+                ['netflix-001.srt', 'netflix-002.srt', 'netflix-003.srt'])
+            with io.open(os.path.join(output_dir, 'netflix-002.srt'),
+                    encoding='utf-8') as f:
+                self.assertEqual(
+                    f.read(),
+                    Ttml2Srt(os.path.join(SAMPLE_DIR, 'netflix-002.xml')).paragraphs())
+        finally:
+            shutil.rmtree(output_dir)
+
+    def test_batch_subdirectories(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            source = os.path.join(SAMPLE_DIR, 'netflix-001.xml')
+            paths = []
+            for name in ('a/ep1.xml', 'b/ep1.xml', 'a/ep1.ttml'):
+                paths.append(os.path.join(tmpdir, 'src', *name.split('/')))
+                if not os.path.isdir(os.path.dirname(paths[-1])):
+                    os.makedirs(os.path.dirname(paths[-1]))
+                shutil.copy(source, paths[-1])
+            output_dir = os.path.join(tmpdir, 'out')
+            results = dict((r[0], r) for r in convert_batch(
+                paths, output_dir, jobs=2))
+            self.assertEqual(
+                results[paths[0]][1], os.path.join(output_dir, 'a', 'ep1.srt'))
+            self.assertEqual(
+                results[paths[1]][1], os.path.join(output_dir, 'b', 'ep1.srt'))
+            self.assertEqual(
+                results[paths[2]][-1],
+                'ValueError: same output as {}'.format(paths[0]))
+            srt = Ttml2Srt(source).paragraphs()
+            for subdir in ('a', 'b'):
+                self.assertEqual(os.listdir(os.path.join(output_dir, subdir)),
+                    ['ep1.srt'])
+                with io.open(os.path.join(output_dir, subdir, 'ep1.srt'),
+                        encoding='utf-8') as f:
+                    self.assertEqual(f.read(), srt)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_manifest(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            paths = []
+            for ttml_doc in ('netflix-001.xml', 'netflix-002.xml',
+                    'netflix-003.xml'):
+                paths.append(os.path.join(tmpdir, ttml_doc))
+                shutil.copy(os.path.join(SAMPLE_DIR, ttml_doc), paths[-1])
+            results = os.path.join(tmpdir, 'results.jsonl')
+            entries = [{'input': paths[0]}, {'input': paths[1], 'shift': 500},
+                paths[2]]
+
+            def run(entries):
+                return dict((r['input'], r) for r in convert_manifest(
+                    entries, results, jobs=2))
+
+            records = run(entries)
+            self.assertEqual(
+                [records[path]['status'] for path in paths], ['converted'] * 3)
+            record = records[paths[1]]
+            self.assertEqual(record['params']['shift'], 500)
+            self.assertEqual(record['outputs'],
+                [os.path.join(tmpdir, 'netflix-002.srt')])
+            srt = Ttml2Srt(paths[1], shift=500).paragraphs()
+            with io.open(record['outputs'][0], encoding='utf-8') as f:
+                self.assertEqual(f.read(), srt)
+            self.assertEqual(record['cues'], srt.count(' --> '))
+            self.assertTrue(record['seconds'] >= 0)
+
+            # Nothing changed; then a touched file and a changed parameter
+            records = run(entries)
+            self.assertEqual(
+                [records[path]['status'] for path in paths], ['unchanged'] * 3)
+            os.utime(paths[0], (1e9, 1e9))
+            entries[1]['shift'] = 1000
+            records = run(entries)
+            self.assertEqual([records[path]['status'] for path in paths],
+                ['unchanged', 'converted', 'unchanged'])
+
+            # Resume after a run interrupted while writing its last result
+            with io.open(results, encoding='utf-8') as f:
+                lines = f.readlines()
+            with io.open(results, 'w', encoding='utf-8') as f:
+                f.writelines(lines[:-1] + [lines[-1][:40]])
+            with open(paths[2], 'ab') as f:
+                f.write(b'\n')
+            records = run(entries)
+            self.assertEqual([records[path]['status'] for path in paths],
+                ['unchanged', 'converted', 'converted'])
+            self.assertEqual(
+                [r['status'] for r in convert_manifest(entries, results)],
+                ['unchanged'] * 3)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            cache = CueCache(cache_dir)
+            for ttml_doc in ('netflix-077.xml', 'hbonordic-001.xml'):
+                path = os.path.join(SAMPLE_DIR, ttml_doc)
+                for kwargs in ({}, {'shift': 1000, 'source_fps': 25}, {}):
+                    self.assertEqual(
+                        Ttml2Srt(path, cache=cache, **kwargs).paragraphs(),
+                        Ttml2Srt(path, **kwargs).paragraphs())
+            self.assertEqual(cache.misses, 2)
+            self.assertEqual(cache.hits, 4)
+            self.assertEqual(cache.stats()['entries'], 2)
+
+            # Evict down to the most recently used entry
+            cache.max_size = max(
+                size for _mtime, size, _path in cache._entries())
+            cache.evict()
+            self.assertEqual(cache.stats()['entries'], 1)
+
+            # Puts only list the directory on the first put and once past
+            # the limit, which still holds
+            cache = CueCache(cache_dir, 2000)
+            listings = []
+            entries = cache._entries
+            cache._entries = lambda: listings.append(1) or entries()
+            for i in range(5):
+                cache.put(str(i), {'text': 'x' * 400})
+                self.assertTrue(sum(os.path.getsize(os.path.join(cache_dir,
+                    name)) for name in os.listdir(cache_dir)) <= 2000)
+            self.assertEqual(len(listings), 2)
+            self.assertEqual(cache.stats()['entries'], 4)
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_stats(self):
+        events = []
+        stats = ConversionStats(callback=lambda *e: events.append(e))
+        path = os.path.join(SAMPLE_DIR, 'netflix-001.xml')
+        ttml = Ttml2Srt(path, stats=stats)
+        count = ttml.write2file(open(os.devnull, 'w'), close_fd=True)
+
+        self.assertEqual(
+            sorted(stats.durations), sorted(ConversionStats.STAGES))
+        self.assertEqual(stats.counters['paragraphs'], count)
+        self.assertEqual(
+            stats.counters['cues'] - stats.counters['merged'], count)
+        self.assertEqual(
+            stats.counters['output_bytes'],
+            len(Ttml2Srt(path).paragraphs().encode('utf-8')))
+        self.assertTrue(stats.counters['text_nodes'] >= count)
+        self.assertIn(('write', stats.durations['write']), events)
+        self.assertIn('paragraphs', stats.report())
+
 if __name__ == '__main__':
     unittest.main()
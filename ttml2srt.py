@@ -1,7 +1,1139 @@
 # -*- coding: utf-8 -*-
 
-from xml.dom import minidom
-import re
+# Heavier modules (xml parsers, re, json, hashlib, argparse, ...) are
+# imported where they're used to keep command line startup short
+from array import array
+from collections import namedtuple
+import io
+import itertools
+import os
+import sys
+import time
+
+# Monotonic clock for timing stages (Python 2 lacks perf_counter)
+_clock = getattr(time, 'perf_counter', time.time)
+
+XML_NS = 'http://www.w3.org/XML/1998/namespace'
+
+# xml.dom.Node.ELEMENT_NODE and TEXT_NODE
+ELEMENT_NODE = 1
+TEXT_NODE = 3
+
+# Paragraphs formatted before each write of SubRip output
+OUTPUT_CHUNK_SIZE = 512
+
+# Entries of the time expression and SubRip timestamp memos of a document,
+# and those stored before a memo with too few hits is turned off
+MEMO_SIZE = 4096
+MEMO_PROBE = 128
+
+# ms per unit of offset-time metrics with a fixed length
+METRIC_MS = {
+    'h': 3.6e6,
+    'm': 60 * 1000,
+}
+
+# TTML named colors (tts:color), as #rrggbb
+NAMED_COLORS = {
+    'transparent': '#000000',
+    'black': '#000000',
+    'silver': '#c0c0c0',
+    'gray': '#808080',
+    'white': '#ffffff',
+    'maroon': '#800000',
+    'red': '#ff0000',
+    'purple': '#800080',
+    'fuchsia': '#ff00ff',
+    'magenta': '#ff00ff',
+    'green': '#008000',
+    'lime': '#00ff00',
+    'olive': '#808000',
+    'yellow': '#ffff00',
+    'navy': '#000080',
+    'blue': '#0000ff',
+    'teal': '#008080',
+    'aqua': '#00ffff',
+    'cyan': '#00ffff',
+}
+
+
+def _subrip_color(value):
+    """Return TTML color `value` as the color of a SubRip <font> tag: a
+    named color or #rrggbb, opacity dropped. '' for white, which text is
+    shown in anyway, and for fully transparent colors. None for values
+    that aren't colors.
+    """
+
+    value = value.strip().lower()
+    alpha = 255
+    try:
+        if value.startswith('#') and len(value) in (7, 9):
+            color = '#' + value[1:7]
+            int(color[1:], 16)
+            if len(value) == 9:
+                alpha = int(value[7:], 16)
+        elif value.startswith('rgb') and value.endswith(')'):
+            parts = [int(part) for part in
+                value[value.index('(') + 1:-1].split(',')]
+            if len(parts) != (4 if value.startswith('rgba') else 3):
+                return None
+            color = '#{:02x}{:02x}{:02x}'.format(*parts[:3])
+            alpha = parts[3] if len(parts) == 4 else 255
+        elif value in NAMED_COLORS:
+            color = value
+            alpha = 0 if value == 'transparent' else 255
+        else:
+            return None
+    except ValueError:
+        return None
+
+    if not alpha or NAMED_COLORS.get(color, color) == '#ffffff':
+        return ''
+    return color
+
+
+_regexes = {}
+
+
+def _regex(pattern):
+    """Return `pattern` compiled, importing re and compiling on first use
+    """
+
+    try:
+        return _regexes[pattern]
+    except KeyError:
+        import re
+        return _regexes.setdefault(pattern, re.compile(pattern))
+
+
+# Runs of XML whitespace other than a single space
+_WHITESPACE_RUNS = r' [ \t\r\n]+|[\t\r\n][ \t\r\n]*'
+
+
+def _unindent(text):
+    # Take the liberty to make a few stylistic choices. We don't
+    # want too many leading spaces or any unnessary new lines
+    text = text.replace('\n', '')
+    stripped = text.lstrip()
+    return stripped if len(text) - len(stripped) >= 4 else text
+
+
+def _keep_text(text):
+    return text
+
+
+def _collapse(text):
+    # Matching allocates, even when nothing matches
+    if '  ' in text or '\n' in text or '\t' in text or '\r' in text:
+        return _regex(_WHITESPACE_RUNS).sub(' ', text)
+    return text
+
+
+def _escape_markup(text):
+    # Text that would read as SubRip style tags
+    if '<' in text or '&' in text:
+        return text.replace('&', '&amp;').replace('<', '&lt;')
+    return text
+
+
+def _unescape_markup(text):
+    if '&' in text:
+        return text.replace('&lt;', '<').replace('&amp;', '&')
+    return text
+
+
+def _text_normalizer(policy):
+    """Return the function normalizing text nodes under whitespace
+    `policy` (see Ttml2Srt.WHITESPACE_POLICIES)
+    """
+
+    if policy == 'default':
+        return _unindent
+    if policy == 'keep':
+        return _keep_text
+    return _collapse
+
+
+def _strip_lines(dialogue):
+    """Drop spaces at the start and end of each line of `dialogue`,
+    inside style tags too
+    """
+
+    if not (dialogue.startswith(' ') or dialogue.endswith(' ') or
+            ' \n' in dialogue or '\n ' in dialogue or
+            '> ' in dialogue or ' <' in dialogue):
+        return dialogue
+
+    def tags_only(match):
+        edge = match.group()
+        return ''.join(_regex(r'<[^<>]*>').findall(edge)) if ' ' in edge \
+            else edge
+
+    # Spaces among the opening tags a line starts with, and among the
+    # closing tags it ends with
+    dialogue = _regex(r'(?m)^(?: |<[^/<>][^<>]*>)+').sub(tags_only, dialogue)
+    return _regex(r'(?m)(?: |</[^<>]+>)+$').sub(tags_only, dialogue)
+
+
+def _local_name(tag):
+    return tag.rpartition('}')[2]
+
+
+# Byte order marks and the encodings they stand for, UTF-32 ones first as
+# the UTF-32-LE mark begins with the UTF-16-LE one
+BOMS = (
+    (b'\xff\xfe\x00\x00', 'utf-32'),
+    (b'\x00\x00\xfe\xff', 'utf-32'),
+    (b'\xff\xfe', 'utf-16'),
+    (b'\xfe\xff', 'utf-16'),
+    (b'\xef\xbb\xbf', 'utf-8'),
+)
+
+# Document data given to Ttml2Srt in place of a path or a file object. On
+# Python 2 bytes is str, which is taken as a path.
+BUFFER_TYPES = (bytearray, memoryview) + ((bytes,) if bytes is not str else ())
+
+
+def _sniff_encoding(head):
+    """Return the encoding of the XML document starting with `head`
+    (bytes): the one declared, or else the one of its byte order mark.
+    None when there is neither.
+    """
+
+    bom_encoding = None
+    for bom, bom_encoding in BOMS:
+        if head.startswith(bom):
+            break
+    else:
+        bom_encoding = None
+
+    if bom_encoding in ('utf-16', 'utf-32'):
+        head = head.decode(bom_encoding, 'ignore').encode('ascii', 'ignore')
+    elif bom_encoding:
+        head = head[len(bom):]
+
+    # Parsed without re, which plain conversions don't import otherwise
+    head = head.lstrip()
+    if not head.startswith(b'<?xml'):
+        return bom_encoding
+    declaration = head[:head.find(b'?>')]
+    start = declaration.find(b'encoding')
+    if start < 0:
+        return bom_encoding
+    value = declaration[start + len(b'encoding'):].lstrip()
+    if not value.startswith(b'='):
+        return bom_encoding
+    value = value[1:].lstrip()
+    end = value.find(value[:1], 1)
+    if value[:1] not in (b'"', b"'") or end < 0:
+        return bom_encoding
+    return value[1:end].decode('ascii')
+
+
+# Encodings expat decodes itself, by the names it knows them by
+EXPAT_ENCODINGS = ('UTF-8', 'UTF-16', 'UTF-16BE', 'UTF-16LE', 'ISO-8859-1',
+    'US-ASCII')
+
+
+def _needs_transcoding(encoding):
+    """Tell whether XML declared to be in `encoding` has to be transcoded
+    for expat.
+
+    Besides its own encodings, expat decodes single byte ones (Windows-1252,
+    ISO-8859-15, ...) through Python's codecs. Raises NotImplementedError
+    for encodings Python doesn't know.
+    """
+
+    if encoding.upper() in EXPAT_ENCODINGS:
+        return False
+
+    import codecs
+
+    try:
+        name = codecs.lookup(encoding).name
+    except LookupError:
+        raise NotImplementedError('No support for "{}" encoding'.format(
+            encoding))
+
+    # UTF-8 under another name (utf8) passes expat's test for single byte
+    # encodings, and then has its multi-byte sequences garbled
+    if name == 'utf-8':
+        return True
+    # The same test as expat's handler of other encodings
+    return len(bytearray(range(256)).decode(name, 'replace')) != 256
+
+
+def _parser_input(handle):
+    """Return the encoding of the XML document read from file object
+    `handle` and a file object reading it in a form expat can decode.
+
+    Text file objects (io.StringIO, files opened in text mode) are read
+    as UTF-8; their encoding is the declared one.
+    """
+
+    head = handle.read(1024)
+    if not isinstance(head, bytes):
+        return _sniff_encoding(head.encode('utf-8')), _TranscodingReader(
+            _PrefixedReader(head, handle), None)
+
+    encoding = _sniff_encoding(head)
+    reader = _PrefixedReader(head, handle)
+
+    if encoding and _needs_transcoding(encoding):
+        reader = _TranscodingReader(reader, encoding)
+
+    return encoding, reader
+
+
+def _is_binary_handle(handle):
+    """Tell whether a writable file-like object takes bytes"""
+
+    if isinstance(handle, io.TextIOBase):
+        return False
+    if isinstance(handle, (io.RawIOBase, io.BufferedIOBase)):
+        return True
+    # Python 2 files (sys.stdout included) and other file-likes outside of
+    # io take byte strings
+    return bytes is str or 'b' in getattr(handle, 'mode', '')
+
+
+def _open_output(output):
+    """Return (handle, write function, binary) for an output as taken by
+    :meth:`Ttml2Srt.write2file`
+    """
+
+    if hasattr(output, 'write') and callable(output.write):
+        return output, output.write, _is_binary_handle(output)
+    if hasattr(output, 'sendall'):
+        return output, output.sendall, True
+    if output is None or output == '-':
+        handle = getattr(sys.stdout, 'buffer', sys.stdout)
+        if handle is not sys.stdout:
+            sys.stdout.flush()
+        return handle, handle.write, _is_binary_handle(handle)
+    handle = open(output, 'wb')
+    return handle, handle.write, True
+
+
+def _close_output(handle, output, close_fd):
+    """Close (or flush) what :func:`_open_output` returned for `output`
+    """
+
+    if handle is output:
+        if close_fd:
+            handle.close()
+    elif handle is sys.stdout or \
+            handle is getattr(sys.stdout, 'buffer', None):
+        handle.flush()
+    else:
+        handle.close()
+
+
+class _PrefixedReader(object):
+    """Read `prefix` and then the rest of file object `handle`
+    """
+
+    def __init__(self, prefix, handle):
+        self.prefix = prefix
+        self.handle = handle
+
+    def read(self, size=-1):
+        if not self.prefix:
+            return self.handle.read(size)
+        if size is None or size < 0:
+            data, self.prefix = self.prefix + self.handle.read(), b''
+            return data
+        data, self.prefix = self.prefix[:size], self.prefix[size:]
+        return data
+
+
+class _BufferReader(object):
+    """Seekable read-only file object over a buffer (bytes, bytearray,
+    memoryview), copying out only the chunks read
+    """
+
+    def __init__(self, buffer):
+        self.view = memoryview(buffer)
+        self.position = 0
+
+    def read(self, size=-1):
+        start = self.position
+        end = len(self.view) if size is None or size < 0 else start + size
+        data = self.view[start:end].tobytes()
+        self.position = start + len(data)
+        return data
+
+    def seek(self, position, whence=0):
+        self.position = position + (
+            0 if whence == 0 else
+            self.position if whence == 1 else
+            len(self.view))
+        return self.position
+
+    def tell(self):
+        return self.position
+
+
+class _TranscodingReader(object):
+    """Read file object `handle` of XML in `encoding` as UTF-8, decoding
+    it a chunk at a time. The encoding declaration is changed to match.
+    With `encoding` None, `handle` reads text.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, handle, encoding):
+        import codecs
+
+        self.handle = handle
+        self.decoder = codecs.getincrementaldecoder(encoding)() \
+            if encoding else None
+        self.buffer = b''
+        self.head = True
+        self.done = False
+
+    def read(self, size=-1):
+        while not self.done and (size is None or size < 0 or \
+                len(self.buffer) < size):
+            data = self.handle.read(self.CHUNK_SIZE)
+            self.done = not data
+            text = self.decoder.decode(data, self.done) \
+                if self.decoder else data
+            if self.head and text:
+                self.head = False
+                # Byte order mark left by codecs of a fixed byte order
+                text = text.lstrip(u'\ufeff')
+                text = _regex(
+                    r'^(\s*<\?xml[^>]*?encoding=)["\'][A-Za-z0-9._-]+["\']'
+                    ).sub(r'\1"utf-8"', text, 1)
+            self.buffer += text.encode('utf-8')
+
+        if size is None or size < 0:
+            data, self.buffer = self.buffer, b''
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+class _StreamedParagraphs(object):
+    """Iterable of the <p> elements of a TTML document read with iterparse.
+
+    Only the element currently being handed out is kept in memory. Elements
+    already iterated past are detached from the tree, so memory use doesn't
+    grow with the size of the document. Iterating again re-reads the source,
+    which requires the source to be a file path or a seekable file object.
+    """
+
+    def __init__(self, ttml, source, position, events):
+        self.ttml = ttml
+        self.source = source
+        self.position = position
+        # Event iterator positioned at <body> and the <body> element (reused
+        # by the first iteration)
+        self.events = events
+
+    def _reopen(self):
+        """Return an event iterator positioned at <body>, the <body>
+        element and the file handle to close once done with it (if any)
+        """
+
+        if self.events is not None:
+            (events, body), self.events = self.events, None
+            return events, body, None
+
+        if not hasattr(self.source, 'read'):
+            handle = open(self.source, 'rb')
+            return self.ttml._iterparse(handle)[1:] + (handle,)
+
+        if self.position is None:
+            raise ValueError('Non-seekable source can only be iterated once')
+
+        self.source.seek(self.position)
+        return self.ttml._iterparse(self.source)[1:] + (None,)
+
+    def begin_exprs(self):
+        """Return an iterator over the begin attributes of the <p>s read
+        with a bare expat pass, or None if the source can't be read again
+        """
+
+        if not hasattr(self.source, 'read'):
+            handle = open(self.source, 'rb')
+        elif self.position is not None:
+            handle = self.source
+            handle.seek(self.position)
+        else:
+            return None
+
+        return self._scan_begins(handle)
+
+    def _scan_begins(self, handle):
+        from xml.parsers import expat
+
+        begins = []
+        # Time containers (<body>, <div>) open, as (depth, begin). Element
+        # depth is only tracked from the first container on, sparing
+        # documents without any an end handler call per element.
+        containers = []
+        depth = []
+
+        def start_element(name, attrs):
+            if depth:
+                depth[0] += 1
+            begin = attrs.get('begin')
+            if begin is None:
+                return
+            if name.rpartition('}')[2] == 'p':
+                begins.append('+'.join([b for _depth, b in containers] + \
+                    [begin]) if containers else begin)
+                return
+            if not depth:
+                depth.append(1)
+                parser.EndElementHandler = end_element
+            containers.append((depth[0], begin))
+
+        def end_element(name):
+            if containers and containers[-1][0] == depth[0]:
+                containers.pop()
+            depth[0] -= 1
+
+        parser = expat.ParserCreate(namespace_separator='}')
+        parser.StartElementHandler = start_element
+
+        try:
+            reader = _parser_input(handle)[1]
+            while True:
+                data = reader.read(64 * 1024)
+                parser.Parse(data, not data)
+                for begin in begins:
+                    yield begin
+                del begins[:]
+                if not data:
+                    break
+        finally:
+            if handle is not self.source:
+                handle.close()
+
+    def _containers(self, ancestors):
+        """Return the style references and region <p>s below `ancestors`
+        inherit, None if there are none
+        """
+
+        ttml = self.ttml
+        styles = ' '.join(ttml._body_styles + tuple(filter(None,
+            [ttml._container_style(a) for a in ancestors])))
+        region = ttml._body_region
+        for a in ancestors:
+            region = a.get('region', region)
+        return (styles, region) if styles or region else None
+
+    def __iter__(self):
+        events, body, handle = self._reopen()
+        # Open elements below <body>
+        ancestors = []
+        # Number of ancestors of the <p> being read, None between <p>s
+        reading = None
+        # Parent of the last <p> and the (style references, region) of it
+        # and its ancestors
+        parent = containers = None
+        try:
+            for event, element in events:
+                if event == 'start':
+                    if reading is None and _local_name(element.tag) == 'p':
+                        reading = len(ancestors)
+                    ancestors.append(element)
+                    continue
+                if event != 'end' or not ancestors:
+                    continue
+                ancestors.pop()
+                if reading is None:
+                    # An ended container (<div>, or any element outside
+                    # <p>s) and what's left under it aren't needed anymore
+                    del (ancestors[-1] if ancestors else body)[:]
+                    continue
+                if len(ancestors) > reading:
+                    # <span>, <br> of the <p> being read
+                    continue
+                reading = None
+                if 'begin' in element.attrib:
+                    ttml = self.ttml
+                    container_begins = ttml._body_begins + tuple(
+                        a.attrib['begin'] for a in ancestors \
+                        if 'begin' in a.attrib)
+                    if container_begins:
+                        ttml._offset_paragraph(
+                            element.get, element.set, container_begins)
+                    if not ancestors or ancestors[-1] is not parent:
+                        parent = ancestors[-1] if ancestors else None
+                        containers = self._containers(ancestors)
+                    if containers:
+                        ttml._inherit_container_styles(element, *containers)
+                    yield element
+                # Drop everything parsed so far under the parent
+                del (ancestors[-1] if ancestors else body)[:]
+        finally:
+            close = getattr(events, 'close', None)
+            if close:
+                close()
+            if handle is not None:
+                handle.close()
+
+
+class CueCache(object):
+    """Content-addressed on-disk cache of parsed TTML documents.
+
+    Entries hold what's left of a document once it has been read: TT
+    parameters, styles, language and for each <p> the begin and end time
+    expressions and the extracted dialogue. Time expressions are stored
+    unconverted so one entry serves conversions with any shift, fps or
+    duration scaling.
+
+    Entries are keyed by a hash of the source bytes, and of the
+    whitespace policy the dialogue was normalized with when it isn't the
+    default. Dialogue is stored with the '<' and '&' of its text escaped
+    (see :meth:`Ttml2Srt.read_parag`). When the total size
+    of the cache grows past `max_size` bytes the least recently used
+    entries (by file mtime, which is bumped on every hit) are evicted.
+    The size is listed on the first put and then kept as a running total
+    of the entries put, so the directory is only listed again once that
+    passes `max_size`, or every :attr:`EVICT_INTERVAL` puts to count
+    entries other processes put.
+    """
+
+    # Bump when the entry format or dialogue extraction changes
+    VERSION = '5'
+
+    EVICT_INTERVAL = 64
+
+    def __init__(self, directory, max_size=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # Size of the entries as of the last eviction plus those put
+        # since, None before the first
+        self._size = None
+        self._puts = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, data, whitespace='default'):
+        import hashlib
+
+        digest = hashlib.sha256(self.VERSION.encode('ascii'))
+        digest.update(data)
+        if whitespace != 'default':
+            digest.update(b'\0' + whitespace.encode('ascii'))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, key):
+        import json
+
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = json.loads(f.read().decode('utf-8'))
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        import json
+
+        path = self._path(key)
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        data = json.dumps(entry).encode('utf-8')
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.rename(tmp_path, path)
+
+        self._puts += 1
+        if self._size is not None:
+            self._size += len(data)
+        if self._size is None or self._size > self.max_size or \
+                not self._puts % self.EVICT_INTERVAL:
+            self.evict()
+
+    def _entries(self):
+        """Return (mtime, size, path) of each entry, oldest first
+        """
+
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        return sorted(entries)
+
+    def evict(self):
+        entries = self._entries()
+        total = sum(e[1] for e in entries)
+        for _mtime, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        self._size = total
+
+    def stats(self):
+        entries = self._entries()
+        return {
+            'directory': self.directory,
+            'entries': len(entries),
+            'size': sum(e[1] for e in entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+class TimeMemo(dict):
+    """Bounded memo of converted times, emptied when it gets full.
+
+    Ends of paragraphs are often begins of the next ones and cues share
+    times, so some documents convert the same time expressions and ms
+    values over and over. Most don't repeat any, though. Once
+    :data:`MEMO_PROBE` entries are stored, a memo that had fewer than one
+    hit in eight lookups is turned off (`active`) for the rest of the
+    document.
+
+    Every miss stores an entry, so misses are counted by the entries
+    stored (and dropped); only `hits` are counted as they happen.
+    `params` are what values depend on besides the key.
+    """
+
+    def __init__(self):
+        dict.__init__(self)
+        self.params = None
+        self.active = True
+        # Entries stored when full() is called
+        self.limit = MEMO_PROBE
+        self.hits = 0
+        self.dropped = 0
+
+    @property
+    def misses(self):
+        return self.dropped + len(self)
+
+    @property
+    def lookups(self):
+        return self.hits + self.misses
+
+    def clear(self):
+        self.dropped += len(self)
+        dict.clear(self)
+
+    def full(self):
+        """Make room for an entry once `limit` are stored. Returns False,
+        and stays off, if the memo isn't worth keeping.
+        """
+
+        if self.limit == MEMO_SIZE:
+            self.clear()
+        elif self.hits * 8 < self.misses:
+            self.clear()
+            self.active = False
+        else:
+            self.limit = MEMO_SIZE
+        return self.active
+
+    def count(self, stats, name):
+        """Add lookups and hits since the last call to `stats` counters
+        <name>_lookups and <name>_hits
+        """
+
+        if not self.lookups:
+            return
+        stats.count(name + '_lookups', self.lookups)
+        stats.count(name + '_hits', self.hits)
+        self.hits = 0
+        self.dropped = -len(self)
+
+
+class ConversionStats(object):
+    """Per-stage durations and counters of a conversion.
+
+    Pass an instance as the `stats` argument of :class:`Ttml2Srt` to have
+    it filled in. Stages are
+
+        load        reading the document (for the iterparse parser only
+                    its head; <p>s are parsed during extract)
+        extract     reading <p>s: time expressions and dialogue
+        sort        ordering paragraphs by begin time
+        merge       combining overlapping paragraphs
+        write       formatting and writing SubRip paragraphs
+
+    and counters
+
+        cues, merged (cues combined into others), slices (the cues
+        overlapping cues are cut into, counted instead of merged with
+        overlap='split'), text_nodes, paragraphs, output_bytes, cache_hits, segments,
+        duplicates (the last two of :class:`SegmentedTtml2Srt`),
+        expr_lookups, expr_hits (time expressions converted and found in
+        the :class:`TimeMemo`), srt_lookups, srt_hits (same for SubRip
+        timestamps)
+
+    `callback`, if given, is called with (name, value) for every duration
+    and counter recorded.
+    """
+
+    STAGES = ('load', 'extract', 'sort', 'merge', 'write')
+
+    def __init__(self, callback=None):
+        self.durations = {}
+        self.counters = {}
+        self.callback = callback
+
+    def add_time(self, stage, seconds):
+        self.durations[stage] = self.durations.get(stage, 0) + seconds
+        if self.callback:
+            self.callback(stage, seconds)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+        if self.callback:
+            self.callback(name, n)
+
+    def report(self):
+        lines = ['{:<10} {:>10.2f} ms'.format(stage, self.durations[stage] * 1000) \
+            for stage in self.STAGES if stage in self.durations]
+        lines.append('{:<10} {:>10.2f} ms'.format(
+            'total', sum(self.durations.values()) * 1000))
+        lines.extend('{:<13} {:>10}'.format(name, self.counters[name]) \
+            for name in sorted(self.counters))
+        return '\n'.join(lines) + '\n'
+
+
+class CueStore(object):
+    """Cues kept column-wise: begin and end times (ms) in arrays of
+    doubles, dialogue in a list.
+
+    Stores what :meth:`Ttml2Srt.parag_to_ms` returns for documents whose
+    paragraphs have to be sorted, without a tuple per cue. Times are
+    doubles rather than integers as scaled timestamps have fractions of
+    milliseconds. Iterating yields (begin, end, dialogue) tuples.
+    """
+
+    def __init__(self, cues=()):
+        self.begins = array('d')
+        self.ends = array('d')
+        self.texts = []
+        for begin, end, text in cues:
+            self.append(begin, end, text)
+
+    def append(self, begin, end, text):
+        self.begins.append(begin)
+        self.ends.append(end)
+        self.texts.append(text)
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __iter__(self):
+        begins, ends, texts = self.begins, self.ends, self.texts
+        for i in range(len(texts)):
+            yield begins[i], ends[i], texts[i]
+
+    def is_sorted(self):
+        begins = self.begins
+        return all(begins[i - 1] <= begins[i] for i in range(1, len(begins)))
+
+    def sort(self):
+        """Order cues by begin time, keeping the document order of cues
+        that begin at the same time
+        """
+
+        if self.is_sorted():
+            return
+
+        order = sorted(range(len(self.texts)), key=self.begins.__getitem__)
+        self.begins = array('d', [self.begins[i] for i in order])
+        self.ends = array('d', [self.ends[i] for i in order])
+        self.texts = [self.texts[i] for i in order]
+
+
+def iter_overlap_clusters(cues):
+    """Group (begin ms, end ms, dialogue) `cues` ordered by begin time into
+    clusters of overlapping cues, in one pass
+
+    A cue belongs to the cluster of the cues before it if it begins before
+    the latest end among them, so cues overlapping an earlier cue rather
+    than the one just before are grouped too. Yields a list of cues per
+    cluster.
+    """
+
+    cluster = []
+    cluster_end = None
+    for cue in cues:
+        if cluster_end is None or cue[0] < cluster_end:
+            cluster.append(cue)
+            if cluster_end is None or cue[1] > cluster_end:
+                cluster_end = cue[1]
+            continue
+        yield cluster
+        cluster = [cue]
+        cluster_end = cue[1]
+    if cluster:
+        yield cluster
+
+
+def split_cluster(cluster):
+    """Cut a cluster of overlapping cues (see :func:`iter_overlap_clusters`)
+    into time slices
+
+    Slices run between consecutive begin and end times of the cues and
+    carry the dialogue of the cues showing throughout the slice, in begin
+    time order. Yields (begin ms, end ms, dialogue) tuples. Cues ending
+    before they begin are left out.
+    """
+
+    if len(cluster) == 1:
+        yield cluster[0]
+        return
+
+    # Cues ending before they begin never show
+    cluster = [cue for cue in cluster if cue[1] >= cue[0]]
+    times = sorted(set([cue[0] for cue in cluster] + [cue[1] for cue in cluster]))
+    by_end = sorted(range(len(cluster)), key=lambda i: cluster[i][1])
+    started = ended = 0
+    # Indexes of the cues showing, in begin time order
+    showing = []
+
+    for begin, end in zip(times, times[1:]):
+        while started < len(cluster) and cluster[started][0] <= begin:
+            showing.append(started)
+            started += 1
+        while ended < len(by_end) and cluster[by_end[ended]][1] <= begin:
+            showing.remove(by_end[ended])
+            ended += 1
+        if showing:
+            yield begin, end, '\n'.join([cluster[i][2] for i in showing])
+
+
+_numpy_module = []
+
+
+def _numpy():
+    """Return numpy, or None if it isn't installed. Imported on first use.
+    """
+
+    if not _numpy_module:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _numpy_module.append(numpy)
+    return _numpy_module[0]
+
+
+class TimeMap(object):
+    """Piecewise-linear mapping of times (ms) through (source, target)
+    anchor pairs.
+
+    Times between two anchors are interpolated; before the first and
+    after the last anchor they keep that anchor's offset. A single anchor
+    is a plain shift. Targets can't go back in time as sources advance,
+    so mapped cues keep their order.
+    """
+
+    # Cues mapped at once on the streaming path
+    CHUNK_SIZE = 4096
+
+    def __init__(self, anchors):
+        anchors = sorted((float(source), float(target)) \
+            for source, target in anchors)
+        if not anchors:
+            raise ValueError('No anchors')
+        for (source, target), (next_source, next_target) in \
+                zip(anchors, anchors[1:]):
+            if next_source == source:
+                raise ValueError(
+                    'Anchors with the same source time {}'.format(source))
+            if next_target < target:
+                raise ValueError(
+                    'Anchor targets go back in time at source time {}'.format(
+                        next_source))
+
+        self.sources = [source for source, _target in anchors]
+        self.offsets = [target - source for source, target in anchors]
+        # Offset change per ms of each segment
+        self.slopes = [(o1 - o0) / (s1 - s0) for s0, s1, o0, o1 in zip(
+            self.sources, self.sources[1:], self.offsets, self.offsets[1:])]
+
+    def __call__(self, ms):
+        return self.map_array([ms])[0]
+
+    def map_array(self, values):
+        """Return an array('d') of `values` (array('d') or sequence)
+        mapped, rounded to a thousandth of a ms
+        """
+
+        numpy = _numpy()
+        if numpy is not None:
+            if not isinstance(values, array):
+                values = array('d', values)
+            times = numpy.frombuffer(values, dtype=numpy.float64) \
+                if len(values) else numpy.zeros(0)
+            # Same arithmetic as below: slope * (t - source) + offset. Its
+            # last bits differ, which the rounding evens out; halves are
+            # rounded up either way (round() of Python 3 doesn't).
+            mapped = numpy.floor((times + numpy.interp(
+                times, self.sources, self.offsets)) * 1000 + 0.5) / 1000
+            result = array('d')
+            getattr(result, 'frombytes', getattr(result, 'fromstring', None))(
+                mapped.tobytes())
+            return result
+
+        import bisect
+        from math import floor
+
+        sources, offsets, slopes = self.sources, self.offsets, self.slopes
+        first, last = sources[0], sources[-1]
+        first_offset, last_offset = offsets[0], offsets[-1]
+        bisect_right = bisect.bisect_right
+
+        def mapped(t):
+            if t <= first:
+                return t + first_offset
+            if t >= last:
+                return t + last_offset
+            i = bisect_right(sources, t) - 1
+            return t + (slopes[i] * (t - sources[i]) + offsets[i])
+
+        return array('d', [floor(mapped(t) * 1000 + 0.5) / 1000 \
+            for t in values])
+
+    def map_store(self, cues):
+        """Map begin and end times of a :class:`CueStore` in place
+        """
+
+        cues.begins = self.map_array(cues.begins)
+        cues.ends = self.map_array(cues.ends)
+
+    def map_cues(self, cues):
+        """Yield (begin ms, end ms, dialogue) `cues` with times mapped, a
+        chunk at a time
+        """
+
+        cues = iter(cues)
+        while True:
+            chunk = CueStore(itertools.islice(cues, self.CHUNK_SIZE))
+            if not len(chunk):
+                return
+            self.map_store(chunk)
+            for cue in chunk:
+                yield cue
+
+
+def load_anchors(path):
+    """Read (source, target) anchor pairs in ms from a file.
+
+    One pair per line: two times separated by whitespace or "-->", each
+    either ms or hh:mm:ss,mmm (or hh:mm:ss.mmm). Empty lines and lines
+    starting with # are skipped.
+    """
+
+    def to_ms(value):
+        if value.lstrip('-').isdigit():
+            return int(value)
+        hh, mm, ss = value.replace(',', '.').split(':')
+        return int(hh) * 3600000 + int(mm) * 60000 + \
+            int(round(float(ss) * 1000))
+
+    anchors = []
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                source, target = line.replace('-->', ' ').split()
+                anchors.append((to_ms(source), to_ms(target)))
+            except ValueError:
+                raise ValueError('{}:{}: not an anchor pair: "{}"'.format(
+                    path, number, line))
+    return anchors
+
+
+class TextRun(namedtuple('TextRun', 'text tags')):
+    """A piece of dialogue and the style tags applied to it: SubRip
+    markup without the brackets, like 'i' or 'font color="yellow"', in a
+    sorted tuple
+    """
+
+    __slots__ = ()
+
+    @property
+    def italic(self):
+        return 'i' in self.tags
+
+    @property
+    def bold(self):
+        return 'b' in self.tags
+
+    @property
+    def color(self):
+        """Named color or #rrggbb, None for the default one
+        """
+
+        for tag in self.tags:
+            if tag.startswith('font color="'):
+                return tag[12:-1]
+        return None
+
+
+# Combined paragraph of Ttml2Srt.iter_structured_cues(): times in ms and
+# the dialogue as a list of TextRuns
+Cue = namedtuple('Cue', 'begin end runs')
+
+
+def dialogue_runs(dialogue):
+    """Split dialogue with SubRip style tags and '<' and '&' of the text
+    escaped, as :meth:`Ttml2Srt.iter_cues` makes it with `escape`, into a
+    list of :class:`TextRun`. Consecutive runs of the same style are
+    joined; line breaks are kept in the text.
+    """
+
+    if '<' not in dialogue:
+        return [TextRun(_unescape_markup(dialogue), ())] if dialogue else []
+
+    parts = _regex(r'<(/?)([^<>/][^<>]*)>').split(dialogue)
+    runs = []
+    open_tags = []
+    for i in range(0, len(parts), 3):
+        text = _unescape_markup(parts[i])
+        if text:
+            tags = tuple(sorted(open_tags))
+            if runs and runs[-1].tags == tags:
+                runs[-1] = TextRun(runs[-1].text + text, tags)
+            else:
+                runs.append(TextRun(text, tags))
+        if i + 2 < len(parts):
+            closing, tag = parts[i + 1], parts[i + 2]
+            if not closing:
+                open_tags.append(tag)
+                continue
+            # Closing tags have the name only (</font>)
+            for j in range(len(open_tags) - 1, -1, -1):
+                if open_tags[j].partition(' ')[0] == tag:
+                    del open_tags[j]
+                    break
+    return runs
+
 
 class Ttml2Srt():
 
@@ -10,10 +1142,62 @@ class Ttml2Srt():
         'smpte',
     ]
 
+    PARSERS = [
+        'minidom',
+        'iterparse',
+    ]
+
+    # What to do with overlapping cues (see iter_merged)
+    OVERLAP_POLICIES = [
+        'merge',
+        'split',
+        'keep',
+    ]
+
+    # How whitespace in text is normalized:
+    #   default   line feeds dropped, and indentation of 4 or more
+    #             whitespace characters
+    #   collapse  each run of whitespace made a single space, as XML's
+    #             default whitespace handling does
+    #   strip     collapse, and spaces at the start and end of each line
+    #             of a cue dropped
+    #   keep      text as it is in the document
+    WHITESPACE_POLICIES = [
+        'default',
+        'collapse',
+        'strip',
+        'keep',
+    ]
+
+    # Document state stored in (and restored from) CueCache entries
+    CACHED_ATTRS = (
+        'encoding',
+        'lang',
+        'styles',
+        'regions',
+        'frame_rate',
+        'tick_rate',
+        'time_base',
+        'clock_mode',
+        'frame_rate_multiplier',
+        'sub_frame_rate',
+        'marker_mode',
+        'drop_mode',
+    )
+
     def __init__(
             self, ttml_filepath, shift=0, source_fps=23.976,
-            target_duration=None, source_duration=None):
+            target_duration=None, source_duration=None, parser='minidom',
+            cache=None, stats=None, anchors=None, overlap='merge',
+            whitespace='default'):
+
+        self._check_options(parser, overlap, whitespace)
 
+        self.parser = parser
+        self.stats = stats
+        self.overlap = overlap
+        self.whitespace = whitespace
+        self.normalize_text = _text_normalizer(whitespace)
         self.shift = shift
         self.target_duration = target_duration
         self.source_duration = source_duration
@@ -23,7 +1207,30 @@ class Ttml2Srt():
             if target_duration and source_duration \
             else 1
 
+        # Resync of shifted and scaled times through (source ms, target ms)
+        # anchor pairs
+        self.time_map = TimeMap(anchors) if anchors else None
+
         self.styles = {}
+        self.regions = {}
+
+        # Ids of the anonymous styles made of the style attributes of time
+        # containers, by those attributes (see _container_style)
+        self._container_style_ids = {}
+
+        # (style references, region) of the minidom time containers whose
+        # <p>s inherit styles, by container element
+        self._containers = {}
+
+        # Begins, container style and region of <body> when read by
+        # iterparse (see _offset_paragraph and _inherit_container_styles)
+        self._body_begins = ()
+        self._body_styles = ()
+        self._body_region = None
+
+        # Converted time expressions (ms) and ms values (SubRip timestamps)
+        self.expr_memo = TimeMemo()
+        self.subrip_memo = TimeMemo()
 
         self.allowed_style_attrs = (
             'color',
@@ -33,16 +1240,52 @@ class Ttml2Srt():
 
         self.lang = None
 
+        started = _clock()
+
+        if isinstance(ttml_filepath, BUFFER_TYPES):
+            ttml_filepath = _BufferReader(ttml_filepath)
+
         # Read TT params, dialogue, etc.
-        self._load_ttml_doc(ttml_filepath)
+        if cache is not None:
+            self._load_cached(ttml_filepath, cache)
+        else:
+            self._load_ttml_doc(ttml_filepath)
+
+        if stats is not None:
+            stats.add_time('load', _clock() - started)
 
         # Set FPS to source_fps if no TT param
         self.frame_rate = self.frame_rate or source_fps
 
-        self.italic_style_ids = []
-        for sid, style in self.styles.items():
-            if style['font_style'] == 'italic':
-                self.italic_style_ids.append(sid)
+        self._prepare_styles()
+
+    @staticmethod
+    def _check_options(parser, overlap, whitespace):
+        """Raise ValueError for an unknown parser, overlap policy or
+        whitespace policy
+        """
+
+        if parser not in Ttml2Srt.PARSERS:
+            raise ValueError('Unknown parser "{}"'.format(parser))
+        if overlap not in Ttml2Srt.OVERLAP_POLICIES:
+            raise ValueError('Unknown overlap policy "{}"'.format(overlap))
+        if whitespace not in Ttml2Srt.WHITESPACE_POLICIES:
+            raise ValueError('Unknown whitespace policy "{}"'.format(
+                whitespace))
+
+    @classmethod
+    def from_string(cls, document, **kwargs):
+        """Return a converter of the TTML `document` held in memory, as
+        text or bytes (a path given as str isn't taken for one)
+
+        Keyword arguments are those of :class:`Ttml2Srt`.
+        """
+
+        if isinstance(document, BUFFER_TYPES + (bytes,)):
+            source = _BufferReader(document)
+        else:
+            source = io.StringIO(document)
+        return cls(source, **kwargs)
 
     def _parse_frame_rate_multiplier(self, expression):
         """
@@ -50,11 +1293,9 @@ class Ttml2Srt():
         like "2 3" == 2/3 == 0.6(6)
         https://www.w3.org/TR/2018/PR-ttml1-20181004/#parameter-attribute-frameRateMultiplier
         """
-        two_digits_match = re.match(r"(\d+)\s+(\d+)", expression)
-        if two_digits_match:
-            first_digit = int(two_digits_match.group(1))
-            second_digit = int(two_digits_match.group(2))
-            return float(first_digit) / float(second_digit)
+        parts = expression.split()
+        if len(parts) == 2 and parts[0].isdigit() and parts[1].isdigit():
+            return float(int(parts[0])) / float(int(parts[1]))
         else:
             return float(expression)
 
@@ -62,22 +1303,277 @@ class Ttml2Srt():
         """Read TTML file. Extract <p> elements and various attributes.
         """
 
-        ttml_dom = minidom.parse(filepath)
-        self.encoding = ttml_dom.encoding
+        if self.parser == 'iterparse':
+            return self._load_ttml_stream(filepath)
 
-        if self.encoding and self.encoding.lower() not in ['utf8', 'utf-8']:
-            # Don't bother with subtitles that aren't utf-8 encoded
-            # but assume utf-8 when the encoding attr is missing
-            raise NotImplementedError('Source is not utf-8 encoded')
+        from xml.dom import minidom
 
-        # Get the root tt element (assume the file contains
-        # a single subtitle document)
-        tt_element = ttml_dom.getElementsByTagName('tt')[0]
+        handle = filepath if hasattr(filepath, 'read') else open(filepath, 'rb')
+        try:
+            encoding, reader = _parser_input(handle)
+            ttml_dom = minidom.parse(reader)
+        finally:
+            if handle is not filepath:
+                handle.close()
+        self.encoding = encoding
+
+        tt_element = None
+        self.lines = []
+
+        # One walk over the elements, in document order. Each comes with
+        # the begin attributes, style references and region of the time
+        # containers (<body>, <div>) it is in and whether it is in a
+        # <styling> element.
+        stack = [(ttml_dom.documentElement, (), False, (), '')]
+        while stack:
+            node, container_begins, in_styling, container_styles, \
+                container_region = stack.pop()
+            name = node.tagName
+
+            if name == 'p':
+                if node.hasAttribute('begin'):
+                    if container_begins:
+                        self._offset_paragraph(
+                            node.getAttribute, node.setAttribute,
+                            container_begins)
+                    self.lines.append(node)
+                # Nothing but content below
+                continue
+
+            # Get the root tt element (assume the file contains
+            # a single subtitle document)
+            if name == 'tt':
+                if tt_element is None:
+                    tt_element = node
+                    self._read_tt_params(dict(node.attributes.items()))
+
+            # Grab <style>s
+            # https://www.w3.org/TR/ttml1/#styling-attribute-vocabulary
+            elif name == 'styling':
+                in_styling = True
+
+            elif name == 'style' and in_styling:
+                style_id = node.getAttribute('xml:id')
+                if style_id:
+                    self.styles[style_id] = self.get_tt_style_attrs(node, True)
+
+            elif name == 'region':
+                region_id = node.getAttribute('xml:id')
+                if region_id:
+                    self.regions[region_id] = self.get_tt_style_attrs(node)
+
+            elif node.hasAttribute('begin'):
+                container_begins += (node.getAttribute('begin'),)
+
+            if name in ('body', 'div'):
+                style_id = self._container_style(node)
+                if style_id:
+                    container_styles += (style_id,)
+                container_region = node.getAttribute('region') or \
+                    container_region
+                if container_styles or container_region:
+                    self._containers[node] = (
+                        ' '.join(container_styles), container_region)
+
+            children = [(child, container_begins, in_styling,
+                container_styles, container_region) \
+                for child in node.childNodes if child.nodeType == ELEMENT_NODE]
+            children.reverse()
+            stack.extend(children)
+
+        if tt_element is None:
+            raise ValueError('No tt element in the document')
+
+        self._set_tick_rate()
+
+    @staticmethod
+    def _offset_paragraph(get_attr, set_attr, container_begins):
+        """Make the begin and end of a <p> in time containers relative to
+        the document, as sums of the containers' begins and its own (see
+        :meth:`Ttml2Srt.timeexprs_to_ms`).
+
+        Containers are taken as parallel ones, the default; sequential
+        containers and container ends aren't supported.
+        """
+
+        for attr in ('begin', 'end'):
+            expr = get_attr(attr)
+            if expr:
+                set_attr(attr, '+'.join(container_begins + (expr,)))
+
+    @staticmethod
+    def _inherit_container_styles(element, container_styles,
+            container_region):
+        """Give an ElementTree <p> the styles the time containers (<body>,
+        <div>) it is in reference, before its own ones which take
+        precedence, and the region of the innermost container with one
+        unless it has its own (minidom <p>s are looked up in
+        :attr:`_containers` instead).
+
+        `container_styles` are ids of :meth:`Ttml2Srt._container_style`.
+        """
+
+        if container_styles:
+            style_ref = element.get('style')
+            element.set('style', container_styles + ' ' + style_ref \
+                if style_ref else container_styles)
+        if container_region and 'region' not in element.attrib:
+            element.set('region', container_region)
+
+    def _load_cached(self, source, cache):
+        """Restore the document from `cache` or read it and store it there.
+
+        On a hit :attr:`lines` holds (begin, end, dialogue) tuples instead
+        of <p> elements and no XML is parsed.
+        """
+
+        if hasattr(source, 'read'):
+            data = source.read()
+        else:
+            with open(source, 'rb') as f:
+                data = f.read()
+
+        text = not isinstance(data, bytes)
+        key = cache.key(data.encode('utf-8') if text else data,
+            self.whitespace)
+        entry = cache.get(key)
+
+        if self.stats is not None:
+            self.stats.count('cache_hits', int(entry is not None))
+
+        if entry is None:
+            self._load_ttml_doc(
+                io.StringIO(data) if text else io.BytesIO(data))
+            # Styles are needed for extracting the dialogue
+            self._prepare_styles()
+            self.lines = [self.read_parag(p, escape=True) \
+                for p in self.lines]
+            entry = dict((a, getattr(self, a)) for a in self.CACHED_ATTRS)
+            entry['lines'] = self.lines
+            cache.put(key, entry)
+            return
+
+        for attr in self.CACHED_ATTRS:
+            setattr(self, attr, entry[attr])
+        self.lines = [tuple(l) for l in entry['lines']]
+
+    def _load_ttml_stream(self, source):
+        """Read TT params and styles from the head of a TTML document with
+        iterparse, leaving <p> elements to be parsed as they're consumed.
+        """
+
+        position = None
+        if hasattr(source, 'read'):
+            try:
+                position = source.tell()
+            except (AttributeError, IOError, OSError):
+                pass
+            handle = source
+        else:
+            handle = open(source, 'rb')
+
+        try:
+            parsed = self._iterparse(handle, self._read_stream_head)
+        except Exception:
+            if handle is not source:
+                handle.close()
+            raise
+
+        self.encoding = parsed[0]
+        events = parsed[1:]
+
+        if handle is not source:
+            handle.close()
+            events = None
+        elif position is not None:
+            events = None
+
+        self._set_tick_rate()
+        self.lines = _StreamedParagraphs(self, source, position, events)
+
+    def _iterparse(self, handle, head_handler=None):
+        """Start iterparsing `handle` and advance to the <body> element.
+
+        Returns the declared encoding, an iterator over the remaining
+        (event, element) pairs and the <body> element (None if there is
+        none).
+        """
+
+        from xml.etree import ElementTree
+
+        encoding, reader = _parser_input(handle)
+        events = iter(ElementTree.iterparse(
+            reader, events=('start', 'end', 'start-ns')))
+
+        namespaces = {}
+        body = None
+        for event, element in events:
+            if event == 'start-ns':
+                namespaces.setdefault(*element)
+            elif event == 'start' and _local_name(element.tag) == 'body':
+                # <body> is the outermost time container
+                begin = element.get('begin')
+                self._body_begins = (begin,) if begin else ()
+                style_id = self._container_style(element)
+                self._body_styles = (style_id,) if style_id else ()
+                self._body_region = element.get('region')
+                body = element
+                break
+            elif head_handler:
+                head_handler(event, element, namespaces)
+
+        return encoding, events, body
+
+    def _read_stream_head(self, event, element, namespaces):
+        name = _local_name(element.tag)
+
+        if event == 'start' and name == 'tt':
+            self._namespaces = namespaces
+            self._read_tt_params(self._qualified_attrs(element))
+
+        elif event == 'end' and name == 'style':
+            style_id = element.get('{%s}id' % XML_NS)
+            if style_id:
+                self.styles[style_id] = self.get_tt_style_attrs(element, True)
+
+        elif event == 'end' and name == 'region':
+            region_id = element.get('{%s}id' % XML_NS)
+            if region_id:
+                self.regions[region_id] = self.get_tt_style_attrs(element)
+
+    def _qualified_attrs(self, element):
+        """Return element's attributes keyed by prefix:name like minidom
+        """
+
+        prefixes = dict((uri, prefix) for prefix, uri in self._namespaces.items())
+        prefixes[XML_NS] = 'xml'
+
+        attrs = {}
+        for name, value in element.attrib.items():
+            uri, _, local = name[1:].rpartition('}') \
+                if name.startswith('{') else ('', '', name)
+            prefix = prefixes.get(uri)
+            attrs['{}:{}'.format(prefix, local) if prefix else local] = value
+        return attrs
+
+    def _clark_name(self, qualified_name):
+        """Convert prefix:name to {namespace}name as used by ElementTree
+        """
+
+        prefix, _, local = qualified_name.rpartition(':')
+        if not prefix:
+            return local
+        uri = XML_NS if prefix == 'xml' else self._namespaces.get(prefix)
+        return '{%s}%s' % (uri, local) if uri else qualified_name
+
+    def _read_tt_params(self, tt_attrs):
+        """Read language and TT parameters from the root element's attributes
+        """
 
         # Extract doc language
         # https://tools.ietf.org/html/rfc4646#section-2.1
-        language_tag = tt_element.getAttribute('xml:lang') or ''
-        self.lang = re.split(r'\s+', language_tag.strip())[0].split('-')[0]
+        language_tag = tt_attrs.get('xml:lang') or ''
+        self.lang = (language_tag.split() or [''])[0].split('-')[0]
 
         # Store TT parameters as instance vars (in camel case)
         for ttp_name, defval, convfn in (
@@ -91,24 +1587,14 @@ class Ttml2Srt():
                 ('markerMode', '', lambda x: x),
                 ('dropMode', '', lambda x: x),
         ):
-            ttp_val = getattr(
-                tt_element.attributes.get('ttp:' + ttp_name), 'value', defval)
+            ttp_val = tt_attrs.get('ttp:' + ttp_name, defval)
             setattr(self, Ttml2Srt.snake_to_camel(ttp_name), convfn(ttp_val))
 
         if self.time_base not in Ttml2Srt.TIME_BASES:
             raise NotImplementedError('No support for "{}" time base'.format(
                 self.time_base))
 
-        # Grab <style>s
-        # https://www.w3.org/TR/ttml1/#styling-attribute-vocabulary
-        for styles_container in ttml_dom.getElementsByTagName('styling'):
-            for style in styles_container.getElementsByTagName('style'):
-                style_id = getattr(
-                    style.attributes.get('xml:id', {}), 'value', None)
-                if not style_id:
-                    continue
-                self.styles[style_id] = self.get_tt_style_attrs(style, True)
-
+    def _set_tick_rate(self):
         # Set effective tick rate as per
         # https://www.w3.org/TR/ttml1/#parameter-attribute-tickRate
         # This will obviously only be made use of if we encounter offset-time
@@ -118,51 +1604,168 @@ class Ttml2Srt():
         elif not self.tick_rate:
             self.tick_rate = 1
 
-        # Get em <p>s.
-        #
-        # CAUTION: This is very naive and will fail us when the TTML
-        # document contains multiple local time contexts with their own
-        # offsets, or even just a single context with an offset other
-        # than zero.
-        self.lines = [i for i in ttml_dom.getElementsByTagName('p') \
-            if 'begin' in i.attributes.keys()]
+    def timeexpr_to_ms(self, time_expr):
+        """Convert a TTML time expression of any supported form to ms
+        """
+
+        return self.timeexprs_to_ms((time_expr,))[0]
+
+    def timeexprs_to_ms(self, time_exprs):
+        """Convert a sequence of TTML time expressions to ms.
+
+        Each expression is classified by its last character and converted
+        right away, so expressions of different forms can be mixed freely.
+        https://www.w3.org/TR/ttml1/#timing-value-timeExpression
+
+        Return:
+            List of ms values (int or float)
+        """
+
+        multiplier = self.time_multiplier
+        frame_ms = 1000 / self.frame_rate
+        tick_seconds = 1.0 / self.tick_rate
+
+        memo = self.expr_memo
+        memoized = None
+        if memo.active:
+            params = (multiplier, frame_ms, tick_seconds)
+            if memo.params != params:
+                memo.clear()
+                memo.params = params
+            memoized = memo.get
+
+        ms_values = []
+        append = ms_values.append
+
+        for time_expr in time_exprs:
+
+            metric = time_expr[-1:]
+
+            # Tick counts convert faster than they're looked up
+            lookup = memoized is not None and metric != 't'
+
+            if lookup:
+                ms = memoized(time_expr)
+                if ms is not None:
+                    memo.hits += 1
+                    append(ms)
+                    continue
+
+            try:
+                # offset-time, tick metric
+                # Example(s): "19298323t"
+                if metric == 't':
+                    try:
+                        ticks = int(time_expr[:-1])
+                    except ValueError:
+                        ticks = float(time_expr[:-1])
+                    ms = (tick_seconds * ticks) * 1000
+
+                # offset-time, second and millisecond metrics
+                # Example(s): "113.2312312s", "1000ms"
+                elif metric == 's':
+                    if time_expr[-2:-1] == 'm':
+                        value = time_expr[:-2]
+                        ms = int(value) if value.isdigit() \
+                            else int(float(value))
+                    else:
+                        ms = int(1000 * float(time_expr[:-1]))
+
+                # clock-time
+                # Example(s): "00:02:23", "00:02:23.283", "00:02:23:12",
+                # "00:02:23:12.222"
+                elif metric.isdigit():
+                    ms = self._clock_time_to_ms(time_expr, frame_ms)
+
+                # offset-time, frame metric
+                # Example(s): "100f"
+                elif metric == 'f':
+                    ms = int(int(float(time_expr[:-1])) * frame_ms)
+
+                # offset-time, minute and hour metrics
+                # Example(s): "13.72986323m", "1.232837372637h"
+                elif metric in METRIC_MS:
+                    ms = int(METRIC_MS[metric] * float(time_expr[:-1]))
+
+                else:
+                    ms = None
+
+            except (ValueError, OverflowError):
+                ms = None
+
+            if ms is None:
+                if '+' not in time_expr:
+                    raise NotImplementedError(
+                        'Unknown timestamp format ("{}")'.format(time_expr))
+                # Time of a <p> in time containers, summed with their
+                # begins (see Ttml2Srt._offset_paragraph())
+                ms = sum(self.timeexprs_to_ms(time_expr.split('+')))
+            else:
+                ms *= multiplier
+
+            if lookup:
+                if len(memo) < memo.limit or memo.full():
+                    memo[time_expr] = ms
+                else:
+                    memoized = None
+            append(ms)
 
-    def timeexpr_to_ms(self, *args):
-        return self._timeexpr_to_ms(*args)
+        return ms_values
 
-    def _timeexpr_to_ms(self, time_expr):
-        """Use the given time expression to get a matching conversion method
-        to overwrite self.timeexpr_to_ms() with.
+    def _clock_time_to_ms(self, time_expr, frame_ms):
+        """Convert unscaled clock-time expression to ms. Returns None if the
+        expression isn't clock-time.
+
+        Sub-frames are discarded.
         """
 
-        self.timeexpr_to_ms = self.determine_ms_convfn(time_expr)
-        return self.timeexpr_to_ms(time_expr)
+        parts = time_expr.split(':')
 
-    def _scaler(self, ms):
-        return ms * self.time_multiplier
+        if len(parts) == 4:
+            hh, mm, ss, frames = parts
+            ms = int(int(frames.partition('.')[0]) * frame_ms)
+        elif len(parts) == 3:
+            hh, mm, ss = parts
+            ss, _, fraction = ss.partition('.')
+            # Resolution beyond ms is useless for our purposes
+            ms = int(fraction[:3].ljust(3, '0')) if fraction else 0
+        else:
+            return None
 
-    def _hhmmss_to_ms(self, hh, mm, ss):
-        return hh * 3600 * 1000 + mm * 60 * 1000 + ss * 1000
+        return int(hh) * 3600000 + int(mm) * 60000 + int(ss) * 1000 + ms
 
     def subrip_to_ms(self, timestamp):
         """Desconstruct SubRip timecode down to milliseconds
         """
 
-        hh, mm, ss, ms = re.split(r'[:,]', timestamp)
+        hh, mm, ss, ms = _regex(r'[:,]').split(timestamp)
         return int(int(hh) * 3.6e6 + int(mm) * 60000 + int(ss) * 1000 + int(ms))
 
-    def _metric_to_ms(self, metric_multiplier, metric_value):
-        return int(metric_multiplier * metric_value)
-
     def ms_to_subrip(self, ms):
         """Build SubRip timecode from milliseconds
         """
 
-        hh = int(ms / 3.6e6)
-        mm = int((ms % 3.6e6) / 60000)
-        ss = int((ms % 60000) / 1000)
-        ms = int(ms % 1000)
-        return '{:02d}:{:02d}:{:02d},{:03d}'.format(hh, mm, ss, ms)
+        memo = self.subrip_memo
+        if memo.active:
+            timecode = memo.get(ms)
+            if timecode is not None:
+                memo.hits += 1
+                return timecode
+
+        if ms >= 0:
+            ss, frac = divmod(int(ms), 1000)
+            mm, ss = divmod(ss, 60)
+            hh, mm = divmod(mm, 60)
+        else:
+            hh = int(ms / 3.6e6)
+            mm = int((ms % 3.6e6) / 60000)
+            ss = int((ms % 60000) / 1000)
+            frac = int(ms % 1000)
+        timecode = '%02d:%02d:%02d,%03d' % (hh, mm, ss, frac)
+
+        if memo.active and (len(memo) < memo.limit or memo.full()):
+            memo[ms] = timecode
+        return timecode
 
     def frames_to_ms(self, frames):
         """Convert frame count to ms
@@ -170,58 +1773,58 @@ class Ttml2Srt():
 
         return int(int(frames) * (1000 / self.frame_rate))
 
+    # Per-form converters. They all go through timeexpr_to_ms() and are
+    # kept for callers of determine_ms_convfn().
+
     def offset_frames_to_ms(self, time):
         """Convert offset-time expression with f metric to milliseconds.
         """
 
-        frames = float(time[:-1])
-        return int(int(frames) * (1000 / self.frame_rate))
+        return self.timeexpr_to_ms(time)
 
     def offset_ticks_to_ms(self, time):
         """Convert offset-time expression with t metric to milliseconds.
         """
 
-        ticks = int(time[:-1])
-        seconds = 1.0 / self.tick_rate
-        return self._scaler((seconds * ticks) * 1000)
+        return self.timeexpr_to_ms(time)
 
     def offset_hours_to_ms(self, time):
         """Convert offset-time expression with h metric to milliseconds.
         """
 
-        hours = float(time[:-1])
-        return self._scaler(self._metric_to_ms(3.6e6, hours))
+        return self.timeexpr_to_ms(time)
 
     def offset_minutes_to_ms(self, time):
         """Convert offset-time expression with m metric to milliseconds.
         """
 
-        return self._scaler(self._metric_to_ms(60 * 1000, float(time[:-1])))
+        return self.timeexpr_to_ms(time)
 
     def offset_seconds_to_ms(self, time):
         """Convert offset-time expression with s metric to milliseconds.
         """
 
-        seconds = float(time[:-1])
-        return self._scaler(self._metric_to_ms(1000, seconds))
+        return self.timeexpr_to_ms(time)
 
     def offset_ms_to_ms(self, time):
         """Convert offset-time expression with ms metric to milliseconds.
         """
 
-        ms = int(time[:-2])
-        return self._scaler(ms)
+        return self.timeexpr_to_ms(time)
 
     def fraction_timestamp_to_ms(self, timestamp):
         """Convert hh:mm:ss.fraction to milliseconds
         """
 
-        hh, mm, ss, fraction = re.split(r'[:.]', timestamp)
-        hh, mm, ss = [int(i) for i in (hh, mm, ss)]
-        # Resolution beoynd ms is useless for our purposes
-        ms = int(fraction[:3])
+        return self.timeexpr_to_ms(timestamp)
+
+    def frame_timestamp_to_ms(self, timestamp):
+        """Convert hh:mm:ss:frames (or hh:mm:ss) to milliseconds
+
+        Will handle hh:mm:ss:frames.sub-frames by discarding the sub-frame part
+        """
 
-        return self._scaler(self._hhmmss_to_ms(hh, mm, ss) + ms)
+        return self.timeexpr_to_ms(timestamp)
 
     def get_tt_style_attrs(self, node, in_head=False):
         """Extract node's style attributes
@@ -230,82 +1833,326 @@ class Ttml2Srt():
 
         Attributes are filtered against :attr:`Ttml2Srt.allowed_style_attrs`
         and returned as a dict whose keys are attribute names camel cased.
+        The referenced styles (style attribute) are under the `style_id`
+        key. `in_head` is no longer used since <style> elements can
+        reference other styles as well.
         """
 
+        if hasattr(node, 'getAttribute'):
+            get_attr = node.getAttribute
+        else:
+            get_attr = lambda name: node.get(self._clark_name(name), '')
+
         style = {}
         for attr_name in self.allowed_style_attrs:
             tts = 'tts:' + attr_name
             attr_name = Ttml2Srt.snake_to_camel(attr_name)
-            style[attr_name] = node.getAttribute(tts) or ''
-        if not in_head:
-            style['style_id'] = node.getAttribute('style')
+            style[attr_name] = get_attr(tts) or ''
+        style['style_id'] = get_attr('style')
         return style
 
-    def frame_timestamp_to_ms(self, timestamp):
-        """Convert hh:mm:ss:frames to milliseconds
-
-        Will handle hh:mm:ss:frames.sub-frames by discarding the sub-frame part
-        """
-
-        hh, mm, ss, frames = [int(i) for i in timestamp.split('.')[0].split(':')]
-        hhmmss_ms = self._hhmmss_to_ms(hh, mm, ss)
-        ms = self.frames_to_ms(frames)
-        return self._scaler(hhmmss_ms + ms)
-
-    def extract_dialogue(self, nodes, styles=[]):
+    def extract_dialogue(self, nodes, styles=(), escape=False):
         """Extract text content and styling attributes from <p> elements.
 
+        Walks the nodes with an explicit stack. Text nodes are normalized
+        as :attr:`whitespace` says and wrapped in the style tags of all
+        their enclosing elements, resolved through
+        :meth:`Ttml2Srt.element_tags`. Markup and text are joined once,
+        at the end.
+
         Args:
-            nodes (xml.dom.minidom.Node): List of <p> elements
-            styles (list): List of style signifiers that should be
+            nodes (xml.dom.minidom.Node): Child nodes of a <p> element
+            styles (tuple): Style tags (like 'i') that should be
                 applied to each node
+            escape (bool): Escape '<' and '&' of the text as &lt; and
+                &amp;, telling it apart from the style tags
 
         Return:
-            List of SRT paragraphs (strings)
+            Text content in SubRip (SRT) format
         """
 
         dialogue = []
+        append = dialogue.append
+        normalize = self._text_normalizer(escape)
+        style_wrap = self._style_wrap
+        element_tags = self.element_tags
+        text_nodes = 0
+
+        stack = [(iter(nodes), tuple(styles))]
+
+        while stack:
+            children, tags = stack[-1]
+
+            for node in children:
+
+                if node.nodeType == TEXT_NODE:
+                    text_nodes += 1
+                    if tags:
+                        prefix, suffix = style_wrap(tags)
+                        append(prefix)
+                        append(normalize(node.nodeValue))
+                        append(suffix)
+                    else:
+                        append(normalize(node.nodeValue))
+                    continue
 
-        for node in nodes:
+                name = node.localName
+
+                if name == 'br':
+                    append('\n')
+
+                if node.hasChildNodes():
+                    if name == 'span':
+                        # A missing attribute costs getAttribute() an
+                        # exception, hasAttribute() a lookup
+                        get_attr = node.getAttribute
+                        has_attr = node.hasAttribute
+                        tags = element_tags(
+                            tags, get_attr('style'),
+                            get_attr('tts:fontStyle'),
+                            get_attr('tts:fontWeight') \
+                                if has_attr('tts:fontWeight') else '',
+                            get_attr('tts:color') \
+                                if has_attr('tts:color') else '')
+                    stack.append((iter(node.childNodes), tags))
+                    break
 
-            _styles = []
+            else:
+                stack.pop()
 
-            if node.nodeType == node.TEXT_NODE:
+        if self.stats is not None:
+            self.stats.count('text_nodes', text_nodes)
 
-                format_str = '{}'
+        if self.whitespace == 'strip':
+            return _strip_lines(''.join(dialogue))
+        return ''.join(dialogue)
 
-                # Take the liberty to make a few stylistic choices. We don't
-                # want too many leading spaces or any unnessary new lines
-                text = re.sub(r'^\s{4,}', '', node.nodeValue.replace('\n', ''))
+    def extract_element_dialogue(self, element, styles=(), escape=False):
+        """Extract text content and styling attributes from an ElementTree
+        <p> element.
 
-                for style in styles:
-                    format_str = '{ot}{f}{et}'.format(
-                        et='</{}>'.format(style),
-                        ot='<{}>'.format(style),
-                        f=format_str)
+        Counterpart of :meth:`Ttml2Srt.extract_dialogue` for documents read
+        with the iterparse parser. Text is held in the `text` and `tail`
+        attributes of elements instead of separate text nodes; the tail of
+        an element belongs to its parent.
+        """
 
-                try:
-                    dialogue.append(format_str.format(text))
-                except UnicodeEncodeError:
-                    dialogue.append(format_str.format(text.encode('utf8')))
+        dialogue = []
+        append = dialogue.append
+        normalize = self._text_normalizer(escape)
+        style_wrap = self._style_wrap
+        element_tags = self.element_tags
+        font_style_attr, font_weight_attr, color_attr = \
+            self._inline_style_names()
+        text_nodes = 0
+
+        def add_text(text, tags):
+            if tags:
+                prefix, suffix = style_wrap(tags)
+                append(prefix)
+                append(normalize(text))
+                append(suffix)
+            else:
+                append(normalize(text))
+
+        styles = tuple(styles)
+        if element.text:
+            text_nodes += 1
+            add_text(element.text, styles)
+
+        # (children left to walk, tags of the parent, parent)
+        stack = [(iter(element), styles, None)]
+
+        while stack:
+            children, tags, _parent = stack[-1]
+
+            for child in children:
+
+                name = _local_name(child.tag)
+
+                if name == 'br':
+                    append('\n')
+
+                if name == 'span' and child.attrib:
+                    get = child.get
+                    child_tags = element_tags(
+                        tags, get('style', ''), get(font_style_attr, ''),
+                        get(font_weight_attr, ''), get(color_attr, ''))
+                else:
+                    child_tags = tags
+
+                if child.text:
+                    text_nodes += 1
+                    add_text(child.text, child_tags)
 
-            elif node.localName == 'br':
-                dialogue.append('\n')
+                if len(child):
+                    stack.append((iter(child), child_tags, child))
+                    break
 
-            # Checks for italics for now but shouldn't be too much work to
-            # support bold text or colors
-            elif node.localName == 'span':
-                style_attrs = self.get_tt_style_attrs(node)
-                inline_italic = style_attrs['font_style'] == 'italic'
-                assoc_italic = style_attrs['style_id'] in self.italic_style_ids
-                if inline_italic or assoc_italic:
-                    _styles.append('i')
+                if child.tail:
+                    text_nodes += 1
+                    add_text(child.tail, tags)
 
-            if node.hasChildNodes():
-                dialogue += self.extract_dialogue(node.childNodes, _styles)
+            else:
+                _children, _tags, parent = stack.pop()
+                if parent is not None and parent.tail:
+                    text_nodes += 1
+                    add_text(parent.tail, stack[-1][1])
+
+        if self.stats is not None:
+            self.stats.count('text_nodes', text_nodes)
 
+        if self.whitespace == 'strip':
+            return _strip_lines(''.join(dialogue))
         return ''.join(dialogue)
 
+    def _text_normalizer(self, escape):
+        """Return :attr:`normalize_text`, escaping markup if `escape`
+        """
+
+        normalize = self.normalize_text
+        if escape:
+            return lambda text: _escape_markup(normalize(text))
+        return normalize
+
+    def _container_style(self, element):
+        """Return the id of an anonymous style made of the style
+        attributes of a time container (<body>, <div>), None if it has
+        none.
+
+        Like a <style>, the style sets what the styles it references set,
+        overridden by the container's inline style attributes, so listing
+        the styles of nested containers outermost first and before the
+        <p>'s own style references gives the inherited styles their
+        precedence. Ids start with '#', which xml:ids can't.
+        """
+
+        attrs = self.get_tt_style_attrs(element)
+        if not any(attrs.values()):
+            return None
+
+        key = tuple(sorted(attrs.items()))
+        style_id = self._container_style_ids.get(key)
+        if style_id is None:
+            style_id = self._container_style_ids[key] = '#{}'.format(
+                len(self._container_style_ids))
+            self.styles[style_id] = attrs
+            # Containers read by iterparse come after styles are prepared
+            if hasattr(self, 'style_tags'):
+                self.style_tags[style_id] = self._resolve_style(style_id, ())
+        return style_id
+
+    def _prepare_styles(self):
+        """Resolve <style> definitions, including styles they reference,
+        into the style tags they set, and <region>s into the style tags
+        of the content shown in them.
+        """
+
+        # Memos for element_tags() and _style_wrap()
+        self._element_tags = {}
+        self._style_wraps = {}
+
+        self.style_tags = {}
+        for style_id in self.styles:
+            self.style_tags[style_id] = self._resolve_style(style_id, ())
+
+        # Of <style>s, not containers
+        self.italic_style_ids = [sid for sid, tags in self.style_tags.items() \
+            if tags.get('i') and not sid.startswith('#')]
+
+        self.region_tags = {}
+        for region_id, region in self.regions.items():
+            self.region_tags[region_id] = self.element_tags(
+                (), region['style_id'], region['font_style'],
+                region['font_weight'], region['color'])
+
+    def _resolve_style(self, style_id, referrers):
+        """Return the style tags a <style> sets as {tag name: tag}, an
+        empty tag for tags it unsets (like 'i' of tts:fontStyle="normal")
+        """
+
+        style = self.styles.get(style_id)
+        if style is None or style_id in referrers:
+            return {}
+
+        tags = {}
+        for ref in (style.get('style_id') or '').split():
+            tags.update(self._resolve_style(ref, referrers + (style_id,)))
+        tags.update(self._inline_style_tags(
+            style['font_style'], style['font_weight'], style['color']))
+        return tags
+
+    @staticmethod
+    def _inline_style_tags(font_style, font_weight, color):
+        """Return the style tags set by tts:fontStyle, tts:fontWeight and
+        tts:color values, like :meth:`Ttml2Srt._resolve_style`
+        """
+
+        tags = {}
+        if font_style:
+            tags['i'] = 'i' if font_style in ('italic', 'oblique') else ''
+        if font_weight:
+            tags['b'] = 'b' if font_weight == 'bold' else ''
+        if color:
+            color = _subrip_color(color)
+            if color is not None:
+                tags['font'] = 'font color="{}"'.format(color) if color \
+                    else ''
+        return tags
+
+    def _inline_style_names(self):
+        """Return the names of the tts:fontStyle, tts:fontWeight and
+        tts:color attributes as ElementTree reads them
+        """
+
+        names = getattr(self, '_inline_style_clark_names', None)
+        if names is None:
+            names = self._inline_style_clark_names = tuple(
+                self._clark_name(name) for name in
+                ('tts:fontStyle', 'tts:fontWeight', 'tts:color'))
+        return names
+
+    def element_tags(self, inherited, style_ref, font_style, font_weight='',
+            color=''):
+        """Return style tags of an element
+
+        Tags of the styles an element references override those it
+        inherits, and its inline style attributes override both. Each
+        distinct combination is resolved once.
+
+        Args:
+            inherited (tuple): Tags of the parent element
+            style_ref (str): Value of the element's style attribute,
+                a space separated list of style ids
+            font_style (str): Value of the element's tts:fontStyle attribute
+            font_weight (str): Value of its tts:fontWeight attribute
+            color (str): Value of its tts:color attribute
+        """
+
+        key = (inherited, style_ref, font_style, font_weight, color)
+        tags = self._element_tags.get(key)
+        if tags is None:
+            resolved = dict((tag.partition(' ')[0], tag) for tag in inherited)
+            for style_id in style_ref.split():
+                resolved.update(self.style_tags.get(style_id, ()))
+            if font_style or font_weight or color:
+                resolved.update(self._inline_style_tags(
+                    font_style, font_weight, color))
+            tags = self._element_tags[key] = tuple(
+                sorted(tag for tag in resolved.values() if tag))
+        return tags
+
+    def _style_wrap(self, tags):
+        """Return opening and closing markup for a tuple of style tags
+        """
+
+        wrap = self._style_wraps.get(tags)
+        if wrap is None:
+            wrap = self._style_wraps[tags] = (
+                ''.join('<{}>'.format(t) for t in reversed(tags)),
+                ''.join('</{}>'.format(t.partition(' ')[0]) for t in tags))
+        return wrap
+
     def timeexpr_to_subrip(self, time_expr):
         ms = self.timeexpr_to_ms(time_expr) + self.shift
         return ms, self.ms_to_subrip(ms)
@@ -328,33 +2175,153 @@ class Ttml2Srt():
                 2: dialogue
         """
 
-        sequalized = []
+        return list(self.iter_sequalized(subs))
+
+    def iter_sequalized(self, subs):
+        """Combine parallel paragraphs as they come in
+
+        Lazy counterpart of :meth:`Ttml2Srt.sequalize`. `subs` can be any
+        iterable ordered by begin time; only the paragraphs overlapping the
+        one being combined are held.
+        """
+
+        return self.with_subrip_times(self.iter_merged(
+            (sub[0], sub[1], sub[4]) for sub in subs))
+
+    def iter_merged(self, cues):
+        """Combine overlapping cues as they come in, as :attr:`overlap`
+        says
+
+        Args:
+            cues: iterable of (begin ms, end ms, dialogue) ordered by begin
+                time, e.g. a :class:`CueStore`
+
+        Yields (begin ms, end ms, dialogue) tuples. Cues overlapping each
+        other, directly or through cues in between, form a cluster that
+        is held until a cue begins after all of it has ended. With the
+        merge policy a cluster becomes one cue spanning all of it, its
+        dialogue joined in begin time order. With split it's cut into
+        time slices at every begin and end inside it, each with the
+        dialogue of the cues showing throughout. With keep, cues are
+        yielded as they are.
+        """
+
+        if self.overlap == 'keep':
+            return iter(cues)
+        if self.overlap == 'split':
+            return (piece for cluster in iter_overlap_clusters(cues) \
+                for piece in split_cluster(cluster))
+        return self._iter_merged_clusters(cues)
 
-        for i in range(len(subs)):
+    def _iter_merged_clusters(self, cues):
+        """The merge policy of :meth:`Ttml2Srt.iter_merged`, without
+        building lists for cues overlapping nothing
+        """
 
-            _prev_begin_ms, prev_end_ms, prev_begin_sr, \
-                prev_end_sr, _prev_dialogue = subs[i - 1]
+        pending = None
+        texts = None
+        cluster_end = None
 
-            curr_begin_ms, curr_end_ms, curr_begin_sr, \
-                curr_end_sr, curr_dialogue = subs[i]
+        for cue in cues:
+            begin, end, dialogue = cue
 
-            if i == 0 or curr_begin_ms >= prev_end_ms:
-                sequalized.append((curr_begin_sr, curr_end_sr, curr_dialogue))
+            if cluster_end is not None and begin < cluster_end:
+                if texts is None:
+                    texts = [pending[2]]
+                texts.append(dialogue)
+                if end > cluster_end:
+                    cluster_end = end
                 continue
 
-            sequalized.append((
-                prev_begin_sr,
-                curr_end_sr if curr_end_ms > prev_end_ms else prev_end_sr,
-                sequalized.pop()[-1] + '\n' + curr_dialogue,
-            ))
+            if texts is not None:
+                yield pending[0], cluster_end, '\n'.join(texts)
+                texts = None
+            elif pending is not None:
+                yield pending
+            pending = cue
+            cluster_end = end
+
+        if texts is not None:
+            yield pending[0], cluster_end, '\n'.join(texts)
+        elif pending is not None:
+            yield pending
+
+    def with_subrip_times(self, cues):
+        """Yield (begin, end, dialogue) of (begin ms, end ms, dialogue)
+        `cues` with the times in SubRip form
+        """
+
+        ms_to_subrip = self.ms_to_subrip
+        for begin, end, dialogue in cues:
+            yield ms_to_subrip(begin), ms_to_subrip(end), dialogue
+
+    def read_parag(self, paragraph, escape=False):
+        """Extract begin and end attrs, and text content of <p> element.
+
+        Args:
+            paragragh (xml.dom.minidom.Element,
+                xml.etree.ElementTree.Element or tuple): <p> element or an
+                already read paragraph (as restored from a :class:`CueCache`,
+                escaped).
+            escape (bool): Escape '<' and '&' of the text (see
+                :meth:`Ttml2Srt.extract_dialogue`)
+
+        Returns:
+            Tuple containing
+                begin time expression,
+                end time expression,
+                text content in Subrip (SRT) format.
+        """
 
-        return sequalized
+        if isinstance(paragraph, tuple):
+            if escape:
+                return paragraph
+            begin, end, dialogue = paragraph
+            return begin, end, _unescape_markup(dialogue)
+
+        if hasattr(paragraph, 'attrib'):
+            get = paragraph.get
+            begin = paragraph.attrib['begin']
+            end = paragraph.attrib['end']
+            font_style_attr, font_weight_attr, color_attr = \
+                self._inline_style_names()
+            tags = self.element_tags(
+                self.region_tags.get(get('region'), ()), get('style', ''),
+                get(font_style_attr, ''), get(font_weight_attr, ''),
+                get(color_attr, ''))
+            dialogue = self.extract_element_dialogue(paragraph, tags, escape)
+        else:
+            get_attr = paragraph.getAttribute
+            has_attr = paragraph.hasAttribute
+            begin = paragraph.attributes['begin'].value
+            end = paragraph.attributes['end'].value
+            region = get_attr('region') if has_attr('region') else ''
+            containers = self._containers.get(paragraph.parentNode) \
+                if self._containers else None
+            if containers:
+                container_styles, container_region = containers
+                inherited = self.element_tags(self.region_tags.get(
+                    region or container_region, ()), container_styles, '')
+            else:
+                inherited = self.region_tags.get(region, ())
+            # A missing attribute costs getAttribute() an exception,
+            # hasAttribute() a lookup
+            tags = self.element_tags(inherited,
+                get_attr('style') if has_attr('style') else '',
+                get_attr('tts:fontStyle') if has_attr('tts:fontStyle') else '',
+                get_attr('tts:fontWeight') \
+                    if has_attr('tts:fontWeight') else '',
+                get_attr('tts:color') if has_attr('tts:color') else '')
+            dialogue = self.extract_dialogue(
+                paragraph.childNodes, tags, escape)
+
+        return begin, end, dialogue
 
     def process_parag(self, paragraph):
         """Extract begin and end attrs, and text content of <p> element.
 
         Args:
-            paragragh (xml.dom.minidom.Element): <p> element.
+            paragragh: <p> element (see :meth:`Ttml2Srt.read_parag`).
 
         Returns:
             Tuple containing
@@ -365,21 +2332,137 @@ class Ttml2Srt():
                 text content in Subrip (SRT) format.
         """
 
-        begin = paragraph.attributes['begin'].value
-        end = paragraph.attributes['end'].value
+        ms_begin, ms_end, dialogue = self.parag_to_ms(paragraph)
+
+        return ms_begin, ms_end, self.ms_to_subrip(ms_begin), \
+            self.ms_to_subrip(ms_end), dialogue
+
+    def parag_to_ms(self, paragraph, escape=False):
+        """Like :meth:`Ttml2Srt.process_parag`, without SubRip timestamps
+
+        Returns:
+            Tuple of shifted begin and end in ms and the dialogue.
+        """
 
-        ms_begin, subrip_begin = self.timeexpr_to_subrip(begin)
-        ms_end, subrip_end = self.timeexpr_to_subrip(end)
+        begin, end, dialogue = self.read_parag(paragraph, escape)
 
-        dialogue = self.extract_dialogue(paragraph.childNodes)
+        ms_begin, ms_end = self.timeexprs_to_ms((begin, end))
 
-        return ms_begin, ms_end, subrip_begin, subrip_end, dialogue
+        return ms_begin + self.shift, ms_end + self.shift, dialogue
 
     def to_paragraphs(self):
-        subs = sorted(
-            [self.process_parag(p) for p in self.lines], key=lambda x: x[0])
+        return list(self.iter_paragraphs())
+
+    def iter_paragraphs(self):
+        """Yield combined paragraphs as (begin, end, dialogue) tuples with
+        SubRip timestamps.
+        """
+
+        return self.with_subrip_times(self.iter_cues())
+
+    def iter_structured_cues(self):
+        """Yield combined paragraphs as :class:`Cue` tuples of begin and
+        end in ms and the dialogue as :class:`TextRun` pieces, for callers
+        that want timings and styles rather than SubRip text
+        """
+
+        for begin, end, dialogue in self.iter_cues(escape=True):
+            yield Cue(begin, end, dialogue_runs(dialogue))
+
+    def iter_cues(self, escape=False):
+        """Yield combined paragraphs as (begin ms, end ms, dialogue) tuples,
+        with '<' and '&' of the text escaped if `escape` (see
+        :meth:`Ttml2Srt.extract_dialogue`)
+
+        Paragraphs are read, converted and combined one at a time when
+        their begin times are already in order, which is the norm. Only
+        documents that aren't get all their paragraphs sorted up front.
+
+        Whether they are is found out before the first cue, by
+        :meth:`Ttml2Srt._begins_monotonic` converting every begin time,
+        which for the iterparse parser is an extra expat pass over the
+        source. Finding out while streaming would let a paragraph out of
+        order turn up after cues that should follow it have been yielded
+        (and written). So the first cue waits for a pass over the begin
+        times, while the dialogue still isn't held in memory.
+        """
+
+        if self.stats is not None:
+            return iter(self._timed_cues(escape))
+
+        cues = (self.parag_to_ms(p, escape) for p in self.lines)
+        if not self._begins_monotonic():
+            cues = CueStore(cues)
+            if self.time_map is not None:
+                self.time_map.map_store(cues)
+            cues.sort()
+        elif self.time_map is not None:
+            cues = self.time_map.map_cues(cues)
+
+        return self.iter_merged(cues)
+
+    def _timed_cues(self, escape=False):
+        """Run the stages of :meth:`Ttml2Srt.iter_cues` one after another,
+        recording their durations in :attr:`stats`
+        """
+
+        stats = self.stats
+
+        started = _clock()
+        cues = CueStore(self.parag_to_ms(p, escape) for p in self.lines)
+        if self.time_map is not None:
+            self.time_map.map_store(cues)
+        stats.add_time('extract', _clock() - started)
+        stats.count('cues', len(cues))
+        self.expr_memo.count(stats, 'expr')
+
+        started = _clock()
+        if not cues.is_sorted():
+            cues.sort()
+        stats.add_time('sort', _clock() - started)
+
+        started = _clock()
+        merged = list(self.iter_merged(cues))
+        stats.add_time('merge', _clock() - started)
+        if self.overlap == 'split':
+            stats.count('slices', len(merged))
+        else:
+            stats.count('merged', len(cues) - len(merged))
 
-        return self.sequalize(subs)
+        return merged
+
+    def _begins_monotonic(self):
+        """Tell whether <p>s are in order of begin time.
+
+        Reads only begin attributes. Returns False when that isn't possible
+        without consuming :attr:`lines` (non-seekable streamed source).
+        """
+
+        if isinstance(self.lines, _StreamedParagraphs):
+            begins = self.lines.begin_exprs()
+            if begins is None:
+                return False
+        else:
+            begins = (
+                p[0] if isinstance(p, tuple) else \
+                p.attrib['begin'] if hasattr(p, 'attrib') else \
+                p.attributes['begin'].value
+                for p in self.lines)
+
+        last = None
+        try:
+            while True:
+                chunk = list(itertools.islice(begins, 1024))
+                if not chunk:
+                    return True
+                values = self.timeexprs_to_ms(chunk)
+                if last is not None and values[0] < last:
+                    return False
+                if any(b < a for a, b in zip(values, values[1:])):
+                    return False
+                last = values[-1]
+        finally:
+            begins.close()
 
     def determine_ms_convfn(self, time_expr):
         """Determine approriate ms conversion fn to pass the time expression to.
@@ -390,108 +2473,180 @@ class Ttml2Srt():
         Return:
             Conversion method (callable)
 
-        Strips the time expression of digits and uses the resulting string as
-        a key to a dict of conversion methods.
+        Conversion itself doesn't need this anymore (see
+        :meth:`Ttml2Srt.timeexprs_to_ms`), the method tells which form the
+        expression is of.
         """
 
-        # Map time expression delimiters to conversion methods. Saves
-        # us from having to exec multibranch code on each line but assumes all
-        # time expressions to be of the same form.
-        time_expr_fns = {
+        # Raises NotImplementedError for unknown forms
+        self.timeexpr_to_ms(time_expr)
 
-            # clock-time, no frames or fraction
-            # Example(s): "00:02:23"
-            '::': self.frame_timestamp_to_ms,
+        if time_expr[-1:].isdigit():
+            return self.fraction_timestamp_to_ms \
+                if time_expr.count(':') == 2 and '.' in time_expr \
+                else self.frame_timestamp_to_ms
 
-            # clock-time, frames
-            # Example(s): "00:02:23:12", "00:02:23:12.222"
-            ':::': self.frame_timestamp_to_ms,
-            ':::.': self.frame_timestamp_to_ms,
+        metric = 'ms' if time_expr.endswith('ms') else time_expr[-1]
 
-            # clock-time, fraction
-            # Example(s): "00:02:23.283"
-            '::.': self.fraction_timestamp_to_ms,
-
-            # offset-time, hour metric
-            # Example(s): "1h", "1.232837372637h"
+        return {
             'h': self.offset_hours_to_ms,
-            '.h': self.offset_hours_to_ms,
-
-            # offset-time, minute metric
-            # Example(s): "1m", "13.72986323m"
             'm': self.offset_minutes_to_ms,
-            '.m': self.offset_minutes_to_ms,
-
-            # offset-time, second metric
-            # Example(s): "1s", "113.2312312s"
             's': self.offset_seconds_to_ms,
-            '.s': self.offset_seconds_to_ms,
-
-            # offset-time, millisecond metric
-            # Example(s): "1ms", "1000.1231231231223ms"
             'ms': self.offset_ms_to_ms,
-            '.ms': self.offset_ms_to_ms,
-
-            # offset-time, frame metric
-            # Example(s): "100f"
             'f': self.offset_frames_to_ms,
-            '.f': self.offset_frames_to_ms,
-
-            # offset-time, tick metric
-            # Example(s): "19298323t"
             't': self.offset_ticks_to_ms,
-            '.t': self.offset_ticks_to_ms,
-
-        }
-
-        try:
-            delims = ''.join([i for i in time_expr if not i.isdigit()])
-            return time_expr_fns[delims]
-        except KeyError:
-            raise NotImplementedError(
-                'Unknown timestamp format ("{}")'.format(time_expr))
+        }[metric]
 
     def paragraphs(self, generator=False):
         """Return SubRip paragraphs
         """
 
-        srt_format_str = '{}\n{} --> {}\n{}\n\n'
-
         if generator:
+            srt_format_str = u'{}\n{} --> {}\n{}\n\n'
             return (srt_format_str.format(i + 1, *s) \
-                for i, s in enumerate(self.to_paragraphs()))
+                for i, s in enumerate(self.iter_paragraphs()))
+
+        return ''.join([chunk for _count, chunk \
+            in self.srt_chunks(self.iter_paragraphs())])
+
+    @staticmethod
+    def srt_chunks(paragraphs, chunk_size=OUTPUT_CHUNK_SIZE, start=1):
+        """Yield (count, text) chunks of formatted SubRip with `count`
+        of the (begin, end, dialogue) `paragraphs` in each `text`,
+        numbering paragraphs from `start`.
+
+        Paragraph pieces are collected into one buffer and joined once per
+        chunk instead of formatting a string for every paragraph.
+        """
 
-        return ''.join([srt_format_str.format(i + 1, *s) \
-            for i, s in enumerate(self.to_paragraphs())])
+        buf = []
+        add = buf.append
+        count = 0
+
+        for index, (begin, end, dialogue) in enumerate(paragraphs, start):
+            add(str(index))
+            add('\n')
+            add(begin)
+            add(' --> ')
+            add(end)
+            add('\n')
+            add(dialogue)
+            add('\n\n')
+            count += 1
+            if count == chunk_size:
+                yield count, ''.join(buf)
+                del buf[:]
+                count = 0
+
+        if count:
+            yield count, ''.join(buf)
+
+    def to_bytes(self, encoding='utf-8'):
+        """Return the complete SRT as bytes
+        """
+
+        return b''.join([chunk.encode(encoding) \
+            for _count, chunk in self.srt_chunks(self.iter_paragraphs())])
 
-    def write2file(self, output, close_fd=False):
+    def write2file(self, output, close_fd=False, encoding='utf-8'):
         """Write SRT file
 
         `output` can be
-            - file like object
+            - file like object, opened either in text or binary mode
+            - socket (anything with `sendall` but no `write`)
             - filename (str)
             - None or '-' (for stdout)
+
+        Output is written in chunks of formatted paragraphs. Binary
+        targets, files opened by name and stdout (on Python 3) get the
+        chunks encoded with `encoding`.
+
+        Returns the number of paragraphs written.
         """
 
+        handle, write, binary = _open_output(output)
+
+        stats = self.stats
+        count = 0
+        output_bytes = 0
         try:
-            sys
-        except NameError:
-            import sys
-
-        if hasattr(output, 'write') and callable(output.write):
-            handle = output
-        elif output == '-':
-            handle = sys.stdout
-        else:
-            handle = open(output, 'w', encoding="utf-8")
+            chunks = self.srt_chunks(self.iter_paragraphs())
+            started = _clock()
+            for chunk_count, chunk in chunks:
+                if binary:
+                    chunk = chunk.encode(encoding)
+                    output_bytes += len(chunk)
+                elif stats is not None:
+                    output_bytes += len(chunk.encode(encoding))
+                write(chunk)
+                count += chunk_count
+            if stats is not None:
+                stats.add_time('write', _clock() - started)
+                stats.count('paragraphs', count)
+                stats.count('output_bytes', output_bytes)
+                self.subrip_memo.count(stats, 'srt')
+        finally:
+            _close_output(handle, output, close_fd)
+
+        return count
 
+    def write_formats(self, outputs, close_fd=False, encoding='utf-8'):
+        """Write subtitles in several formats from one pass over the cues
+
+        `outputs` maps format names of :data:`WRITERS` (or
+        :class:`SubtitleWriter` subclasses) to outputs, each one of those
+        taken by :meth:`Ttml2Srt.write2file`. A list of (format, output)
+        pairs works too.
+
+        Returns the number of cues written to each output.
+        """
+
+        if hasattr(outputs, 'items'):
+            outputs = outputs.items()
+
+        stats = self.stats
+        targets = []
+        count = 0
+        output_bytes = 0
         try:
-            for parag in self.paragraphs(generator=True):
-                handle.write(parag)
+            for writer, output in outputs:
+                writer = WRITERS.get(writer, writer)(self)
+                handle, write, binary = _open_output(output)
+                targets.append((writer, output, handle, write, binary))
+
+            # Writers tell the converter's own tags from the text's
+            cues = self.iter_cues(escape=True)
+            started = _clock()
+            texts = [(target, target[0].header()) for target in targets]
+            while texts:
+                for (_writer, _output, _handle, write, binary), text in texts:
+                    if not text:
+                        continue
+                    if isinstance(text, bytes):
+                        # Headers are byte strings on Python 2
+                        text = text.decode('ascii')
+                    if binary or stats is not None:
+                        data = text.encode(encoding)
+                        output_bytes += len(data)
+                    write(data if binary else text)
+
+                chunk = list(itertools.islice(cues, OUTPUT_CHUNK_SIZE))
+                if not chunk:
+                    break
+                texts = [(target, target[0].format_cues(chunk, count + 1)) \
+                    for target in targets]
+                count += len(chunk)
+
+            if stats is not None:
+                stats.add_time('write', _clock() - started)
+                stats.count('paragraphs', count)
+                stats.count('output_bytes', output_bytes)
+                self.subrip_memo.count(stats, 'srt')
         finally:
-            if (handle is output and close_fd) or \
-                    (handle is not output and handle is not sys.stdout):
-                handle.close()
+            for _writer, output, handle, _write, _binary in targets:
+                _close_output(handle, output, close_fd)
+
+        return count
 
     @staticmethod
     def mfn2srtfn(media_filename, lang=None, m_ext=True):
@@ -525,50 +2680,1358 @@ class Ttml2Srt():
                 camel += c
         return camel
 
-if __name__ == '__main__':
 
-    import argparse
-    import sys
+class SegmentedTtml2Srt(Ttml2Srt):
+    """Converter of a title delivered as a sequence of TTML segment
+    documents, as DASH, HLS and Smooth Streaming subtitle tracks are.
+
+    `segments` is an iterable of segments (paths or binary file objects)
+    in presentation order, all on the same timeline. Other arguments are
+    those of :class:`Ttml2Srt`, `shift` and the rest applying to every
+    segment. Segments are read as cues are consumed and only cues still
+    liable to be repeated are held, so output starts after the first
+    segments and memory use doesn't grow with the length of the title.
+
+    Cues repeated across segment boundaries are dropped: those with the
+    times and dialogue of a held cue, and those continuing a held cue with
+    the same dialogue that ended where they begin (which gets extended).
+
+    Segments given as an iterator can only be converted once.
+    """
+
+    def __init__(
+            self, segments, shift=0, source_fps=23.976,
+            target_duration=None, source_duration=None, parser='minidom',
+            cache=None, stats=None, anchors=None, overlap='merge',
+            whitespace='default'):
+
+        self._check_options(parser, overlap, whitespace)
+
+        self.segments = segments
+        self.stats = stats
+        self.overlap = overlap
+        self.time_map = TimeMap(anchors) if anchors else None
+
+        # Options of the converter of each segment
+        self.segment_options = dict(
+            shift=shift, source_fps=source_fps,
+            target_duration=target_duration, source_duration=source_duration,
+            parser=parser, cache=cache, stats=stats, whitespace=whitespace)
+
+        # Memos of Ttml2Srt's conversions (segments are read by converters
+        # of their own, with their own memos)
+        self.expr_memo = TimeMemo()
+        self.subrip_memo = TimeMemo()
+
+        # Language of the first segment
+        self.lang = None
+
+    def iter_segment_cues(self, escape=False):
+        """Yield a list of (begin ms, end ms, dialogue) cues per segment,
+        ordered by begin time
+        """
+
+        stats = self.stats
+
+        for source in self.segments:
+            segment = Ttml2Srt(source, **self.segment_options)
+            if self.lang is None:
+                self.lang = segment.lang
+
+            started = _clock()
+            cues = sorted(
+                (segment.parag_to_ms(p, escape) for p in segment.lines),
+                key=lambda cue: cue[0])
+
+            if stats is not None:
+                stats.add_time('extract', _clock() - started)
+                stats.count('segments')
+                stats.count('cues', len(cues))
+                segment.expr_memo.count(stats, 'expr')
+
+            yield cues
+
+    def iter_deduplicated(self, segments):
+        """Drop cues repeated across segment boundaries
+
+        Args:
+            segments: iterable of lists of (begin ms, end ms, dialogue)
+                cues, one list per segment, ordered by begin time
+
+        Yields the (begin ms, end ms, dialogue) cues of all segments
+        ordered by begin time. A cue is held until a segment not repeating
+        or continuing it has been read.
+        """
+
+        stats = self.stats
+        held = []
+
+        for cues in segments:
+            # Held cues by times and dialogue, and by end and dialogue
+            held_index = set(held)
+            ends_index = dict(((end, text), i) \
+                for i, (_begin, end, text) in enumerate(held))
+
+            repeated = set()
+            fresh = []
+            for cue in cues:
+                begin, end, text = cue
+                if cue in held_index:
+                    repeated.add(cue)
+                    continue
+                i = ends_index.pop((begin, text), None)
+                if i is None:
+                    fresh.append(cue)
+                    continue
+                held[i] = (held[i][0], end, text)
+                held_index.add(held[i])
+                ends_index[(end, text)] = i
+                repeated.add(held[i])
+
+            if stats is not None:
+                stats.count('duplicates', len(cues) - len(fresh))
+
+            # Held cues not repeated by this segment won't be by later
+            # ones. Yield them, unless cues still to come begin earlier.
+            cutoff = fresh[0][0] if fresh else None
+            done = 0
+            for cue in held:
+                if cue in repeated or cutoff is not None and cue[0] > cutoff:
+                    break
+                yield cue
+                done += 1
+
+            held = sorted(held[done:] + fresh, key=lambda cue: cue[0])
+
+        for cue in held:
+            yield cue
+
+    def iter_cues(self, escape=False):
+        """Yield combined (begin ms, end ms, dialogue) tuples of all
+        segments, reading segments as they're needed
+        """
+
+        cues = self.iter_deduplicated(self.iter_segment_cues(escape))
+        if self.time_map is not None:
+            cues = self.time_map.map_cues(cues)
+
+        return self.iter_merged(cues)
+
+
+class SubtitleWriter(object):
+    """Base of the subtitle formats of :meth:`Ttml2Srt.write_formats`
+
+    Writers format chunks of combined (begin ms, end ms, dialogue) cues of
+    `ttml`. Dialogue comes as :meth:`Ttml2Srt.iter_cues` makes it with
+    `escape`: with SubRip style tags (<i>, <b>), which `tags` maps to the
+    format's own, and <font color> tags, which :meth:`font` translates,
+    and '<' and '&' of the text escaped, so text reading as tags is left
+    alone.
+    """
+
+    extension = None
+    tags = {}
+    # SubRip <font> tags and the text in them, in dialogue as
+    # translate_tags() gets it
+    font_pattern = r'(?s)<font color="([^"]*)">(.*?)</font>'
+
+    def __init__(self, ttml):
+        self.ttml = ttml
+
+    def header(self):
+        return ''
+
+    def format_cues(self, cues, start):
+        """Return the text of `cues`, numbered from `start`
+        """
+
+        raise NotImplementedError
+
+    def translate_tags(self, dialogue):
+        for tag, replacement in self.tags.items():
+            dialogue = dialogue.replace(tag, replacement)
+        if 'font' in dialogue:
+            dialogue = _regex(self.font_pattern).sub(
+                lambda match: self.font(*match.groups()), dialogue)
+        return dialogue
+
+    def font(self, color, text):
+        """Return `text` shown in `color` (a named color or #rrggbb, as in
+        SubRip <font> tags) in the format's markup
+        """
+
+        return text
+
+
+class SrtWriter(SubtitleWriter):
+
+    extension = 'srt'
+
+    def format_cues(self, cues, start):
+        cues = [(begin, end, _unescape_markup(dialogue)) \
+            for begin, end, dialogue in cues]
+        return ''.join([chunk for _count, chunk in Ttml2Srt.srt_chunks(
+            self.ttml.with_subrip_times(cues), len(cues), start)])
+
+
+class VttWriter(SubtitleWriter):
+    """WebVTT, keeping style tags and escaping the rest of the markup
+    """
+
+    extension = 'vtt'
+
+    # Color classes of WebVTT by #rrggbb; other colors are dropped
+    COLOR_CLASSES = dict((NAMED_COLORS[name], name) for name in (
+        'white', 'lime', 'cyan', 'red', 'yellow', 'magenta', 'blue', 'black'))
+
+    def header(self):
+        return 'WEBVTT\n\n'
+
+    def timestamp(self, ms):
+        return self.ttml.ms_to_subrip(ms).replace(',', '.')
+
+    def font(self, color, text):
+        name = self.COLOR_CLASSES.get(NAMED_COLORS.get(color, color))
+        return '<c.{}>{}</c>'.format(name, text) if name else text
+
+    def escape(self, dialogue):
+        if '>' in dialogue:
+            # '>' of the text; tags, the only '<' left, are kept
+            dialogue = _regex(r'(<[^<>]*>)|>').sub(
+                lambda match: match.group(1) or '&gt;', dialogue)
+        if '<font' in dialogue:
+            dialogue = self.translate_tags(dialogue)
+        return dialogue
+
+    def format_cues(self, cues, start):
+        buf = []
+        add = buf.append
+        timestamp = self.timestamp
+        escape = self.escape
+
+        for begin, end, dialogue in cues:
+            add(timestamp(begin))
+            add(' --> ')
+            add(timestamp(end))
+            add('\n')
+            add(escape(dialogue))
+            add('\n\n')
+
+        return ''.join(buf)
+
+
+class AssWriter(SubtitleWriter):
+    """Advanced SubStation Alpha with a single default style
+    """
+
+    extension = 'ass'
+    tags = {
+        '<i>': '{\\i1}',
+        '</i>': '{\\i0}',
+        '<b>': '{\\b1}',
+        '</b>': '{\\b0}',
+    }
+
+    HEADER = (
+        '[Script Info]\n'
+        'ScriptType: v4.00+\n'
+        'WrapStyle: 0\n'
+        'ScaledBorderAndShadow: yes\n'
+        'PlayResX: 384\n'
+        'PlayResY: 288\n'
+        '\n'
+        '[V4+ Styles]\n'
+        'Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, '
+        'OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, '
+        'ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, '
+        'Alignment, MarginL, MarginR, MarginV, Encoding\n'
+        'Style: Default,Arial,16,&H00FFFFFF,&H000000FF,&H00000000,'
+        '&H00000000,0,0,0,0,100,100,0,0,1,1,0,2,10,10,10,1\n'
+        '\n'
+        '[Events]\n'
+        'Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, '
+        'Effect, Text\n'
+    )
+
+    def header(self):
+        return self.HEADER
+
+    def font(self, color, text):
+        # &HBBGGRR&, back to the style's color after the text
+        rgb = NAMED_COLORS.get(color, color)
+        return '{\\c&H' + (rgb[5:7] + rgb[3:5] + rgb[1:3]).upper() + '&}' + \
+            text + '{\\c}'
+
+    @staticmethod
+    def timestamp(ms):
+        return '{:d}:{:02d}:{:02d}.{:02d}'.format(
+            int(ms / 3.6e6), int((ms % 3.6e6) / 60000),
+            int((ms % 60000) / 1000), int((ms % 1000) / 10))
+
+    def escape(self, dialogue):
+        if '{' in dialogue or '}' in dialogue:
+            # Braces of the text would start override blocks
+            dialogue = dialogue.replace('{', '\\{').replace('}', '\\}')
+        return _unescape_markup(
+            self.translate_tags(dialogue)).replace('\n', '\\N')
+
+    def format_cues(self, cues, start):
+        buf = []
+        add = buf.append
+        timestamp = self.timestamp
+        escape = self.escape
+
+        for begin, end, dialogue in cues:
+            add('Dialogue: 0,')
+            add(timestamp(begin))
+            add(',')
+            add(timestamp(end))
+            add(',Default,,0,0,0,,')
+            add(escape(dialogue))
+            add('\n')
+
+        return ''.join(buf)
+
+
+# Subtitle formats of Ttml2Srt.write_formats() by name
+WRITERS = dict((writer.extension, writer) \
+    for writer in (SrtWriter, VttWriter, AssWriter))
+
+TTML_EXTENSIONS = ('.xml', '.ttml', '.dfxp')
+
+
+def _natural_key(path):
+    """Sort key putting numbered names in numeric order (seg-2 before
+    seg-10)
+    """
+
+    return [int(part) if part.isdigit() else part \
+        for part in _regex(r'(\d+)').split(path)]
+
+
+def find_ttml_files(sources, key=None):
+    """Expand directories (recursively), glob patterns and file paths into
+    a list of TTML files, sorting the files of directories and patterns
+    by `key` (their names by default)
+    """
+
+    import glob
+
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            for root, dirs, files in os.walk(source):
+                dirs.sort(key=key)
+                paths.extend(os.path.join(root, f) \
+                    for f in sorted(files, key=key) \
+                    if f.lower().endswith(TTML_EXTENSIONS))
+        elif any(c in source for c in '*?['):
+            paths.extend(sorted(glob.glob(source), key=key))
+        else:
+            paths.append(source)
+
+    # Drop duplicates picked up by overlapping sources
+    seen = set()
+    return [p for p in paths if not (p in seen or seen.add(p))]
+
+
+def _convert_for_batch(job):
+    """Convert a single file of a batch. Runs in a worker process.
 
+    Returns a tuple of input path, output path, paragraph count, input
+    size in bytes and error message (None on success).
+    """
+
+    path, output_dir, root, formats, kwargs = job
     try:
-        BrokenPipeError
-    except NameError:
-        BrokenPipeError = IOError
+        ttml = Ttml2Srt(path, **kwargs)
+        outputs, count = _write_batch_outputs(
+            ttml, _batch_output(path, ttml.lang, output_dir, root), formats)
+        return path, outputs[0], count, os.path.getsize(path), None
+    except Exception as e:
+        return path, None, 0, 0, '{}: {}'.format(type(e).__name__, e)
+
+
+def _source_root(paths):
+    """Return the deepest directory holding all of `paths`
+    """
+
+    # commonprefix() compares lists item by item
+    parts = os.path.commonprefix([
+        os.path.dirname(os.path.abspath(path)).split(os.sep) \
+        for path in paths])
+    return os.sep.join(parts) or os.sep
+
+
+def _batch_output(path, lang, output_dir, root=None):
+    """Return the SRT path of TTML file `path` in a batch, in
+    `output_dir` at the path of the source relative to `root` (the
+    directory of the source by default)
+    """
+
+    output = Ttml2Srt.mfn2srtfn(path, lang)
+    if output_dir:
+        output = os.path.join(output_dir, os.path.relpath(
+            os.path.abspath(output), root) if root \
+            else os.path.basename(output))
+    return output
+
+
+def _duplicate_outputs(paths, output_dir, root):
+    """Return {path: earlier path} of the `paths` whose output would be
+    that of an earlier one (like a.xml and a.ttml), leaving the language
+    out of the names as it isn't known before parsing
+    """
+
+    seen = {}
+    duplicates = {}
+    for path in paths:
+        output = _batch_output(path, None, output_dir, root)
+        if output in seen:
+            duplicates[path] = seen[output]
+        else:
+            seen[output] = path
+    return duplicates
 
-    argparser = argparse.ArgumentParser(
-        description='Convert TTML document to SubRip (SRT).')
-    argparser.add_argument('ttml-file',
-        help='TTML subtitle file',
-        action='store')
-    argparser.add_argument('output-file',
-        nargs='?',
-        help='file to write resulting SRT to',
-        action='store')
+
+def _write_batch_outputs(ttml, output, formats):
+    """Write `ttml` to SRT file `output` and files of the other `formats`
+    named after it, creating its directory. Returns the paths written and
+    the paragraph count.
+    """
+
+    directory = os.path.dirname(output)
+    if directory and not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Made by another worker in the meantime
+            if not os.path.isdir(directory):
+                raise
+
+    if tuple(formats) == ('srt',):
+        return [output], ttml.write2file(output)
+    outputs = _format_outputs(output, formats)
+    return [path for _name, path in outputs], ttml.write_formats(outputs)
+
+
+def convert_batch(paths, output_dir=None, jobs=1, formats=('srt',),
+        **kwargs):
+    """Convert TTML files to SRT files using a pool of `jobs` processes.
+
+    SRT files are named with :meth:`Ttml2Srt.mfn2srtfn` and written next to
+    their source or to `output_dir`, in the subdirectories the sources are
+    in below the deepest directory holding all of them. Files of other
+    `formats` (names of :data:`WRITERS`) get the same name with their own
+    extension. Keyword arguments are passed to :class:`Ttml2Srt`.
+
+    Yields the tuples returned by :func:`_convert_for_batch` in the order
+    conversions finish. Failures don't stop the batch. Sources whose
+    output would be that of an earlier source fail before any conversion
+    starts.
+    """
+
+    paths = list(paths)
+    root = _source_root(paths) if output_dir and paths else None
+
+    duplicates = _duplicate_outputs(paths, output_dir, root)
+    for path in paths:
+        if path in duplicates:
+            yield path, None, 0, 0, \
+                'ValueError: same output as {}'.format(duplicates[path])
+
+    jobs_iter = ((path, output_dir, root, formats, kwargs) \
+        for path in paths if path not in duplicates)
+
+    if jobs == 1:
+        for job in jobs_iter:
+            yield _convert_for_batch(job)
+        return
+
+    import multiprocessing
+
+    pool = multiprocessing.Pool(jobs or None)
+    try:
+        for result in pool.imap_unordered(_convert_for_batch, jobs_iter, 4):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+# Ttml2Srt arguments that change the output of a conversion, recorded in
+# manifest results (see convert_manifest)
+MANIFEST_PARAMS = (
+    'shift',
+    'source_fps',
+    'target_duration',
+    'source_duration',
+    'anchors',
+    'overlap',
+    'whitespace',
+)
+
+
+def _manifest_params(kwargs, formats, output_dir):
+    """Return the conversion parameters of a manifest result as they read
+    back from JSON
+    """
+
+    import json
+
+    params = dict((name, kwargs[name]) for name in MANIFEST_PARAMS \
+        if kwargs.get(name) is not None)
+    params['formats'] = list(formats)
+    params['output_dir'] = output_dir
+    return json.loads(json.dumps(params))
+
+
+def _file_digest(path):
+    import hashlib
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _convert_for_manifest(job):
+    """Convert a file of a manifest batch. Runs in a worker process.
+
+    Returns its result record (see :func:`convert_manifest`).
+    """
+
+    path, output, output_dir, root, formats, kwargs, params = job
+    import hashlib
+
+    record = {'input': path, 'params': params}
+    started = _clock()
+    try:
+        stat = os.stat(path)
+        with open(path, 'rb') as f:
+            data = f.read()
+        record.update(size=stat.st_size, mtime=stat.st_mtime,
+            sha256=hashlib.sha256(data).hexdigest())
+        ttml = Ttml2Srt(io.BytesIO(data), **kwargs)
+        record['outputs'], record['cues'] = _write_batch_outputs(
+            ttml, output or _batch_output(path, ttml.lang, output_dir, root),
+            formats)
+        record['status'] = 'converted'
+    except Exception as e:
+        record['status'] = 'failed'
+        record['error'] = '{}: {}'.format(type(e).__name__, e)
+    record['seconds'] = round(_clock() - started, 6)
+    return record
+
+
+def _unchanged(record, path, params):
+    """Tell whether the result `record` of an earlier run still holds for
+    `path` converted with `params`
+    """
+
+    if record is None or record.get('status') != 'converted' or \
+            record.get('params') != params or \
+            not all(os.path.exists(output) for output in record['outputs']):
+        return False
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False
+    if stat.st_size != record['size']:
+        return False
+    # Same size and time stamp, or else the same content
+    return stat.st_mtime == record['mtime'] or \
+        _file_digest(path) == record['sha256']
+
+
+def _last_byte(path):
+    with open(path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1)
+
+
+def read_manifest_results(path):
+    """Return {input path: last result record} of a results file written
+    by :func:`convert_manifest`, empty if there's none. A line cut short
+    by an interrupted run is ignored.
+    """
+
+    import json
+
+    records = {}
+    if not os.path.exists(path):
+        return records
+    with io.open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            records[record['input']] = record
+    return records
+
+
+def convert_manifest(entries, results=None, output_dir=None, jobs=1,
+        formats=('srt',), **kwargs):
+    """Convert the TTML files of a manifest, skipping those converted
+    before with the same parameters and unchanged since.
+
+    `entries` are dicts with the TTML path under 'input', and optionally
+    an output SRT path under 'output' and Ttml2Srt arguments of
+    :data:`MANIFEST_PARAMS` overriding `kwargs` for that file. Plain
+    paths stand for {'input': path}. Other arguments are those of
+    :func:`convert_batch`.
+
+    `results` is a JSONL file of result records, read to find files that
+    can be skipped and appended to as conversions finish, so a rerun
+    after an interruption resumes where it stopped. A record holds the
+    input path, its size, mtime and SHA-256, the conversion `params`,
+    the `outputs` written, the paragraph count (`cues`), the conversion
+    time (`seconds`) and the `status`: 'converted' or 'failed' (with an
+    `error`).
+
+    Yields the records of all entries in the order conversions finish,
+    the earlier ones of skipped files with status 'unchanged'.
+    """
+
+    import json
+
+    previous = read_manifest_results(results) if results else {}
+
+    entries = [entry if hasattr(entry, 'get') else {'input': entry} \
+        for entry in entries]
+    # Outputs are laid out in output_dir as convert_batch() does it
+    inputs = [entry['input'] for entry in entries if not entry.get('output')]
+    root = _source_root(inputs) if output_dir and inputs else None
+
+    def jobs_iter():
+        for entry in entries:
+            path = entry['input']
+            options = dict(kwargs)
+            options.update((name, entry[name]) for name in MANIFEST_PARAMS \
+                if name in entry)
+            params = _manifest_params(options, formats, output_dir)
+            if entry.get('output'):
+                params['output'] = entry['output']
+            record = previous.get(path)
+            if _unchanged(record, path, params):
+                skipped.append(dict(record, status='unchanged'))
+                continue
+            yield (path, entry.get('output'), output_dir, root, formats,
+                options, params)
+
+    skipped = []
+    handle = None
+    if results:
+        handle = io.open(results, 'a', encoding='utf-8')
+        # End a line cut short by an interrupted run
+        if handle.tell() and _last_byte(results) != b'\n':
+            handle.write(u'\n')
+    try:
+        if jobs == 1:
+            records = (_convert_for_manifest(job) for job in jobs_iter())
+        else:
+            import multiprocessing
+
+            pool = multiprocessing.Pool(jobs or None)
+            records = pool.imap_unordered(_convert_for_manifest, jobs_iter(), 4)
+
+        try:
+            for record in records:
+                if handle is not None:
+                    line = json.dumps(record, sort_keys=True)
+                    handle.write(line if isinstance(line, type(u'')) \
+                        else line.decode('utf-8'))
+                    handle.write(u'\n')
+                    handle.flush()
+                while skipped:
+                    yield skipped.pop(0)
+                yield record
+            while skipped:
+                yield skipped.pop(0)
+        finally:
+            if jobs != 1:
+                pool.close()
+                pool.join()
+    finally:
+        if handle is not None:
+            handle.close()
+
+
+# Conversion options of the command line, by argparse dest
+CLI_DEFAULTS = dict(
+    shift=0,
+    sfps=23.976,
+    td=1,
+    sd=1,
+    parser='minidom',
+    cache_dir=None,
+    cache_size=256,
+    stats=False,
+    formats=['srt'],
+    anchors=None,
+    overlap='merge',
+    whitespace='default',
+)
+
+
+def _format_outputs(output, formats):
+    """Pair each of `formats` with `output` with the format's extension
+    """
+
+    base = os.path.splitext(output)[0]
+    return [(name, '{}.{}'.format(base, WRITERS[name].extension)) \
+        for name in formats]
+
+
+def _formats_arg(value):
+    import argparse
+
+    formats = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in formats if name not in WRITERS]
+    if unknown or not formats:
+        raise argparse.ArgumentTypeError(
+            'unknown format "{}" (choose from {})'.format(
+                ','.join(unknown), ', '.join(sorted(WRITERS))))
+    return formats
+
+
+def _add_formats_arg(argparser):
+    argparser.add_argument('--formats',
+        dest='formats', metavar='list',
+        help='comma separated output formats written from one conversion: '
+            '{} (default: srt)'.format(', '.join(sorted(WRITERS))),
+        type=_formats_arg, action='store')
+
+
+def _add_stats_arg(argparser):
+    # Only for commands converting a single title
+    argparser.add_argument('--stats',
+        dest='stats', help='print stage timings and counters to stderr',
+        action='store_true')
+
+
+def _add_conversion_args(argparser):
     argparser.add_argument('-s', '--shift',
         dest='shift', help='shift',
         metavar='ms', nargs='?',
-        const=0, default=0, type=int,
+        const=0, type=int,
         action='store')
     argparser.add_argument('-f', '--fps',
         dest='sfps', metavar='fps',
         help='frames per second (default: 23.976)',
-        nargs='?', const=23.976,
-        default=23.976, type=float,
+        nargs='?', const=23.976, type=float,
         action='store')
     argparser.add_argument('--t-dur',
         dest='td', metavar='sec',
         help='target duration',
-        nargs='?', type=int, default=1, action='store')
+        nargs='?', type=int, action='store')
     argparser.add_argument('--s-dur',
         dest='sd', metavar='sec',
         help='source duration',
-        nargs='?', type=int, default=1, action='store')
-    args = argparser.parse_args()
+        nargs='?', type=int, action='store')
+    argparser.add_argument('--parser',
+        dest='parser', choices=Ttml2Srt.PARSERS,
+        help='XML parser; iterparse keeps memory use flat on large '
+            'documents (default: minidom)',
+        action='store')
+    argparser.add_argument('--cache-dir',
+        dest='cache_dir', metavar='dir',
+        help='cache parsed documents in dir for faster reconversion',
+        action='store')
+    argparser.add_argument('--cache-size',
+        dest='cache_size', metavar='MB',
+        help='evict least recently used cache entries past this size '
+            '(default: 256)',
+        type=float, action='store')
+    argparser.add_argument('--anchors',
+        dest='anchors', metavar='file',
+        help='resync times through "source target" anchor pairs, one per '
+            'line (ms or hh:mm:ss,mmm)',
+        action='store')
+    argparser.add_argument('--overlap',
+        dest='overlap', choices=Ttml2Srt.OVERLAP_POLICIES,
+        help='overlapping cues are merged into one, split into time slices '
+            'or kept overlapping (default: merge)',
+        action='store')
+    argparser.add_argument('--whitespace',
+        dest='whitespace', choices=Ttml2Srt.WHITESPACE_POLICIES,
+        help='whitespace in text is collapsed, also stripped at line ends, '
+            'or kept as it is; by default only line feeds and deep '
+            'indentation are dropped (default: default)',
+        action='store')
+    argparser.set_defaults(**CLI_DEFAULTS)
+
+
+class _PlainArgs(object):
+    """Stand-in for the argparse namespace of plain command lines
+    """
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(CLI_DEFAULTS)
+        self.__dict__.update(kwargs)
+
+
+def _parse_plain_args(argv):
+    """Parse a `ttml-file [output-file]` command line without importing
+    argparse. Returns None for any other command line.
+    """
+
+    if not 1 <= len(argv) <= 2 or any(arg.startswith('-') for arg in argv):
+        return None
+
+    return _PlainArgs(**{
+        'ttml-file': argv[0],
+        'output-file': argv[1] if len(argv) == 2 else None,
+    })
+
+
+def _conversion_kwargs(args):
+    cache = CueCache(args.cache_dir, int(args.cache_size * 1024 * 1024)) \
+        if args.cache_dir else None
+    anchors = load_anchors(args.anchors) if args.anchors else None
+    return dict(
+        shift=args.shift, source_fps=args.sfps, target_duration=args.td,
+        source_duration=args.sd, parser=args.parser, cache=cache,
+        anchors=anchors, overlap=args.overlap, whitespace=args.whitespace)
+
+
+def run_cache_stats(argv):
+    """Entry point of the cache-stats command
+    """
+
+    import argparse
+
+    argparser = argparse.ArgumentParser(
+        prog='ttml2srt.py cache-stats',
+        description='Show size and entry count of a parsed document cache.')
+    argparser.add_argument('cache_dir',
+        metavar='dir', help='cache directory', action='store')
+    args = argparser.parse_args(argv)
+
+    if not os.path.isdir(args.cache_dir):
+        sys.stderr.write('{}: no such cache directory\n'.format(args.cache_dir))
+        return 1
+
+    stats = CueCache(args.cache_dir).stats()
+    sys.stdout.write(
+        '{directory}: {entries} entries, {mb:.2f} MB\n'.format(
+            mb=stats['size'] / 1024.0 / 1024.0, **stats))
+    return 0
+
+
+def run_batch(argv):
+    """Entry point of the batch command
+    """
 
-    ttml = Ttml2Srt(getattr(args, 'ttml-file'),
-        args.shift, args.sfps, args.td, args.sd)
+    import argparse
+
+    argparser = argparse.ArgumentParser(
+        prog='ttml2srt.py batch',
+        description='Convert many TTML documents to SubRip (SRT) files.')
+    argparser.add_argument('sources',
+        nargs='*', metavar='source',
+        help='TTML file, directory or glob pattern',
+        action='store')
+    argparser.add_argument('-l', '--file-list',
+        dest='file_list', metavar='file',
+        help='file with one TTML path per line ("-" for stdin)',
+        action='store')
+    argparser.add_argument('-o', '--output-dir',
+        dest='output_dir', metavar='dir',
+        help='directory to write SRT files to, keeping the subdirectories of '
+            'sources (default: next to sources)',
+        action='store')
+    argparser.add_argument('-j', '--jobs',
+        dest='jobs', metavar='N',
+        help='number of worker processes, 0 for one per CPU (default: 1)',
+        type=int, default=1, action='store')
+    argparser.add_argument('-m', '--manifest',
+        dest='manifest', metavar='file',
+        help='JSONL file of {"input": path} objects, optionally with '
+            '"output" and conversion options ("-" for stdin)',
+        action='store')
+    argparser.add_argument('--results',
+        dest='results', metavar='file',
+        help='JSONL file of conversion results, appended to; files converted '
+            'in it before with the same options and unchanged since are '
+            'skipped (default with --manifest: stdout)',
+        action='store')
+    _add_formats_arg(argparser)
+    _add_conversion_args(argparser)
+    args = argparser.parse_args(argv)
+
+    sources = list(args.sources)
+    if args.file_list:
+        handle = sys.stdin if args.file_list == '-' else open(args.file_list)
+        sources.extend(l.strip() for l in handle if l.strip())
+        if handle is not sys.stdin:
+            handle.close()
+    paths = find_ttml_files(sources)
+
+    if args.output_dir and not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    if args.manifest or args.results:
+        return _run_manifest(args, paths)
+
+    started = time.time()
+    failed = paragraphs = size = 0
+    for path, output, count, nbytes, error in convert_batch(
+            paths, args.output_dir, args.jobs, args.formats,
+            **_conversion_kwargs(args)):
+        if error:
+            failed += 1
+            sys.stderr.write('{}: {}\n'.format(path, error))
+            continue
+        paragraphs += count
+        size += nbytes
+
+    elapsed = max(time.time() - started, 1e-6)
+    converted = len(paths) - failed
+    sys.stderr.write(
+        'Converted {}/{} files ({} failed), {} paragraphs in {:.2f}s: '
+        '{:.1f} files/s, {:.0f} paragraphs/s, {:.2f} MB/s\n'.format(
+            converted, len(paths), failed, paragraphs, elapsed,
+            converted / elapsed, paragraphs / elapsed,
+            size / elapsed / 1e6))
+
+    return 1 if failed else 0
+
+
+def _run_manifest(args, paths):
+    """Run the batch command with a manifest or results file
+    """
+
+    import json
+
+    entries = list(paths)
+    if args.manifest:
+        handle = sys.stdin if args.manifest == '-' else \
+            io.open(args.manifest, encoding='utf-8')
+        entries.extend(json.loads(l) for l in handle if l.strip())
+        if handle is not sys.stdin:
+            handle.close()
+
+    started = time.time()
+    counts = dict(converted=0, unchanged=0, failed=0)
+    paragraphs = 0
+    for record in convert_manifest(entries, args.results, args.output_dir,
+            args.jobs, args.formats, **_conversion_kwargs(args)):
+        counts[record['status']] += 1
+        if record['status'] == 'failed':
+            sys.stderr.write('{}: {}\n'.format(record['input'],
+                record['error']))
+        elif record['status'] == 'converted':
+            paragraphs += record['cues']
+        if not args.results:
+            sys.stdout.write(json.dumps(record, sort_keys=True) + '\n')
+
+    elapsed = max(time.time() - started, 1e-6)
+    sys.stderr.write(
+        'Converted {converted}/{total} files ({unchanged} unchanged, '
+        '{failed} failed), {paragraphs} paragraphs in {elapsed:.2f}s\n'.format(
+            total=len(entries), paragraphs=paragraphs, elapsed=elapsed,
+            **counts))
+
+    return 1 if counts['failed'] else 0
+
+
+def run_segments(argv):
+    """Entry point of the segments command
+    """
+
+    import argparse
+
+    argparser = argparse.ArgumentParser(
+        prog='ttml2srt.py segments',
+        description='Convert the TTML segments of a title (DASH, HLS, '
+            'Smooth Streaming) to one SubRip (SRT) file.')
+    argparser.add_argument('sources',
+        nargs='*', metavar='source',
+        help='TTML segment, directory or glob pattern; numbered names are '
+            'taken in numeric order',
+        action='store')
+    argparser.add_argument('-l', '--file-list',
+        dest='file_list', metavar='file',
+        help='file with one segment path per line, in order ("-" for stdin)',
+        action='store')
+    argparser.add_argument('-o', '--output',
+        dest='output', metavar='file',
+        help='file to write to; with several --formats, the name the other '
+            'files are named after (default: stdout)',
+        action='store')
+    _add_formats_arg(argparser)
+    _add_conversion_args(argparser)
+    _add_stats_arg(argparser)
+    args = argparser.parse_args(argv)
+
+    if len(args.formats) > 1 and args.output in (None, '-'):
+        argparser.error('several --formats need an --output')
+
+    sources = list(args.sources)
+    if args.file_list:
+        handle = sys.stdin if args.file_list == '-' else open(args.file_list)
+        sources.extend(l.strip() for l in handle if l.strip())
+        if handle is not sys.stdin:
+            handle.close()
+    paths = find_ttml_files(sources, _natural_key)
+    if not paths:
+        argparser.error('no segments given')
+
+    stats = ConversionStats() if args.stats else None
+    ttml = SegmentedTtml2Srt(paths, stats=stats, **_conversion_kwargs(args))
+    output = args.output or '-'
+
+    if args.formats == ['srt']:
+        ttml.write2file(output)
+    elif len(args.formats) == 1:
+        ttml.write_formats([(args.formats[0], output)])
+    else:
+        ttml.write_formats(_format_outputs(output, args.formats))
+
+    if stats is not None:
+        sys.stderr.write(stats.report())
+
+    return 0
+
+
+def _convert_for_server(job):
+    """Convert a request body. Runs in a worker process.
+    """
+
+    data, kwargs = job
+    return Ttml2Srt(io.BytesIO(data), **kwargs).to_bytes()
+
+
+def _init_server_worker():
+    """Leave shutting down worker processes to the server
+    """
+
+    import signal
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+
+class RequestLatencies(object):
+    """Latencies of the last `window` requests served, plus totals
+    """
+
+    def __init__(self, window=10000):
+        import collections
+        import threading
+
+        self.latencies = collections.deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def add(self, seconds, error=False):
+        with self._lock:
+            self.latencies.append(seconds)
+            self.requests += 1
+            self.errors += bool(error)
+
+    def percentiles(self, pcts=(50, 90, 99, 100)):
+        """Return {pct: ms} for the latencies in the window
+        """
+
+        with self._lock:
+            latencies = sorted(self.latencies)
+        if not latencies:
+            return dict((pct, None) for pct in pcts)
+        return dict(
+            (pct, latencies[min(len(latencies) - 1,
+                int(len(latencies) * pct / 100.0))] * 1000) \
+            for pct in pcts)
+
+    def report(self):
+        return dict(
+            requests=self.requests, errors=self.errors,
+            latency_ms=dict(
+                ('max' if pct == 100 else 'p{}'.format(pct), ms) \
+                for pct, ms in self.percentiles().items()))
+
+
+# Query parameters of conversion requests: (Ttml2Srt argument, type)
+SERVER_PARAMS = {
+    'shift': ('shift', int),
+    'fps': ('source_fps', float),
+    't-dur': ('target_duration', float),
+    's-dur': ('source_duration', float),
+    'parser': ('parser', str),
+    'overlap': ('overlap', str),
+    'whitespace': ('whitespace', str),
+}
+
+
+def make_server(address, jobs=1, **kwargs):
+    """Return an HTTP server converting TTML documents POSTed to it to SRT.
+
+    `address` is a Unix socket path or a (host, port) tuple. Keyword
+    arguments are defaults for :class:`Ttml2Srt`, overridden per request
+    by the query parameters in :data:`SERVER_PARAMS`. ``GET /stats``
+    returns request counts and latency percentiles as JSON.
+
+    With `jobs` other than 1, conversions run on a pool of that many
+    worker processes (0 for one per CPU), started along with the server.
+    Otherwise they run in request threads and SRT is sent back in chunks
+    as it is converted.
+
+    Call ``server_close()`` to stop the pool.
+    """
+
+    import json
+
+    try:
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        from socketserver import ThreadingMixIn, UnixStreamServer
+        from urllib.parse import urlsplit, parse_qsl
+    except ImportError:
+        from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+        from SocketServer import ThreadingMixIn, UnixStreamServer
+        from urlparse import urlsplit, parse_qsl
+
+    class Handler(BaseHTTPRequestHandler):
+
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_body(self, status, body, content_type):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_error_text(self, status, message):
+            self.send_body(status, (message + '\n').encode('utf-8'),
+                'text/plain; charset=utf-8')
+
+        def do_GET(self):
+            if urlsplit(self.path).path != '/stats':
+                return self.send_error_text(404, 'Not found')
+            self.send_body(200,
+                json.dumps(self.server.latencies.report()).encode('utf-8'),
+                'application/json')
+
+        def do_POST(self):
+            started = _clock()
+            error = True
+            try:
+                error = self.convert()
+            finally:
+                self.server.latencies.add(_clock() - started, error)
+
+        def convert(self):
+            """Serve a conversion request, returning True on failure
+            """
+
+            data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+            options = dict(self.server.defaults)
+            try:
+                for name, value in parse_qsl(urlsplit(self.path).query):
+                    if name not in SERVER_PARAMS:
+                        raise ValueError('unknown parameter "{}"'.format(name))
+                    option, convert = SERVER_PARAMS[name]
+                    options[option] = convert(value)
+            except ValueError as e:
+                self.send_error_text(400, str(e))
+                return True
+
+            pool = self.server.pool
+            try:
+                if pool is not None:
+                    srt = pool.apply(_convert_for_server, ((data, options),))
+                    self.send_body(200, srt, 'text/srt; charset=utf-8')
+                    return False
+                ttml = Ttml2Srt(io.BytesIO(data), **options)
+                chunks = ttml.srt_chunks(ttml.iter_paragraphs())
+                first = next(chunks, None)
+            except Exception as e:
+                self.send_error_text(422, '{}: {}'.format(type(e).__name__, e))
+                return True
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/srt; charset=utf-8')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            try:
+                while first is not None:
+                    chunk = first[1].encode('utf-8')
+                    self.wfile.write(
+                        '{:x}\r\n'.format(len(chunk)).encode('ascii') + \
+                        chunk + b'\r\n')
+                    first = next(chunks, None)
+            except Exception:
+                # Too late for an error status; an unterminated chunked
+                # body tells the client the response is incomplete
+                self.close_connection = True
+                return True
+            self.wfile.write(b'0\r\n\r\n')
+            return False
+
+    if isinstance(address, tuple):
+        base = HTTPServer
+    else:
+        class base(UnixStreamServer):
+            def get_request(self):
+                # BaseHTTPRequestHandler expects an address tuple
+                request, _address = UnixStreamServer.get_request(self)
+                return request, ('local', 0)
+
+    class Server(ThreadingMixIn, base):
+
+        daemon_threads = True
+
+        def handle_error(self, request, client_address):
+            # Clients going away mid-request aren't worth a traceback
+            if not isinstance(sys.exc_info()[1], (IOError, OSError)):
+                base.handle_error(self, request, client_address)
+
+        def server_close(self):
+            base.server_close(self)
+            if self.pool is not None:
+                self.pool.close()
+                self.pool.join()
+            if not isinstance(self.server_address, tuple):
+                try:
+                    os.unlink(self.server_address)
+                except OSError:
+                    pass
+
+    if not isinstance(address, tuple) and os.path.exists(address):
+        os.unlink(address)
+
+    server = Server(address, Handler)
+    server.defaults = kwargs
+    server.latencies = RequestLatencies()
+    server.pool = None
+    if jobs != 1:
+        import multiprocessing
+        server.pool = multiprocessing.Pool(jobs or None, _init_server_worker)
+    return server
+
+
+def run_serve(argv):
+    """Entry point of the serve command
+    """
+
+    import argparse
+    import json
+    import signal
+
+    argparser = argparse.ArgumentParser(
+        prog='ttml2srt.py serve',
+        description='Convert TTML documents POSTed over HTTP to SubRip (SRT).',
+        epilog='Query parameters {} override the conversion options per '
+            'request. GET /stats reports latency percentiles.'.format(
+                ', '.join(sorted(SERVER_PARAMS))))
+    argparser.add_argument('--socket',
+        dest='socket', metavar='path',
+        help='listen on a Unix socket instead of TCP',
+        action='store')
+    argparser.add_argument('--host',
+        dest='host', metavar='host',
+        help='address to listen on (default: 127.0.0.1)',
+        default='127.0.0.1', action='store')
+    argparser.add_argument('-p', '--port',
+        dest='port', metavar='port',
+        help='TCP port to listen on (default: 8087)',
+        type=int, default=8087, action='store')
+    argparser.add_argument('-j', '--jobs',
+        dest='jobs', metavar='N',
+        help='number of worker processes, 0 for one per CPU; 1 converts in '
+            'the server process and streams SRT back (default: 1)',
+        type=int, default=1, action='store')
+    _add_conversion_args(argparser)
+    args = argparser.parse_args(argv)
+
+    address = args.socket or (args.host, args.port)
+    server = make_server(address, args.jobs, **_conversion_kwargs(args))
+    sys.stderr.write('Listening on {}\n'.format(
+        args.socket or 'http://{}:{}/'.format(*server.server_address[:2])))
+
+    # Shut down as on ^C
+    signal.signal(signal.SIGTERM, lambda *_args: sys.exit(0))
 
     try:
-        ttml.write2file(getattr(args, 'output-file') or '-')
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        server.server_close()
+        sys.stderr.write(json.dumps(server.latencies.report()) + '\n')
+
+    return 0
+
+
+if __name__ == '__main__':
+
+    if sys.argv[1:2] == ['batch']:
+        sys.exit(run_batch(sys.argv[2:]))
+    if sys.argv[1:2] == ['cache-stats']:
+        sys.exit(run_cache_stats(sys.argv[2:]))
+    if sys.argv[1:2] == ['serve']:
+        sys.exit(run_serve(sys.argv[2:]))
+    if sys.argv[1:2] == ['segments']:
+        sys.exit(run_segments(sys.argv[2:]))
+
+    try:
+        BrokenPipeError
+    except NameError:
+        BrokenPipeError = IOError
+
+    # Plain `ttml-file [output-file]` calls skip argparse
+    args = _parse_plain_args(sys.argv[1:])
+
+    if args is None:
+        import argparse
+
+        argparser = argparse.ArgumentParser(
+            description='Convert TTML document to SubRip (SRT).',
+            epilog='Run "%(prog)s batch -h" for converting many files at '
+                'once, "%(prog)s segments -h" for titles split into segment '
+                'documents, "%(prog)s serve -h" for running a conversion '
+                'server and "%(prog)s cache-stats dir" to inspect a '
+                '--cache-dir.')
+        argparser.add_argument('ttml-file',
+            help='TTML subtitle file',
+            action='store')
+        argparser.add_argument('output-file',
+            nargs='?',
+            help='file to write resulting SRT to; with several --formats, '
+                'the name the other files are named after',
+            action='store')
+        _add_formats_arg(argparser)
+        _add_conversion_args(argparser)
+        _add_stats_arg(argparser)
+        args = argparser.parse_args()
+
+        if len(args.formats) > 1 and getattr(args, 'output-file') in (None, '-'):
+            argparser.error('several --formats need an output-file')
+
+    stats = ConversionStats() if args.stats else None
+
+    ttml = Ttml2Srt(getattr(args, 'ttml-file'), stats=stats,
+        **_conversion_kwargs(args))
+
+    output = getattr(args, 'output-file') or '-'
+
+    try:
+        if args.formats == ['srt']:
+            ttml.write2file(output)
+        elif len(args.formats) == 1:
+            ttml.write_formats([(args.formats[0], output)])
+        else:
+            ttml.write_formats(_format_outputs(output, args.formats))
     except BrokenPipeError:
         pass
+
+    if stats is not None:
+        sys.stderr.write(stats.report())
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""asyncio front end to ttml2srt (Python 3.7+)
+
+Parsing and conversion are CPU-bound and run on an executor, a slice of
+paragraphs at a time, so the event loop stays responsive while many
+documents are converted at once:
+
+    srt = await convert_async(source, shift=2000)
+
+    converter = AsyncConverter(max_concurrency=4)
+    async for begin, end, dialogue in converter.iter_paragraphs(source):
+        ...
+
+`source` can be anything Ttml2Srt() takes (path, binary file-like), bytes,
+an async byte stream with a coroutine `read(n)` (asyncio.StreamReader,
+aiofiles, ...) or an async iterable of bytes chunks.
+"""
+
+import asyncio
+import concurrent.futures
+import inspect
+import io
+import itertools
+
+from ttml2srt import Ttml2Srt, OUTPUT_CHUNK_SIZE
+
+# Bytes requested per read() of async byte streams
+READ_SIZE = 64 * 1024
+
+
+async def read_source(source):
+    """Return `source` ready to be passed to Ttml2Srt(), reading async
+    byte streams into memory without blocking the loop
+    """
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+
+    if hasattr(source, '__aiter__'):
+        return io.BytesIO(b''.join([chunk async for chunk in source]))
+
+    read = getattr(source, 'read', None)
+    if read is not None and inspect.iscoroutinefunction(read):
+        chunks = []
+        while True:
+            chunk = await read(READ_SIZE)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return io.BytesIO(b''.join(chunks))
+
+    return source
+
+
+# Executor jobs are module-level functions so process pools can pickle them
+
+def _load(source, kwargs):
+    return Ttml2Srt(source, **kwargs)
+
+
+def _convert(source, kwargs):
+    # Whole conversion in one go, for process pools
+    return Ttml2Srt(source, **kwargs).paragraphs()
+
+
+def _to_paragraphs(source, kwargs):
+    # All paragraphs in one go, for process pools
+    return Ttml2Srt(source, **kwargs).to_paragraphs()
+
+
+def _take(iterator, count):
+    return list(itertools.islice(iterator, count))
+
+
+class AsyncConverter(object):
+    """Convert TTML documents on `executor` (the loop's default executor
+    when None), with at most `max_concurrency` conversion steps submitted
+    at a time.
+
+    `kwargs` are default Ttml2Srt() options, overridable per call.
+
+    Cancelling a conversion stops it once the slice of work in progress on
+    the executor is done. With a ProcessPoolExecutor, conversions run in
+    one piece and are only cancellable before they start; `source` has to
+    be a path, bytes or an async byte stream then.
+    """
+
+    def __init__(self, executor=None, max_concurrency=None, **kwargs):
+        self.executor = executor
+        self.max_concurrency = max_concurrency
+        self.kwargs = kwargs
+        self._semaphore = None
+
+    def _options(self, kwargs):
+        options = dict(self.kwargs)
+        options.update(kwargs)
+        return options
+
+    def _in_process_pool(self):
+        return isinstance(
+            self.executor, concurrent.futures.ProcessPoolExecutor)
+
+    async def _pool_source(self, source):
+        # Sources sent to another process as bytes rather than file objects
+        source = await read_source(source)
+        if isinstance(source, io.BytesIO):
+            source = source.getvalue()
+        return source
+
+    async def _run(self, fn, *args):
+        if self.max_concurrency and self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        loop = asyncio.get_running_loop()
+
+        if self._semaphore is None:
+            return await loop.run_in_executor(self.executor, fn, *args)
+
+        async with self._semaphore:
+            return await loop.run_in_executor(self.executor, fn, *args)
+
+    async def load(self, source, **kwargs):
+        """Return a Ttml2Srt instance for `source`
+        """
+
+        if self._in_process_pool():
+            source = await self._pool_source(source)
+        else:
+            source = await read_source(source)
+        return await self._run(_load, source, self._options(kwargs))
+
+    async def convert(self, source, **kwargs):
+        """Return the SRT of `source`
+        """
+
+        if self._in_process_pool():
+            source = await self._pool_source(source)
+            return await self._run(_convert, source, self._options(kwargs))
+
+        ttml = await self.load(source, **kwargs)
+        chunks = ttml.srt_chunks(await self._run(ttml.iter_paragraphs))
+
+        srt = []
+        while True:
+            chunk = await self._run(next, chunks, None)
+            if chunk is None:
+                return ''.join(srt)
+            srt.append(chunk[1])
+
+    async def iter_paragraphs(self, source, batch_size=OUTPUT_CHUNK_SIZE,
+            **kwargs):
+        """Yield (begin, end, dialogue) tuples of `source` with SubRip
+        timestamps, converting `batch_size` paragraphs per executor job
+        (all of them in one job on a process pool)
+        """
+
+        if self._in_process_pool():
+            source = await self._pool_source(source)
+            for paragraph in await self._run(
+                    _to_paragraphs, source, self._options(kwargs)):
+                yield paragraph
+            return
+
+        ttml = await self.load(source, **kwargs)
+        paragraphs = await self._run(ttml.iter_paragraphs)
+
+        while True:
+            batch = await self._run(_take, paragraphs, batch_size)
+            if not batch:
+                return
+            for paragraph in batch:
+                yield paragraph
+
+
+async def convert_async(source, executor=None, **kwargs):
+    """Return the SRT of `source`, converted on `executor`
+    """
+
+    return await AsyncConverter(executor).convert(source, **kwargs)
+
+
+def iter_paragraphs_async(source, executor=None, **kwargs):
+    """Async iterator over the (begin, end, dialogue) tuples of `source`
+    """
+
+    return AsyncConverter(executor).iter_paragraphs(source, **kwargs)